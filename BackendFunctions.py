@@ -0,0 +1,560 @@
+# Geometry backend functions
+# --------------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# The geoprocessing calls used most in the merge and scoring scripts, behind one interface with two implementations:
+# - ArcpyBackend calls the ArcGIS tools (Clip_analysis, Union_analysis, Eliminate_management etc.) as the scripts do now.
+# - OpenBackend does the same operations with shapely (GEOS) in memory, reading and writing GeoPackages or file gdbs with pyogrio,
+#   so the pipeline can run on Linux machines without ArcGIS, and be checked in CI (run this file to check it).
+# get_backend() returns the arcpy backend when arcpy can be imported, or the open backend otherwise. Set the environment variable
+# NATCAP_BACKEND to "arcpy" or "open" to choose.
+# Datasets are named as in arcpy: a name in the workspace, a full path (e.g. D:\LADs\Oxford.gdb\OSMM or D:\LADs\Oxford.gpkg\OSMM),
+# or "in_memory\name" for an intermediate dataset kept in memory.
+# Overlay outputs follow the ArcGIS conventions: FID_<input> fields, _1 suffixes for duplicate field names, -1 / 0 / '' for the
+# attributes of the input that a Union or Identity piece does not overlap.
+# Differences from the ArcGIS tools in OpenBackend: no cluster tolerance (the cluster_tolerance argument of clip, erase, intersect,
+# union and identity is passed to ArcGIS by ArcpyBackend but ignored here: coordinates are not snapped or cracked), and Union and
+# Identity do not split overlapping polygons within the same input (the OSMM base map and the preprocessed inputs do not overlap).
+# -----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import numpy as np
+try:
+    import shapely
+except ImportError:
+    # Only OpenBackend needs shapely 2.0; ArcpyBackend also runs in ArcMap (Python 2)
+    shapely = None
+import MergeFunctions
+import RuleFunctions
+
+
+def get_backend(workspace=None, name=None):
+    # The backend to use: name ("arcpy" or "open"), else the NATCAP_BACKEND environment variable, else arcpy if it is installed
+    if name is None:
+        name = os.environ.get("NATCAP_BACKEND")
+    if name is None:
+        try:
+            import arcpy
+            name = "arcpy"
+        except ImportError:
+            name = "open"
+    if name == "arcpy":
+        return ArcpyBackend(workspace)
+    elif name == "open":
+        return OpenBackend(workspace)
+    raise ValueError("Backend must be arcpy or open, not " + str(name))
+
+
+class ArcpyBackend(object):
+    # Thin wrapper around the ArcGIS tools, with the same arguments as OpenBackend
+
+    def __init__(self, workspace=None):
+        import arcpy
+        self.arcpy = arcpy
+        self.num_layers = 0
+        if workspace is not None:
+            arcpy.env.workspace = workspace
+
+    def layer_name(self, prefix):
+        # A new name for each temporary layer or view, so they cannot clash with the fixed names used in the scripts
+        self.num_layers = self.num_layers + 1
+        return prefix + "_backend" + str(self.num_layers)
+
+    def delete(self, name):
+        self.arcpy.Delete_management(name)
+
+    def exists(self, name):
+        return self.arcpy.Exists(name)
+
+    def get_count(self, in_table):
+        return int(self.arcpy.GetCount_management(in_table).getOutput(0))
+
+    def copy(self, in_features, out_features):
+        self.arcpy.CopyFeatures_management(in_features, out_features)
+
+    def delete_rows(self, in_features, expression):
+        # Delete the features selected by expression
+        layer = self.layer_name("del_lyr")
+        self.arcpy.MakeFeatureLayer_management(in_features, layer)
+        self.arcpy.SelectLayerByAttribute_management(layer, "NEW_SELECTION", expression)
+        self.arcpy.DeleteFeatures_management(layer)
+        self.arcpy.Delete_management(layer)
+
+    def clip(self, in_features, clip_features, out_features, cluster_tolerance=None):
+        self.arcpy.Clip_analysis(in_features, clip_features, out_features, cluster_tolerance or "")
+
+    def erase(self, in_features, erase_features, out_features, cluster_tolerance=None):
+        self.arcpy.Erase_analysis(in_features, erase_features, out_features, cluster_tolerance or "")
+
+    def intersect(self, in_features, out_features, cluster_tolerance=None):
+        self.arcpy.Intersect_analysis(in_features, out_features, "ALL", cluster_tolerance or "")
+
+    def union(self, in_features, out_features, cluster_tolerance=None):
+        self.arcpy.Union_analysis(in_features, out_features, "ALL", cluster_tolerance or "")
+
+    def identity(self, in_features, identity_features, out_features, cluster_tolerance=None):
+        self.arcpy.Identity_analysis(in_features, identity_features, out_features, "ALL", cluster_tolerance or "")
+
+    def dissolve(self, in_features, out_features, dissolve_fields=None, multi_part=True):
+        self.arcpy.Dissolve_management(in_features, out_features, dissolve_fields or "", "",
+                                       "MULTI_PART" if multi_part else "SINGLE_PART")
+
+    def multipart_to_singlepart(self, in_features, out_features):
+        self.arcpy.MultipartToSinglepart_management(in_features, out_features)
+
+    def delete_identical(self, in_table, fields):
+        self.arcpy.DeleteIdentical_management(in_table, fields)
+
+    def eliminate(self, in_features, out_features, expression):
+        # Merge the polygons selected by expression into the neighbour with the longest shared boundary
+        layer = self.layer_name("elim_lyr")
+        self.arcpy.MakeFeatureLayer_management(in_features, layer)
+        self.arcpy.SelectLayerByAttribute_management(layer, "NEW_SELECTION", expression)
+        self.arcpy.Eliminate_management(layer, out_features, "LENGTH")
+        self.arcpy.Delete_management(layer)
+
+    def tabulate_intersection(self, zone_features, zone_fields, class_features, out_table, class_fields):
+        self.arcpy.TabulateIntersection_analysis(zone_features, zone_fields, class_features, out_table, class_fields)
+
+    def join_field(self, in_table, key_field, join_table, join_key, join_value_field, out_field):
+        # AddJoin / CalculateField / RemoveJoin: copies join_value_field into out_field for rows with a matching key
+        join_name = os.path.basename(join_table)
+        view = self.layer_name("join_view")
+        self.arcpy.MakeTableView_management(in_table, view)
+        self.arcpy.AddJoin_management(view, key_field, join_table, join_key, "KEEP_COMMON")
+        self.arcpy.CalculateField_management(view, os.path.basename(in_table) + "." + out_field,
+                                             "!" + join_name + "." + join_value_field + "!", "PYTHON_9.3")
+        self.arcpy.RemoveJoin_management(view, join_name)
+        self.arcpy.Delete_management(view)
+
+    def calculate_field(self, in_table, field, expression, codeblock=None):
+        self.arcpy.CalculateField_management(in_table, field, expression, "PYTHON_9.3", codeblock or "")
+
+
+class Layer(object):
+    # A feature class or table held in memory by OpenBackend: shapely geometries (None for a table), a dictionary of numpy
+    # arrays with the field names in order, object IDs and the coordinate system (WKT)
+
+    def __init__(self, geoms, columns, fields, oids=None, crs=None):
+        self.geoms = None if geoms is None else np.asarray(geoms, dtype=object)
+        self.columns = columns
+        self.fields = list(fields)
+        if oids is None:
+            oids = np.arange(1, self.count() + 1)
+        self.oids = np.asarray(oids)
+        self.crs = crs
+
+    def count(self):
+        if self.geoms is not None:
+            return len(self.geoms)
+        return len(self.columns[self.fields[0]]) if self.fields else 0
+
+    def take(self, index):
+        # New layer with the rows in index (an array of row numbers or a boolean mask)
+        geoms = None if self.geoms is None else self.geoms[index]
+        columns = dict((field, self.columns[field][index]) for field in self.fields)
+        return Layer(geoms, columns, self.fields, self.oids[index], self.crs)
+
+
+def blank_values(values, num_rows):
+    # Values given by ArcGIS Union and Identity to the attributes of an input that does not overlap a piece: '' for text, 0 for numbers
+    values = np.asarray(values)
+    if values.dtype.kind in "OSU":
+        return np.array([""] * num_rows, dtype=object)
+    return np.zeros(num_rows, dtype=values.dtype)
+
+
+def geometry_dimension(geoms):
+    # Highest dimension of a set of geometries: 0 points, 1 lines, 2 polygons
+    dimensions = shapely.get_dimensions(geoms[~shapely.is_missing(geoms)])
+    return int(dimensions.max()) if len(dimensions) > 0 else 2
+
+
+def keep_dimension(geoms, dimension):
+    # Overlay results can be geometry collections with parts of lower dimension (e.g. the line where two polygons touch).
+    # Keep only the parts of the given dimension as multipart geometries, as the ArcGIS tools do. None if nothing is left.
+    parts, index = shapely.get_parts(geoms, return_index=True)
+    # Collections can contain multipart geometries, so split twice
+    parts, sub_index = shapely.get_parts(parts, return_index=True)
+    index = index[sub_index]
+    keep = (shapely.get_dimensions(parts) == dimension) & ~shapely.is_empty(parts)
+    constructors = {0: shapely.multipoints, 1: shapely.multilinestrings, 2: shapely.multipolygons}
+    out = np.full(len(geoms), None, dtype=object)
+    if keep.any():
+        constructors[dimension](parts[keep], indices=index[keep], out=out)
+    return out
+
+
+def covering_geometries(geoms, others):
+    # For each geometry, the union of the other geometries that intersect it (None if there are none), found with an STRtree.
+    # Also returns the intersecting pairs.
+    tree = shapely.STRtree(others)
+    geom_index, other_index = tree.query(geoms, predicate="intersects")
+    covers = np.full(len(geoms), None, dtype=object)
+    if len(geom_index) > 0:
+        starts = np.flatnonzero(np.r_[True, geom_index[1:] != geom_index[:-1]])
+        stops = np.r_[starts[1:], len(geom_index)]
+        for start, stop in zip(starts, stops):
+            covers[geom_index[start]] = shapely.union_all(others[other_index[start:stop]])
+    return covers, geom_index, other_index
+
+
+def combine_layers(layers, names, indexes, geoms, crs):
+    # Output layer of an overlay: FID_<name> and the fields of each input, taken from rows indexes[i] of layers[i] (-1 for no row)
+    columns = {}
+    fields = []
+    for layer, name, index in zip(layers, names, indexes):
+        missing = index < 0
+        safe_index = np.where(missing, 0, index)
+        fid_field = "FID_" + name
+        columns[fid_field] = np.where(missing, -1, layer.oids[safe_index] if layer.count() > 0 else -1)
+        fields.append(fid_field)
+        for field in layer.fields:
+            out_field = field
+            while out_field in columns:
+                out_field = out_field + "_1"
+            if layer.count() > 0:
+                values = layer.columns[field][safe_index]
+                if missing.any():
+                    values = values.astype(object) if values.dtype.kind in "OSU" else values.copy()
+                    values[missing] = blank_values(values, int(missing.sum()))
+            else:
+                values = blank_values(layer.columns[field], len(index))
+            columns[out_field] = values
+            fields.append(out_field)
+    return Layer(geoms, columns, fields, crs=crs)
+
+
+class OpenBackend(object):
+    # shapely / pyogrio implementation. Layers are read from disk when used and written when created, apart from in_memory ones.
+
+    def __init__(self, workspace=None):
+        self.workspace = workspace
+        self.memory = {}
+
+    # Reading and writing
+    # -------------------
+    def is_memory(self, name):
+        return name.lower().replace("/", "\\").startswith(("in_memory\\", "memory\\"))
+
+    def locate(self, name):
+        # Data source and layer name for a dataset name, as with arcpy paths (a gdb or GeoPackage path followed by the layer name)
+        folder, layer = os.path.split(name)
+        if folder.lower().endswith((".gdb", ".gpkg")):
+            return folder, layer
+        if folder:
+            # A single-layer file such as a shapefile
+            return name, None
+        return self.workspace, name
+
+    def exists(self, name):
+        if self.is_memory(name):
+            return name.lower() in self.memory
+        import pyogrio
+        path, layer = self.locate(name)
+        if not os.path.exists(path):
+            return False
+        return layer is None or layer in [info[0] for info in pyogrio.list_layers(path)]
+
+    def read(self, name):
+        if self.is_memory(name):
+            return self.memory[name.lower()]
+        import pyogrio.raw
+        path, layer = self.locate(name)
+        meta, fids, wkbs, field_data = pyogrio.raw.read(path, layer=layer, return_fids=True)
+        fields = list(meta["fields"])
+        columns = dict(zip(fields, field_data))
+        geoms = None if wkbs is None else shapely.from_wkb(wkbs)
+        if fids is None or len(fids) == 0:
+            fids = None
+        return Layer(geoms, columns, fields, fids, meta.get("crs"))
+
+    def write(self, name, layer):
+        if self.is_memory(name):
+            self.memory[name.lower()] = layer
+            return
+        import pyogrio.raw
+        path, layer_name = self.locate(name)
+        field_data = []
+        for field in layer.fields:
+            values = np.asarray(layer.columns[field])
+            field_data.append(values.astype(object) if values.dtype.kind in "SU" else values)
+        wkbs = None
+        geometry_type = None
+        if layer.geoms is not None:
+            wkbs = shapely.to_wkb(layer.geoms)
+            geometry_type = {0: "MultiPoint", 1: "MultiLineString", 2: "MultiPolygon"}[geometry_dimension(layer.geoms)]
+            # Single part outputs (e.g. from MultipartToSinglepart) keep single part types
+            types = shapely.get_type_id(layer.geoms[~shapely.is_missing(layer.geoms)])
+            if len(types) > 0 and (types == types[0]).all() and types[0] in (0, 1, 3):
+                geometry_type = {0: "Point", 1: "LineString", 3: "Polygon"}[int(types[0])]
+        options = {"OVERWRITE": "YES"} if path.lower().endswith(".gpkg") else None
+        pyogrio.raw.write(path, wkbs, field_data, layer.fields, layer=layer_name, geometry_type=geometry_type, crs=layer.crs,
+                          layer_options=options)
+
+    def delete(self, name):
+        if self.is_memory(name):
+            self.memory.pop(name.lower(), None)
+            return
+        if not self.exists(name):
+            return
+        path, layer_name = self.locate(name)
+        if layer_name is None:
+            os.remove(path)
+        else:
+            # pyogrio cannot delete one layer of a multi-layer data source
+            raise NotImplementedError("The open backend cannot delete " + name + ": delete it with GDAL or ArcGIS")
+
+    # Tools
+    # -----
+    def get_count(self, in_table):
+        return self.read(in_table).count()
+
+    def copy(self, in_features, out_features):
+        layer = self.read(in_features)
+        self.write(out_features, layer.take(np.ones(layer.count(), dtype=bool)))
+
+    def selected(self, layer, expression):
+        # Boolean array of the rows selected by an SQL where clause
+        predicate, expression_fields = RuleFunctions.compile_where(expression)
+        names = dict((field.lower(), field) for field in layer.fields)
+        values = [layer.columns[names[field]].tolist() for field in expression_fields]
+        return np.array([predicate(dict(zip(expression_fields, row))) for row in zip(*values)], dtype=bool).reshape(-1)
+
+    def delete_rows(self, in_features, expression):
+        layer = self.read(in_features)
+        self.write(in_features, layer.take(~self.selected(layer, expression)))
+
+    def clip(self, in_features, clip_features, out_features, cluster_tolerance=None):
+        layer = self.read(in_features)
+        covers, geom_index, other_index = covering_geometries(layer.geoms, self.read(clip_features).geoms)
+        has_cover = np.flatnonzero(covers != None)
+        geoms = np.full(layer.count(), None, dtype=object)
+        geoms[has_cover] = keep_dimension(shapely.intersection(layer.geoms[has_cover], covers[has_cover]), geometry_dimension(layer.geoms))
+        keep = geoms != None
+        out = layer.take(keep)
+        out.geoms = geoms[keep]
+        self.write(out_features, out)
+
+    def erase(self, in_features, erase_features, out_features, cluster_tolerance=None):
+        layer = self.read(in_features)
+        geoms = self.difference(layer, self.read(erase_features).geoms)
+        keep = geoms != None
+        out = layer.take(keep)
+        out.geoms = geoms[keep]
+        self.write(out_features, out)
+
+    def difference(self, layer, others):
+        # Part of each geometry not covered by the others (None if nothing is left)
+        covers, geom_index, other_index = covering_geometries(layer.geoms, others)
+        has_cover = np.flatnonzero(covers != None)
+        geoms = layer.geoms.copy()
+        geoms[has_cover] = shapely.difference(layer.geoms[has_cover], covers[has_cover])
+        return keep_dimension(geoms, geometry_dimension(layer.geoms))
+
+    def overlay(self, in_features, keep_first=False, keep_second=False):
+        # Pieces of the overlay of two layers: the intersecting pairs, plus (for Identity and Union) the parts of the first input
+        # outside the second, plus (for Union) the parts of the second outside the first
+        if len(in_features) != 2:
+            raise ValueError("The open backend overlays two inputs at a time, not " + str(len(in_features)))
+        first = self.read(in_features[0])
+        second = self.read(in_features[1])
+        dimension = min(geometry_dimension(first.geoms), geometry_dimension(second.geoms))
+        tree = shapely.STRtree(second.geoms)
+        first_index, second_index = tree.query(first.geoms, predicate="intersects")
+        geoms = keep_dimension(shapely.intersection(first.geoms[first_index], second.geoms[second_index]), dimension)
+        pieces = [(geoms, first_index, second_index)]
+        if keep_first:
+            geoms = self.difference(first, second.geoms)
+            pieces.append((geoms, np.arange(first.count()), np.full(first.count(), -1)))
+        if keep_second:
+            geoms = self.difference(second, first.geoms)
+            pieces.append((geoms, np.full(second.count(), -1), np.arange(second.count())))
+        geoms = np.concatenate([piece[0] for piece in pieces])
+        first_index = np.concatenate([piece[1] for piece in pieces]).astype(np.int64)
+        second_index = np.concatenate([piece[2] for piece in pieces]).astype(np.int64)
+        keep = geoms != None
+        names = [os.path.basename(name.replace("\\", "/")) for name in in_features]
+        return combine_layers([first, second], names, [first_index[keep], second_index[keep]], geoms[keep], first.crs)
+
+    def intersect(self, in_features, out_features, cluster_tolerance=None):
+        self.write(out_features, self.overlay(in_features))
+
+    def union(self, in_features, out_features, cluster_tolerance=None):
+        self.write(out_features, self.overlay(in_features, keep_first=True, keep_second=True))
+
+    def identity(self, in_features, identity_features, out_features, cluster_tolerance=None):
+        self.write(out_features, self.overlay([in_features, identity_features], keep_first=True))
+
+    def dissolve(self, in_features, out_features, dissolve_fields=None, multi_part=True):
+        layer = self.read(in_features)
+        if isinstance(dissolve_fields, str):
+            dissolve_fields = dissolve_fields.split(";")
+        dissolve_fields = dissolve_fields or []
+        groups = {}
+        keys = zip(*[layer.columns[field].tolist() for field in dissolve_fields]) if dissolve_fields else [()] * layer.count()
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+        geoms = np.array([shapely.union_all(layer.geoms[rows]) for rows in groups.values()], dtype=object)
+        first_rows = np.array([rows[0] for rows in groups.values()], dtype=np.int64)
+        columns = dict((field, layer.columns[field][first_rows]) for field in dissolve_fields)
+        out = Layer(geoms, columns, dissolve_fields, crs=layer.crs)
+        if not multi_part:
+            out = self.explode(out)
+            del out.columns["ORIG_FID"]
+            out.fields.remove("ORIG_FID")
+        self.write(out_features, out)
+
+    def explode(self, layer):
+        parts, index = shapely.get_parts(layer.geoms, return_index=True)
+        out = layer.take(index)
+        out.geoms = parts
+        out.columns["ORIG_FID"] = layer.oids[index]
+        out.fields.append("ORIG_FID")
+        out.oids = np.arange(1, len(parts) + 1)
+        return out
+
+    def multipart_to_singlepart(self, in_features, out_features):
+        self.write(out_features, self.explode(self.read(in_features)))
+
+    def delete_identical(self, in_table, fields):
+        # Deletes all but the first of each set of rows with the same values in fields ("Shape" compares the geometries)
+        layer = self.read(in_table)
+        key_columns = []
+        for field in fields:
+            if field.lower() == "shape":
+                key_columns.append(shapely.to_wkb(shapely.normalize(layer.geoms)).tolist())
+            else:
+                key_columns.append(layer.columns[field].tolist())
+        seen = set()
+        keep = np.zeros(layer.count(), dtype=bool)
+        for i, key in enumerate(zip(*key_columns)):
+            if key not in seen:
+                seen.add(key)
+                keep[i] = True
+        self.write(in_table, layer.take(keep))
+        return int((~keep).sum())
+
+    def eliminate(self, in_features, out_features, expression):
+        layer = self.read(in_features)
+        slivers = self.selected(layer, expression)
+        geoms, absorbed = MergeFunctions.eliminate_slivers(layer.geoms, slivers)
+        out = layer.take(~absorbed)
+        out.geoms = geoms[~absorbed]
+        self.write(out_features, out)
+
+    def tabulate_intersection(self, zone_features, zone_fields, class_features, out_table, class_fields):
+        zones = self.read(zone_features)
+        classes = self.read(class_features)
+        zone_index, class_index, area, percentage = MergeFunctions.tabulate_intersection(zones.geoms, classes.geoms)
+        # Duplicate field names in the class table get a suffix of _1, as they do in the ArcGIS tool
+        columns = {}
+        fields = []
+        for field in zone_fields:
+            columns[field] = zones.columns[field][zone_index]
+            fields.append(field)
+        for field in class_fields:
+            out_field = field + "_1" if field in fields else field
+            columns[out_field] = classes.columns[field][class_index]
+            fields.append(out_field)
+        columns["AREA"] = area
+        columns["PERCENTAGE"] = percentage
+        self.write(out_table, Layer(None, columns, fields + ["AREA", "PERCENTAGE"]))
+
+    def join_field(self, in_table, key_field, join_table, join_key, join_value_field, out_field):
+        # As AddJoin / CalculateField: the first matching row of the join table is used for each key
+        layer = self.read(in_table)
+        join_layer = self.read(join_table)
+        lookup = {}
+        for key, value in zip(join_layer.columns[join_key].tolist(), join_layer.columns[join_value_field].tolist()):
+            if key not in lookup:
+                lookup[key] = value
+        values = layer.columns[out_field].astype(object) if out_field in layer.columns else np.full(layer.count(), None, dtype=object)
+        for i, key in enumerate(layer.columns[key_field].tolist()):
+            if key in lookup:
+                values[i] = lookup[key]
+        self.set_column(layer, out_field, values)
+        self.write(in_table, layer)
+
+    def calculate_field(self, in_table, field, expression, codeblock=None):
+        # CalculateField with a PYTHON_9.3 expression: each !field! is replaced by the row value; code block functions can be used
+        layer = self.read(in_table)
+        names = dict((name.lower(), name) for name in layer.fields)
+        code = RuleFunctions.field_reference.sub(lambda match: "row[" + repr(names[match.group(1).lower()]) + "]", str(expression))
+        namespace = {}
+        if codeblock:
+            exec(codeblock, namespace)
+        compiled = compile(code, "<expression>", "eval")
+        values = []
+        for i in range(layer.count()):
+            row = dict((name, layer.columns[name][i]) for name in layer.fields)
+            values.append(eval(compiled, namespace, {"row": row}))
+        self.set_column(layer, field, np.array(values, dtype=object))
+        self.write(in_table, layer)
+
+    def set_column(self, layer, field, values):
+        # Keep the type of an existing numeric field
+        if field in layer.columns and layer.columns[field].dtype.kind in "iuf":
+            values = np.array([0 if value is None else value for value in values]).astype(layer.columns[field].dtype)
+        layer.columns[field] = values
+        if field not in layer.fields:
+            layer.fields.append(field)
+
+
+def check_backend():
+    # Checks the open backend on a small example: two overlapping squares in A, one square across both in B. Prints and returns
+    # the number of failed checks.
+    backend = OpenBackend()
+    a = Layer(shapely.box([0, 10], [0, 0], [10, 20], [10, 10]), {"Hab": np.array(["Grass", "Wood"], dtype=object)}, ["Hab"])
+    b = Layer(np.array([shapely.box(5, 0, 15, 10)], dtype=object), {"Desig": np.array(["SSSI"], dtype=object)}, ["Desig"])
+    backend.write("in_memory\\A", a)
+    backend.write("in_memory\\B", b)
+    checks = []
+    backend.clip("in_memory\\A", "in_memory\\B", "in_memory\\clip")
+    checks.append(("clip area", shapely.area(backend.read("in_memory\\clip").geoms).sum(), 100.0))
+    backend.erase("in_memory\\A", "in_memory\\B", "in_memory\\erase")
+    checks.append(("erase area", shapely.area(backend.read("in_memory\\erase").geoms).sum(), 100.0))
+    backend.intersect(["in_memory\\A", "in_memory\\B"], "in_memory\\intersect")
+    checks.append(("intersect count", backend.get_count("in_memory\\intersect"), 2))
+    backend.union(["in_memory\\A", "in_memory\\B"], "in_memory\\union")
+    union = backend.read("in_memory\\union")
+    checks.append(("union count", union.count(), 4))
+    checks.append(("union area", shapely.area(union.geoms).sum(), 200.0))
+    checks.append(("union blank FID", sorted(union.columns["FID_B"].tolist()), [-1, -1, 1, 1]))
+    backend.identity("in_memory\\A", "in_memory\\B", "in_memory\\identity")
+    identity = backend.read("in_memory\\identity")
+    checks.append(("identity area", shapely.area(identity.geoms).sum(), 200.0))
+    checks.append(("identity blank Desig", sorted(identity.columns["Desig"].tolist()), ["", "", "SSSI", "SSSI"]))
+    backend.dissolve("in_memory\\identity", "in_memory\\dissolve", ["Desig"])
+    checks.append(("dissolve count", backend.get_count("in_memory\\dissolve"), 2))
+    backend.multipart_to_singlepart("in_memory\\dissolve", "in_memory\\single")
+    checks.append(("singlepart count", backend.get_count("in_memory\\single"), 3))
+    backend.write("in_memory\\double", Layer(np.array([a.geoms[0], a.geoms[0], a.geoms[1]], dtype=object),
+                                              {"Hab": np.array(["Grass", "Grass", "Grass"], dtype=object)}, ["Hab"]))
+    checks.append(("delete identical", backend.delete_identical("in_memory\\double", ["Shape", "Hab"]), 1))
+    backend.eliminate("in_memory\\union", "in_memory\\eliminate", "FID_B = -1")
+    checks.append(("eliminate count", backend.get_count("in_memory\\eliminate"), 2))
+    backend.copy("in_memory\\A", "in_memory\\copy")
+    backend.delete_rows("in_memory\\copy", "Hab = 'Wood'")
+    checks.append(("delete rows", backend.read("in_memory\\copy").columns["Hab"].tolist(), ["Grass"]))
+    checks.append(("copy unchanged", backend.get_count("in_memory\\A"), 2))
+    backend.delete("in_memory\\copy")
+    checks.append(("delete", backend.exists("in_memory\\copy"), False))
+    backend.tabulate_intersection("in_memory\\A", ["Hab"], "in_memory\\B", "in_memory\\TI", ["Desig"])
+    checks.append(("tabulate percentage", backend.read("in_memory\\TI").columns["PERCENTAGE"].tolist(), [50.0, 50.0]))
+    backend.join_field("in_memory\\TI", "Hab", "in_memory\\A", "Hab", "Hab", "Hab_copy")
+    checks.append(("join field", backend.read("in_memory\\TI").columns["Hab_copy"].tolist(), ["Grass", "Wood"]))
+    backend.calculate_field("in_memory\\TI", "Label", "!Hab! + ' ' + Upper(!Desig!)", "def Upper(value):\n    return value.upper()")
+    checks.append(("calculate field", backend.read("in_memory\\TI").columns["Label"].tolist(), ["Grass SSSI", "Wood SSSI"]))
+
+    num_failed = 0
+    for name, result, expected in checks:
+        if result != expected:
+            print("   " + name + ": expected " + str(expected) + " but got " + str(result))
+            num_failed = num_failed + 1
+    print(str(len(checks) - num_failed) + " of " + str(len(checks)) + " backend checks passed")
+    return num_failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check_backend() else 0)
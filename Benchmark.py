@@ -0,0 +1,80 @@
+# Benchmarks the base map pipeline end to end on a fixed input gdb (see BenchmarkFunctions.py): preprocess, merge, interpret,
+# designations, greenspace, public access and scoring. Records wall time, peak memory, rows in / out and disk usage for each
+# stage in a JSON file, and compares the run with a stored baseline to show the effect of code or parameter changes.
+# -----------------------------------------------------------------------------------------------------------------------
+# BEFORE RUNNING THIS SCRIPT
+# Make the input gdb, e.g. with Make_synthetic_data.py (copy_to_gdb = True) at a fixed scale and seed, and add any other inputs
+# the scripts read from outside the LAD gdb (boundary, OS greenspace, access layers). Set region and method in each script as for
+# a normal run with the Oxon HLU parameter blocks; 'overrides' below changes parameters for the benchmark only, e.g.
+# {"significant_size": 300} or {"in_memory_joins": False}, without editing the scripts.
+# -----------------------------------------------------------------------------------------------------------------------
+# Usage: python Benchmark.py                                  - run the benchmark and compare with the baseline if there is one
+#        python Benchmark.py compare results.json baseline.json  - compare two saved runs
+import os
+import sys
+import time
+import BenchmarkFunctions
+
+# Input gdb (copied before each run, so it is never changed), folder for the working copies, logs and results
+input_gdb = r"D:\cenv0389\Synthetic\Synthetic_district_0.gdb"
+work_folder = r"D:\cenv0389\Benchmark"
+baseline_file = os.path.join(work_folder, "baseline.json")
+# Save this run as the new baseline (e.g. after an intended change in results)
+save_as_baseline = False
+# Changes in time, memory or disk usage of more than this percentage are flagged in the comparison
+tolerance = 10.0
+
+# Stages in order: script, datasets whose rows are counted before (inputs) and after (outputs), and parameter overrides
+stages = [{"name": "preprocess", "script": "Merge_OSMM_HLU_Preprocess.py", "inputs": ["OSMM", "HLU"],
+           "outputs": ["OSMM_noLandform", "HLU_preprocessed"], "overrides": {"clip_OSMM": False, "clip_HLU": False}},
+          {"name": "merge", "script": "Merge_into_Base_Map_V5b.py", "inputs": ["OSMM_noLandform", "HLU_preprocessed"],
+           "outputs": ["New_snap_clean", "Base_TI", "OSMM_HLU"], "overrides": {"merge_type": "Oxon_OSMM_HLU", "significant_size": 200}},
+          {"name": "interpret", "script": "OSMM_HLU_Interpret V2.py", "inputs": ["OSMM_HLU"], "outputs": ["OSMM_HLU"],
+           "overrides": {"in_file_name": "OSMM_HLU"}},
+          {"name": "designations", "script": "Merge_into_Base_Map_V5b.py", "inputs": ["OSMM_HLU", "Designations"],
+           "outputs": ["OSMM_HLU_Desig"],
+           "overrides": {"merge_type": "Oxon_Designations", "Base_map_name": "OSMM_HLU", "Output_fc": "OSMM_HLU_Desig",
+                         "snap_env": [["OSMM_HLU", "EDGE", "0.5 Meters"], ["OSMM_HLU", "VERTEX", "0.5 Meters"]]}},
+          {"name": "greenspace", "script": "Join_Greenspace.py", "inputs": ["OSMM_HLU_Desig"], "outputs": ["OSMM_HLU_Desig_GS"],
+           "overrides": {"Base_map_name": "OSMM_HLU_Desig"}},
+          {"name": "public_access", "script": "Public_accessV3.py", "inputs": ["OSMM_HLU_Desig_GS"], "outputs": ["OSMM_HLU_Desig_GS_PA"],
+           "overrides": {"base_map": "OSMM_HLU_Desig_GS"}},
+          # SetUpScoreTable writes NatCap_<area_name>, which is NatCap_Oxon for the Oxon HLU parameter block
+          {"name": "scoring", "script": "SetUpScoreTable.py", "inputs": ["OSMM_HLU_Desig_GS_PA"], "outputs": ["NatCap_Oxon"],
+           "overrides": {"Base_map": "OSMM_HLU_Desig_GS_PA"}}]
+
+
+def count_rows(dataset):
+    # Row count of a dataset, using arcpy if it is installed or pyogrio otherwise
+    import BackendFunctions
+    if not hasattr(count_rows, "backend"):
+        count_rows.backend = BackendFunctions.get_backend()
+    if not count_rows.backend.exists(dataset):
+        return None
+    return count_rows.backend.get_count(dataset)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        report, num_flagged = BenchmarkFunctions.compare_results(BenchmarkFunctions.load_results(sys.argv[2]),
+                                                                 BenchmarkFunctions.load_results(sys.argv[3]), tolerance)
+        print(report)
+        exit(0)
+
+    print(''.join(["## Started on : ", time.ctime()]))
+    script_folder = os.path.dirname(os.path.abspath(__file__))
+    results = BenchmarkFunctions.run_benchmark(stages, input_gdb, work_folder, count_rows, script_folder,
+                                               {"tolerance": tolerance})
+    results_file = os.path.join(work_folder, "benchmark_" + results["run"] + ".json")
+    BenchmarkFunctions.save_results(results, results_file)
+    print("Results saved in " + results_file)
+
+    if os.path.exists(baseline_file):
+        report, num_flagged = BenchmarkFunctions.compare_results(results, BenchmarkFunctions.load_results(baseline_file), tolerance)
+        print(report)
+        with open(os.path.splitext(results_file)[0] + "_comparison.txt", "w") as f:
+            f.write(report + "\n")
+    if save_as_baseline or not os.path.exists(baseline_file):
+        BenchmarkFunctions.save_results(results, baseline_file)
+        print("Saved as baseline in " + baseline_file)
+    print(''.join(["## Completed on : ", time.ctime()]))
@@ -0,0 +1,208 @@
+# Benchmark functions
+# -------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Harness for timing the base map pipeline end to end on a fixed input gdb (e.g. a synthetic dataset from Make_synthetic_data.py),
+# used by Benchmark.py. Each stage is a per-LAD script run in its own Python process on a fresh copy of the input gdb, with any
+# parameter overrides passed in NATCAP_OVERRIDES (see PipelineFunctions.apply_overrides). For each stage it records:
+# - wall time and peak memory (RSS) of the script process
+# - row counts of the stage's input and output datasets
+# - gdb size after the stage, and peak size of the gdb plus the process TEMP folder while it ran (intermediate disk usage)
+# Results are saved as JSON, and compare_results reports the changes from a stored baseline.
+# Peak memory needs psutil (which records the true peak on Windows). Without it, on Linux the largest child process so far
+# is reported instead, and on Windows nothing.
+# These functions do not import arcpy: row counts are made with a count_rows function passed in by the caller.
+# -------------------------------------------------------------------------------------------------------------------
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+
+def folder_size(path):
+    # Total size in bytes of the files in a folder (e.g. a file gdb), or of a file. 0 if it does not exist.
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for folder, sub_folders, files in os.walk(path):
+        for name in files:
+            try:
+                size = size + os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                # Scratch files can be deleted while we walk the folder
+                pass
+    return size
+
+
+def run_measured(command, log_file, env=None, disk_paths=(), sample_seconds=0.5, disk_sample_seconds=5.0):
+    # Run a command, sampling its memory use and the size of disk_paths while it runs.
+    # Returns a dictionary of return_code, seconds, peak_rss_mb and peak_disk_mb.
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    start = time.time()
+    peak_rss = 0
+    peak_disk = 0
+    last_disk_sample = 0
+    with open(log_file, "w") as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+        watched = psutil.Process(process.pid) if psutil is not None else None
+        while process.poll() is None:
+            if watched is not None:
+                try:
+                    memory = watched.memory_info()
+                    peak_rss = max(peak_rss, memory.rss, getattr(memory, "peak_wset", 0))
+                except psutil.Error:
+                    pass
+            if time.time() - last_disk_sample >= disk_sample_seconds:
+                peak_disk = max(peak_disk, sum(folder_size(path) for path in disk_paths))
+                last_disk_sample = time.time()
+            time.sleep(sample_seconds)
+    seconds = time.time() - start
+    peak_disk = max(peak_disk, sum(folder_size(path) for path in disk_paths))
+    if watched is None:
+        try:
+            import resource
+            # ru_maxrss is in kB on Linux: the largest child so far, so for later stages it may belong to an earlier stage
+            peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        except ImportError:
+            peak_rss = None
+    return {"return_code": process.returncode, "seconds": round(seconds, 1),
+            "peak_rss_mb": None if peak_rss is None else round(peak_rss / 1048576.0, 1),
+            "peak_disk_mb": round(peak_disk / 1048576.0, 1)}
+
+
+def count_datasets(count_rows, gdb, names):
+    # Row counts of datasets in a gdb (None for datasets that do not exist or cannot be counted)
+    counts = {}
+    for name in names:
+        try:
+            counts[name] = count_rows(os.path.join(gdb, name))
+        except Exception:
+            counts[name] = None
+    return counts
+
+
+def run_stage(stage, gdb, log_folder, count_rows, script_folder):
+    # Run one stage (a dictionary with name, script, inputs, outputs and optional overrides) on a gdb and return its results
+    script = os.path.join(script_folder, stage["script"])
+    overrides = stage.get("overrides") or {}
+    temp_folder = os.path.join(log_folder, "temp_" + stage["name"])
+    if not os.path.exists(temp_folder):
+        os.makedirs(temp_folder)
+    env = dict(os.environ)
+    env["TEMP"] = temp_folder
+    env["TMP"] = temp_folder
+    env["NATCAP_OVERRIDES"] = json.dumps(overrides)
+    log_file = os.path.join(log_folder, stage["name"] + ".log")
+
+    print("   Running " + stage["name"] + " (" + stage["script"] + ") on " + time.ctime())
+    rows_in = count_datasets(count_rows, gdb, stage.get("inputs", []))
+    size_before = folder_size(gdb)
+    result = run_measured([sys.executable, "-u", script, gdb], log_file, env, [gdb, temp_folder])
+    rows_out = count_datasets(count_rows, gdb, stage.get("outputs", []))
+    size_after = folder_size(gdb)
+    result.update({"name": stage["name"], "script": stage["script"], "overrides": overrides, "rows_in": rows_in,
+                   "rows_out": rows_out, "gdb_mb": round(size_after / 1048576.0, 1),
+                   "gdb_change_mb": round((size_after - size_before) / 1048576.0, 1), "log_file": log_file})
+    status = "completed" if result["return_code"] == 0 else "FAILED (exit code " + str(result["return_code"]) + ")"
+    print("      " + status + " in " + str(result["seconds"]) + " s, peak memory " + str(result["peak_rss_mb"]) + " MB")
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    return result
+
+
+def run_benchmark(stages, input_gdb, work_folder, count_rows, script_folder, settings=None):
+    # Copy the input gdb to a fresh working gdb and run the stages on it in order, stopping at the first failure.
+    # Returns the results dictionary that is saved as JSON.
+    run_name = time.strftime("%Y%m%d_%H%M%S")
+    run_folder = os.path.join(work_folder, run_name)
+    gdb = os.path.join(run_folder, os.path.basename(input_gdb.rstrip("\\/")))
+    log_folder = os.path.join(run_folder, "logs")
+    os.makedirs(log_folder)
+    print("Copying " + input_gdb + " to " + gdb)
+    shutil.copytree(input_gdb, gdb)
+
+    results = {"run": run_name, "input_gdb": input_gdb, "input_mb": round(folder_size(input_gdb) / 1048576.0, 1),
+               "machine": platform.node(), "python": platform.python_version(), "started": time.ctime(),
+               "settings": settings, "stages": []}
+    start = time.time()
+    for stage in stages:
+        result = run_stage(stage, gdb, log_folder, count_rows, script_folder)
+        results["stages"].append(result)
+        if result["return_code"] != 0:
+            print("Stopping: " + stage["name"] + " failed. See " + result["log_file"])
+            break
+    results["seconds"] = round(time.time() - start, 1)
+    results["completed"] = time.ctime()
+    return results
+
+
+def save_results(results, path):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def percent_change(new, old):
+    if new is None or old is None:
+        return None
+    if old == 0:
+        return 0.0 if new == 0 else None
+    return (new - old) * 100.0 / old
+
+
+def compare_results(results, baseline, tolerance=10.0):
+    # Report of the changes in each stage from a baseline run. Time, memory and disk changes of more than tolerance percent and
+    # any change in row counts or settings are flagged with '***'. Returns the report and the number of flagged changes.
+    lines = ["Benchmark " + str(results.get("run")) + " compared with baseline " + str(baseline.get("run"))]
+    num_flagged = 0
+    if results.get("input_gdb") != baseline.get("input_gdb") or results.get("input_mb") != baseline.get("input_mb"):
+        lines.append("*** Input differs: " + str(baseline.get("input_gdb")) + " (" + str(baseline.get("input_mb")) + " MB) -> "
+                     + str(results.get("input_gdb")) + " (" + str(results.get("input_mb")) + " MB)")
+        num_flagged = num_flagged + 1
+    baseline_stages = dict((stage["name"], stage) for stage in baseline.get("stages", []))
+    for stage in results.get("stages", []):
+        old = baseline_stages.get(stage["name"])
+        lines.append("")
+        if old is None:
+            lines.append(stage["name"] + ": not in baseline")
+            continue
+        lines.append(stage["name"] + ":")
+        if stage.get("overrides") != old.get("overrides"):
+            lines.append("   *** overrides " + json.dumps(old.get("overrides"), sort_keys=True) + " -> "
+                         + json.dumps(stage.get("overrides"), sort_keys=True))
+            num_flagged = num_flagged + 1
+        for measure, unit in [("seconds", "s"), ("peak_rss_mb", "MB"), ("peak_disk_mb", "MB"), ("gdb_mb", "MB")]:
+            change = percent_change(stage.get(measure), old.get(measure))
+            flag = "   "
+            if change is None or abs(change) > tolerance:
+                flag = "***"
+                num_flagged = num_flagged + 1
+            change_text = "n/a" if change is None else ("+" if change >= 0 else "") + str(round(change, 1)) + "%"
+            lines.append(flag + " " + measure + ": " + str(old.get(measure)) + " -> " + str(stage.get(measure)) + " " + unit
+                         + " (" + change_text + ")")
+        for counts in ["rows_in", "rows_out"]:
+            new_counts = stage.get(counts) or {}
+            old_counts = old.get(counts) or {}
+            for name in sorted(set(new_counts) | set(old_counts)):
+                if new_counts.get(name) != old_counts.get(name):
+                    lines.append("*** " + counts + " " + name + ": " + str(old_counts.get(name)) + " -> " + str(new_counts.get(name)))
+                    num_flagged = num_flagged + 1
+        if stage.get("return_code") != 0:
+            lines.append("*** failed with exit code " + str(stage.get("return_code")))
+            num_flagged = num_flagged + 1
+    lines.append("")
+    lines.append("Total: " + str(baseline.get("seconds")) + " -> " + str(results.get("seconds")) + " s. "
+                 + str(num_flagged) + " changes flagged.")
+    return "\n".join(lines), num_flagged
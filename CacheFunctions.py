@@ -0,0 +1,216 @@
+# Cache functions
+# ---------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Columnar cache of LAD feature classes (e.g. OSMM_CR_PHI_ALC_Desig_GS_PA, NatCap_<LAD>) as GeoParquet files, so that later stages
+# can read just the columns they need straight into numpy arrays instead of iterating over every row with a SearchCursor.
+# Geometry is stored as WKB in a "geometry" column with GeoParquet 1.0 metadata, so the files can also be opened in QGIS or geopandas.
+# Each file records the modification stamp of its gdb when it was written; any later edit to the gdb makes the cache stale.
+# Needs pyarrow (and pyproj to record the coordinate system). These do not import arcpy: see MyFunctions.export_geoparquet
+# and MyFunctions.read_columns_cached.
+# -----------------------------------------------------------------------------------------------------------------------
+import json
+import os
+
+# arrow types for the arcpy field types that are cached (other types such as Blob and Raster are skipped)
+arrow_type_names = {"OID": "int64", "SmallInteger": "int16", "Integer": "int32", "Single": "float32", "Double": "float64",
+                    "String": "string", "Date": "timestamp", "GUID": "string", "GlobalID": "string"}
+
+
+def gdb_stamp(gdb):
+    # Latest modification time of the files in a file gdb. Any edit to any feature class in the gdb changes it. Lock files are
+    # ignored, because ArcGIS creates them just by reading the gdb.
+    stamp = 0
+    for name in os.listdir(gdb):
+        if not name.endswith(".lock"):
+            stamp = max(stamp, os.path.getmtime(os.path.join(gdb, name)))
+    return stamp
+
+
+def cache_path(gdb, table, cache_folder=None):
+    # Default cache folder is next to the gdb, e.g. D:\LADs\Oxford.gdb -> D:\LADs\Oxford_parquet\NatCap_Oxford.parquet
+    if cache_folder is None:
+        cache_folder = os.path.splitext(gdb.rstrip("\\/"))[0] + "_parquet"
+    return os.path.join(cache_folder, os.path.basename(table) + ".parquet")
+
+
+def arrow_type(type_name):
+    import pyarrow as pa
+    if type_name == "timestamp":
+        return pa.timestamp("ms")
+    return getattr(pa, type_name)()
+
+
+def write_geoparquet(path, columns, field_types, wkbs=None, crs_wkt=None, source=None, stamp=None):
+    # Write columns (a dictionary of lists of values, None for nulls) to a GeoParquet file. field_types is a list of
+    # [field name, arcpy field type] in column order. wkbs is a list of WKB geometries (or None for a table).
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    names = []
+    arrays = []
+    for name, field_type in field_types:
+        names.append(name)
+        arrays.append(pa.array(columns[name], type=arrow_type(arrow_type_names[field_type])))
+    metadata = {"natcap": json.dumps({"source": source, "stamp": stamp, "field_types": field_types})}
+    if wkbs is not None:
+        names.append("geometry")
+        arrays.append(pa.array([None if wkb is None else bytes(wkb) for wkb in wkbs], type=pa.binary()))
+        # A null crs means 'unknown' (an omitted crs would mean longitude / latitude)
+        crs = None
+        if crs_wkt:
+            try:
+                import pyproj
+                crs = pyproj.CRS.from_wkt(crs_wkt).to_json_dict()
+            except ImportError:
+                print("      pyproj is not installed so the coordinate system is not recorded in " + path)
+        metadata["geo"] = json.dumps({"version": "1.0.0", "primary_column": "geometry",
+                                      "columns": {"geometry": {"encoding": "WKB", "geometry_types": [], "crs": crs}}})
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(metadata)
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    # Write to a temporary file first so that an interrupted export does not leave a truncated cache
+    pq.write_table(table, path + ".tmp")
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(path + ".tmp", path)
+
+
+def read_metadata(path):
+    # The natcap metadata of a cache file (source, stamp and field types), or None if there is no file
+    if not os.path.exists(path):
+        return None
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(path).metadata or {}
+    value = metadata.get(b"natcap")
+    return json.loads(value.decode("utf-8")) if value else None
+
+
+def cache_is_current(path, stamp):
+    metadata = read_metadata(path)
+    return metadata is not None and metadata.get("stamp") == stamp
+
+
+def read_geoparquet(path, fields, geometry=False):
+    # Read only the given columns from a cache file into a dictionary of numpy arrays (numeric columns without nulls are not
+    # copied). Text columns are object arrays with None for nulls; integer columns with nulls are floats with NaN.
+    # With geometry=True the WKB geometries are also returned as a list.
+    import numpy as np
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=list(fields) + (["geometry"] if geometry else []))
+    columns = {}
+    for field in fields:
+        columns[field] = np.asarray(table.column(field).combine_chunks().to_numpy(zero_copy_only=False))
+    wkbs = table.column("geometry").to_pylist() if geometry else None
+    return columns, wkbs
+
+
+# Row count cache
+# ---------------
+# The scripts print row counts of the same feature classes many times (before and after each step, in the stage manifests and in the
+# timing logs), and on a large file gdb feature class each GetCount can read the whole table. Counts of datasets in a file gdb are
+# kept until the gdb is next changed: the key is the dataset path and the value is stored with the gdb stamp, so any write to the
+# gdb (by this process, a cursor or another process) makes the count stale. See MyFunctions.count_rows.
+
+def gdb_of(path):
+    # The file gdb containing a dataset path (e.g. D:\LADs\Oxford.gdb\OSMM or D:\LADs\Oxford.gdb\Dataset\OSMM), or None
+    # if it is not in a file gdb (layers, in_memory, shapefiles)
+    folder = path.rstrip("\\/")
+    while folder:
+        if folder.lower().endswith(".gdb"):
+            return folder
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            break
+        folder = parent
+    return None
+
+
+class CountCache(object):
+    # Row counts keyed by dataset path, each valid while the stamp of its gdb is unchanged. count_function(path) makes the count
+    # (returning None if the dataset does not exist, which is not cached); stamp_function(gdb) gives the gdb stamp.
+
+    def __init__(self, count_function, stamp_function=gdb_stamp):
+        self.count_function = count_function
+        self.stamp_function = stamp_function
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, path):
+        gdb = gdb_of(path)
+        if gdb is None or not os.path.isdir(gdb):
+            return self.count_function(path)
+        # Stamp taken before counting, so a write during the count leaves the entry stale rather than wrong
+        stamp = self.stamp_function(gdb)
+        key = os.path.normcase(os.path.normpath(path))
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits = self.hits + 1
+            return entry[1]
+        self.misses = self.misses + 1
+        value = self.count_function(path)
+        if value is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = (stamp, value)
+        return value
+
+    def invalidate(self, path=None):
+        # Forget the count of one dataset, of all datasets in a gdb (path is the gdb), or everything (no path)
+        if path is None:
+            self.entries.clear()
+            return
+        key = os.path.normcase(os.path.normpath(path))
+        for name in list(self.entries.keys()):
+            if name == key or name.startswith(key + os.sep):
+                del self.entries[name]
+
+    def report(self):
+        return str(self.hits) + " row counts from cache, " + str(self.misses) + " counted"
+
+
+def check_count_cache():
+    # Self-check of CountCache on a fake gdb folder, with a counting function that records its calls
+    import shutil
+    import tempfile
+    folder = tempfile.mkdtemp()
+    gdb = os.path.join(folder, "Test.gdb")
+    os.makedirs(gdb)
+    table_file = os.path.join(gdb, "a00000009.gdbtable")
+    with open(table_file, "w") as f:
+        f.write("x")
+    calls = []
+    rows = {"OSMM": 10, "HLU": 5}
+
+    def count_function(path):
+        calls.append(path)
+        return rows.get(os.path.basename(path))
+
+    cache = CountCache(count_function)
+    checks = []
+    checks.append(cache.count(os.path.join(gdb, "OSMM")) == 10 and cache.count(os.path.join(gdb, "OSMM")) == 10 and len(calls) == 1)
+    checks.append(cache.count(os.path.join(gdb, "Missing")) is None and cache.count(os.path.join(gdb, "Missing")) is None
+                  and len(calls) == 3)
+    in_memory = os.path.join("in_memory", "OSMM")
+    checks.append(cache.count(in_memory) == 10 and cache.count(in_memory) == 10 and len(calls) == 5)
+    # A write to the gdb makes the count stale
+    rows["OSMM"] = 12
+    stamp = os.path.getmtime(table_file) + 10
+    os.utime(table_file, (stamp, stamp))
+    checks.append(cache.count(os.path.join(gdb, "OSMM")) == 12 and len(calls) == 6)
+    # Lock files (written by readers) do not
+    with open(os.path.join(gdb, "_gdb.test.sr.lock"), "w") as f:
+        f.write("x")
+    os.utime(os.path.join(gdb, "_gdb.test.sr.lock"), (stamp + 10, stamp + 10))
+    checks.append(cache.count(os.path.join(gdb, "OSMM")) == 12 and len(calls) == 6)
+    cache.invalidate(gdb)
+    checks.append(cache.count(os.path.join(gdb, "OSMM")) == 12 and len(calls) == 7)
+    checks.append(gdb_of(os.path.join(gdb, "Dataset", "OSMM")) == gdb and gdb_of(folder) is None)
+    shutil.rmtree(folder)
+    print(str(sum(checks)) + " of " + str(len(checks)) + " count cache checks passed. " + cache.report())
+    return all(checks)
+
+
+if __name__ == "__main__":
+    check_count_cache()
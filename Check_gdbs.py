@@ -5,6 +5,7 @@
 import time
 import arcpy
 import os
+import MyFunctions
 
 arcpy.CheckOutExtension("Spatial")
 
@@ -60,10 +61,10 @@ for gdb in gdbs:
     print "Checking " + gdb
     gdb_failed = False
     for table in Tables_to_check:
-        numrows = arcpy.GetCount_management(table)
+        # count_rows returns a number (GetCount returns a Result object, which is never equal to 0), or None if the table is missing
+        numrows = MyFunctions.count_rows(table)
         print str(numrows) + " rows in " + table
-        if numrows == 0:
-            # this doesn't seem to work
+        if not numrows:
             gdb_failed = True
             error_msgs.append(gdb + " has zero rows in " + table)
     if gdb_failed:
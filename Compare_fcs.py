@@ -166,32 +166,35 @@ for fc in in_fcs:
     print("Identifying reasons for non-matching polygons")
     MyFunctions.check_and_add_field(non_match_fc, "DetailedReason", "TEXT", 120)
     MyFunctions.check_and_add_field(non_match_fc, "SimpleReason", "TEXT", 100)
+    # Rules are (expression, field, new value), applied in order in one pass through the table
+    reason_rules = []
     # Mis-matched habitats
     expression = "Hab_comp = 0"
-    MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "!SimplePaid!" + "' vs '" + "!SimpleFree!")
-    MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "!Interpreted_habitat!" + "' vs '" + "!Interpreted_habitat_1!")
+    reason_rules.append((expression, "SimpleReason", "!SimplePaid!" + "' vs '" + "!SimpleFree!"))
+    reason_rules.append((expression, "DetailedReason", "!Interpreted_habitat!" + "' vs '" + "!Interpreted_habitat_1!"))
     # Mis-matched ALC grades
     expression = "Hab_comp = 1 AND ALC_comp = 0"
-    MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'ALC mismatch'")
-    MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "'ALC mismatch'")
+    reason_rules.append((expression, "SimpleReason", "'ALC mismatch'"))
+    reason_rules.append((expression, "DetailedReason", "'ALC mismatch'"))
     # Special case for linear habitats
     expression = "HabNmPLUS_1 ='Linear habitats'"
-    MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'Undefined linear habitat mismatch'")
+    reason_rules.append((expression, "SimpleReason", "'Undefined linear habitat mismatch'"))
     # # Temporary corrections...
     # expression = "DetailedReason = 'ALC mis-match' AND ALC_GRADE = 'Not agricultural' AND ALC_GRADE_12 = 'Non Agricultural'"
-    # MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'False ALC mismatch'")
-    # MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "'False ALC mismatch'")
+    # reason_rules.append((expression, "SimpleReason", "'False ALC mismatch'"))
+    # reason_rules.append((expression, "DetailedReason", "'False ALC mismatch'"))
     # expression = "DetailedReason = 'ALC mis-match' AND ALC_GRADE = 'Non Agricultural' AND ALC_GRADE_12 = 'Not agricultural'"
-    # MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'False ALC mismatch'")
-    # MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "'False ALC mismatch'")
+    # reason_rules.append((expression, "SimpleReason", "'False ALC mismatch'"))
+    # reason_rules.append((expression, "DetailedReason", "'False ALC mismatch'"))
     # Mis-matched Access
     expression = "DetailedReason IS NULL AND AccessType <> AccessType_1"
-    MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'Access mismatch'")
-    MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "'Access mismatch'")
+    reason_rules.append((expression, "SimpleReason", "'Access mismatch'"))
+    reason_rules.append((expression, "DetailedReason", "'Access mismatch'"))
     # The rest must be due to mis-matched designations
     expression = "DetailedReason IS NULL"
-    MyFunctions.select_and_copy(non_match_fc, "SimpleReason", expression, "'Designation mismatch'")
-    MyFunctions.select_and_copy(non_match_fc, "DetailedReason", expression, "'Designation mismatch'")
+    reason_rules.append((expression, "SimpleReason", "'Designation mismatch'"))
+    reason_rules.append((expression, "DetailedReason", "'Designation mismatch'"))
+    MyFunctions.apply_rules(non_match_fc, reason_rules)
 
     print(''.join(["## Finished on : ", time.ctime()]))
 
@@ -0,0 +1,47 @@
+# Mirrors feature classes in each LAD gdb into GeoParquet cache files (see CacheFunctions.py), so that later stages can read
+# only the columns they need with MyFunctions.read_columns_cached. Files that are already up to date are skipped.
+# -----------------------------------------------------------------------------------------------------------------------
+# Needs pyarrow (and pyproj to record the coordinate system) in the ArcGIS Python installation.
+# Can be run on many gdbs at once with Parallel_LADs.py.
+# -----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import time
+import arcpy
+import CacheFunctions
+import MyFunctions
+import PipelineFunctions
+
+print(''.join(["## Started on : ", time.ctime()]))
+
+folder = r"M:\urban_development_natural_capital\LADs"
+gdbs = PipelineFunctions.list_gdbs(folder)
+# Feature classes to cache. "NatCap_" + the LAD name is added for each gdb if include_natcap is True.
+fcs = ["OSMM_CR_PHI_ALC_Desig_GS_PA"]
+include_natcap = True
+# Cache folder: None for a folder next to each gdb (e.g. Oxford_parquet), or one folder with a subfolder per LAD
+cache_folder = None
+
+# If gdbs are given on the command line (e.g. by Parallel_LADs.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
+
+for gdb in gdbs:
+    arcpy.env.workspace = gdb
+    LAD = PipelineFunctions.gdb_name(gdb)
+    print("### Caching " + LAD + " on " + time.ctime())
+    gdb_fcs = list(fcs)
+    if include_natcap:
+        gdb_fcs.append("NatCap_" + LAD.replace("-", ""))
+    for fc in gdb_fcs:
+        if not arcpy.Exists(fc):
+            print("      " + fc + " not found in " + gdb)
+            continue
+        LAD_cache_folder = None if cache_folder is None else os.path.join(cache_folder, LAD)
+        path = CacheFunctions.cache_path(gdb, fc, LAD_cache_folder)
+        if CacheFunctions.cache_is_current(path, CacheFunctions.gdb_stamp(gdb)):
+            print("      " + fc + " is up to date")
+            continue
+        MyFunctions.export_geoparquet(fc, path, gdb)
+
+print(''.join(["## Completed on : ", time.ctime()]))
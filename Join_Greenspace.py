@@ -14,7 +14,9 @@
 import time
 import arcpy
 import os
+import sys
 import MyFunctions
+import PipelineFunctions
 
 arcpy.CheckOutExtension("Spatial")
 
@@ -156,7 +158,7 @@ if merge_GS_files:
             arcpy.CopyFeatures_management("sel_lyr", OSGS)
         else:
             arcpy.Append_management("sel_lyr", OSGS)
-            numrows = arcpy.GetCount_management(OSGS)
+            numrows = MyFunctions.count_rows(OSGS)
             print("After merging " + str(ifile) + " files, OSGS file contains " + str(numrows) + " rows")
         arcpy.Delete_management("sel_lyr")
 
@@ -170,6 +172,13 @@ if prep_openGS:
     arcpy.Union_analysis([["OS_Open_GS_sort", 1]], OS_openGS, "ALL")
     arcpy.DeleteIdentical_management(OS_openGS, ["Shape"])
 
+# Parameters can be overridden by the benchmark harness (Benchmark.py)
+PipelineFunctions.apply_overrides(globals())
+
+# If gdbs are given on the command line (e.g. by Parallel_LADs.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
+
 i = 0
 for gdb in gdbs:
     i = i + 1
@@ -183,16 +192,16 @@ for gdb in gdbs:
     if correct_habitats:
         # May or may not need to be different from the above depending on which stage you want to apply the corrections to
         Base_map = Base_map_name + "_GS"
-    print ("    " + Base_map + " has " + str(arcpy.GetCount_management(Base_map_name)) + " rows")
+    print ("    " + Base_map + " has " + str(MyFunctions.count_rows(Base_map_name)) + " rows")
 
     if clip_OSGS:
         print("    Clipping OSGS for " + gdb_name)
         arcpy.Clip_analysis(OSGS, boundary, "OSGS")
-        print (str(arcpy.GetCount_management("OSGS")) + " rows in OSGS")
+        print (str(MyFunctions.count_rows("OSGS")) + " rows in OSGS")
     if clip_openGS:
         print("    Clipping OS open GS for " + gdb_name)
         arcpy.Clip_analysis(os.path.join(Open_GS_gdb, OS_openGS), boundary, "OS_Open_GS")
-        print (str(arcpy.GetCount_management("OS_Open_GS")) + " rows in OS Open_GS")
+        print (str(MyFunctions.count_rows("OS_Open_GS")) + " rows in OS Open_GS")
 
     if join_OSGS:
         print("    Joining OSGS data")
@@ -0,0 +1,55 @@
+# Makes a synthetic test dataset (see SyntheticFunctions.py) for benchmarking the merge, interpretation and scoring stages:
+# OSMM (base map), HLU (Phase 1 habitat with jittered boundaries), Designations and OS_openGS, at a named scale from a parish
+# to a county. The same scale, seed and jitter always give the same data.
+# -----------------------------------------------------------------------------------------------------------------------
+# Usage: python Make_synthetic_data.py [scale] [seed], e.g. python Make_synthetic_data.py county 1
+# The layers are written to a GeoPackage with pyogrio. If copy_to_gdb is True (needs ArcGIS) they are also copied into a new
+# file gdb under the same names, which are the input names Merge_OSMM_HLU_Preprocess.py reads when clip_OSMM and clip_HLU are False.
+# -----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import time
+import BackendFunctions
+import SyntheticFunctions
+
+print(''.join(["## Started on : ", time.ctime()]))
+
+# Scale: "parish" (2 km square), "town" (5 km), "district" (20 km), "county" (50 km) or a side length in metres
+scale = "parish"
+seed = 0
+# Maximum offset in metres of the HLU, designation and greenspace boundaries from the base map boundaries
+jitter = 2.0
+out_folder = r"D:\cenv0389\Synthetic"
+copy_to_gdb = False
+
+if len(sys.argv) > 1:
+    scale = sys.argv[1]
+if len(sys.argv) > 2:
+    seed = int(sys.argv[2])
+
+name = "Synthetic_" + str(scale) + "_" + str(seed)
+if not os.path.exists(out_folder):
+    os.makedirs(out_folder)
+gpkg = os.path.join(out_folder, name + ".gpkg")
+
+print("Making " + str(scale) + " dataset with seed " + str(seed) + " and jitter " + str(jitter))
+layers = SyntheticFunctions.make_dataset(scale, seed, jitter)
+print(SyntheticFunctions.describe_dataset(layers))
+
+backend = BackendFunctions.OpenBackend(gpkg)
+for layer_name in sorted(layers):
+    print("   Writing " + layer_name + " to " + gpkg)
+    backend.write(layer_name, layers[layer_name])
+
+if copy_to_gdb:
+    import arcpy
+    arcpy.env.overwriteOutput = True
+    gdb = os.path.join(out_folder, name + ".gdb")
+    if not arcpy.Exists(gdb):
+        arcpy.CreateFileGDB_management(out_folder, name + ".gdb")
+    for layer_name in sorted(layers):
+        print("   Copying " + layer_name + " to " + gdb)
+        # ArcGIS names GeoPackage layers main.<layer>
+        arcpy.FeatureClassToFeatureClass_conversion(os.path.join(gpkg, "main." + layer_name), gdb, layer_name)
+
+print(''.join(["## Completed on : ", time.ctime()]))
@@ -0,0 +1,246 @@
+# Merge engine functions
+# ----------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Pure Python versions of the overlay steps in Merge_into_Base_Map_V5b.py. They work on arrays of shapely geometries
+# held in memory, so they can be run and checked without ArcGIS. Geometries can be read from a geodatabase with
+# MyFunctions.read_geometries. The geometry functions require shapely 2.0 or later, which needs Python 3 (ArcGIS Pro); shapely
+# is imported inside them, so the numpy-only functions (classify_relationships, partition_overlaps and the tile grid functions)
+# also run in ArcMap's Python 2.
+# -------------------------------------------------------------------------------------------------------------------
+import numpy as np
+
+
+def tabulate_intersection(base_geoms, new_geoms, chunk_size=500000, xy_tolerance=0.0):
+    # Equivalent of TabulateIntersection_analysis with the base map polygons as zones and the new features as classes.
+    # Returns four arrays with one entry per overlapping pair: index of the base polygon, index of the new feature,
+    # overlap AREA and PERCENTAGE of the base polygon covered by the overlap (as in the Base_TI table).
+    # With an xy_tolerance (in map units) the overlaps are calculated on a grid of that size, so boundaries closer together than
+    # the tolerance coincide and leave no sliver overlaps, as with the xy_tolerance of the ArcGIS tool (which clusters vertices
+    # rather than snapping them to a grid, so areas can differ very slightly).
+    import shapely
+    base_geoms = np.asarray(base_geoms, dtype=object)
+    new_geoms = np.asarray(new_geoms, dtype=object)
+
+    # Candidate pairs from an STRtree on the new features. The query prepares each base polygon and tests the
+    # 'intersects' predicate, so only pairs that really touch or overlap are returned.
+    tree = shapely.STRtree(new_geoms)
+    base_index, new_index = tree.query(base_geoms, predicate="intersects")
+
+    # Intersection areas are calculated in chunks to limit the memory used by the intermediate geometries
+    area = np.empty(len(base_index), dtype=np.float64)
+    for start in range(0, len(base_index), chunk_size):
+        stop = start + chunk_size
+        overlaps = shapely.intersection(base_geoms[base_index[start:stop]], new_geoms[new_index[start:stop]],
+                                        grid_size=xy_tolerance if xy_tolerance else None)
+        area[start:stop] = shapely.area(overlaps)
+
+    # Pairs that only share a boundary have zero overlap and are not reported by Tabulate Intersection
+    keep = area > 0
+    base_index = base_index[keep]
+    new_index = new_index[keep]
+    area = area[keep]
+    percentage = area / shapely.area(base_geoms)[base_index] * 100
+    return base_index, new_index, area, percentage
+
+
+# Codes for the overlap relationship between base map polygons and new features, held in memory as int8 rather than text.
+# RELATIONSHIP_NAMES converts them back to the text values used in the Relationship field of Base_TI and Joint_spatial.
+# 'Not new' is only assigned later, to the parts of split polygons that lie outside the new features.
+NO_RELATIONSHIP = 0
+BASE = 1
+SPLIT = 2
+NEW = 3
+NOT_NEW = 4
+RELATIONSHIP_NAMES = np.array(["", "Base", "Split", "New", "Not new"], dtype=object)
+
+
+def classify_relationships(area, percentage, ignore_low, ignore_high, significant_size):
+    # Vectorised version of the relationship() codeblock that was calculated row by row on Base_TI:
+    # - small overlaps (under ignore_low percent and under significant_size) are ignored: 'Base'
+    # - most overlaps mean the base polygon is split to match the new feature boundary: 'Split'
+    # - very high overlaps (ignore_high percent or more) assign new feature attributes to the whole polygon: 'New'
+    area = np.asarray(area)
+    percentage = np.asarray(percentage)
+    codes = np.full(len(area), NEW, dtype=np.int8)
+    codes[percentage < ignore_high] = SPLIT
+    codes[(percentage < ignore_low) & (area < significant_size)] = BASE
+    return codes
+
+
+def relationship_names(codes):
+    # Convert relationship codes to the text values stored in the Relationship field
+    return RELATIONSHIP_NAMES[np.asarray(codes, dtype=np.int8)]
+
+
+def relationship_codes(names):
+    # Convert text values read from a Relationship field back to int8 codes. Nulls and unknown values become NO_RELATIONSHIP.
+    lookup = dict((name, code) for code, name in enumerate(RELATIONSHIP_NAMES) if name)
+    return np.array([lookup.get(name, NO_RELATIONSHIP) for name in names], dtype=np.int8)
+
+
+def partition_overlaps(base_ids, new_ids, area, relationship):
+    # In-memory replacement for the Base_TI_split and Base_TI_not_split_sort tables in the merge script.
+    # Returns:
+    # - the set of base map IDs with at least one overlap marked 'Split'
+    # - the set of new feature IDs with at least one overlap marked 'Split'
+    # - a dictionary of base map ID: (new feature ID, relationship code) for the largest overlap of each base polygon
+    #   among the overlaps that are not marked 'Split' (equivalent to sorting by AREA descending and deleting identical base_IDs)
+    base_ids = np.asarray(base_ids)
+    new_ids = np.asarray(new_ids)
+    area = np.asarray(area)
+    relationship = np.asarray(relationship, dtype=np.int8)
+
+    is_split = relationship == SPLIT
+    split_base_ids = set(base_ids[is_split].tolist())
+    split_new_ids = set(new_ids[is_split].tolist())
+
+    # Sort the remaining rows by base ID and then by descending area, and keep the first row for each base ID
+    not_split = np.flatnonzero(~is_split)
+    order = not_split[np.lexsort((-area[not_split], base_ids[not_split]))]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = base_ids[order][1:] != base_ids[order][:-1]
+    largest = order[first]
+    largest_overlap = dict(zip(base_ids[largest].tolist(), zip(new_ids[largest].tolist(), relationship[largest].tolist())))
+    return split_base_ids, split_new_ids, largest_overlap
+
+
+def eliminate_slivers(geoms, slivers, tolerance=0.0):
+    # Equivalent of Eliminate_management with the default LENGTH option: each selected sliver is merged into the
+    # unselected neighbour with which it shares the longest boundary. Adjacency is found once with an STRtree.
+    # Slivers with no unselected neighbour (e.g. only touching other slivers, or at a point) are left as they are, as in ArcGIS.
+    # If tolerance > 0, boundaries within that distance of each other count as shared (helps where edges are not exactly coincident).
+    # Returns the output geometries (the merged shape for neighbours that absorbed slivers) and a boolean array of the
+    # slivers that were absorbed, which should be deleted.
+    import shapely
+    geoms = np.asarray(geoms, dtype=object)
+    slivers = np.asarray(slivers, dtype=bool)
+    sliver_index = np.flatnonzero(slivers)
+
+    # Candidate pairs of selected sliver and unselected neighbour
+    tree = shapely.STRtree(geoms)
+    if tolerance > 0:
+        pair_sliver, pair_neighbour = tree.query(geoms[sliver_index], predicate="dwithin", distance=tolerance)
+    else:
+        pair_sliver, pair_neighbour = tree.query(geoms[sliver_index], predicate="intersects")
+    pair_sliver = sliver_index[pair_sliver]
+    keep = ~slivers[pair_neighbour]
+    pair_sliver = pair_sliver[keep]
+    pair_neighbour = pair_neighbour[keep]
+
+    # Length of shared boundary for each pair
+    sliver_edges = shapely.boundary(geoms[pair_sliver])
+    if tolerance > 0:
+        neighbour_edges = shapely.buffer(shapely.boundary(geoms[pair_neighbour]), tolerance)
+    else:
+        neighbour_edges = shapely.boundary(geoms[pair_neighbour])
+    shared_length = shapely.length(shapely.intersection(sliver_edges, neighbour_edges))
+    keep = shared_length > 0
+    pair_sliver = pair_sliver[keep]
+    pair_neighbour = pair_neighbour[keep]
+    shared_length = shared_length[keep]
+
+    # Longest shared boundary for each sliver: sort by sliver then descending length, keep the first row per sliver
+    order = np.lexsort((-shared_length, pair_sliver))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_sliver[order][1:] != pair_sliver[order][:-1]
+    absorbed = pair_sliver[order][first]
+    targets = pair_neighbour[order][first]
+
+    # Merge each group of absorbed slivers into its neighbour
+    out_geoms = geoms.copy()
+    order = np.argsort(targets, kind="stable")
+    absorbed = absorbed[order]
+    targets = targets[order]
+    group_start = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]]) if len(targets) > 0 else []
+    group_stop = np.r_[group_start[1:], len(targets)].astype(int)
+    for start, stop in zip(group_start, group_stop):
+        target = targets[start]
+        out_geoms[target] = shapely.union_all(np.r_[geoms[[target]], geoms[absorbed[start:stop]]])
+
+    is_absorbed = np.zeros(len(geoms), dtype=bool)
+    is_absorbed[absorbed] = True
+    return out_geoms, is_absorbed
+
+
+def identical_geometries(geoms, base_geoms):
+    # Boolean array of the geometries that are identical to a base map geometry (as SelectLayerByLocation 'are_identical_to')
+    import shapely
+    geoms = np.asarray(geoms, dtype=object)
+    tree = shapely.STRtree(base_geoms)
+    geom_index, base_index = tree.query(geoms, predicate="covered_by")
+    same = shapely.equals(geoms[geom_index], np.asarray(base_geoms, dtype=object)[base_index])
+    identical = np.zeros(len(geoms), dtype=bool)
+    identical[geom_index[same]] = True
+    return identical
+
+
+def snap_geometries(geoms, base_geoms, snap_type, tolerance, skip=None, chunk_size=1000000):
+    # Equivalent of one snap environment of Snap_edit: moves each vertex of geoms that is within tolerance of the base map
+    # to the nearest base map vertex (snap_type "VERTEX") or the nearest point on a base map boundary ("EDGE").
+    # Base map vertices or boundaries are indexed once in an STRtree and the vertices of geoms are snapped in batches of
+    # chunk_size. Geometries flagged in skip (e.g. those identical to base map polygons) are left unchanged.
+    # Returns the snapped geometries and a boolean array of the geometries that were changed.
+    import shapely
+    geoms = np.asarray(geoms, dtype=object)
+    base_geoms = np.asarray(base_geoms, dtype=object)
+    todo = ~shapely.is_missing(geoms)
+    if skip is not None:
+        todo = todo & ~np.asarray(skip, dtype=bool)
+    todo_geoms = geoms[todo]
+    coords, index = shapely.get_coordinates(todo_geoms, return_index=True)
+
+    if snap_type == "VERTEX":
+        targets = np.unique(shapely.get_coordinates(base_geoms), axis=0)
+        tree = shapely.STRtree(shapely.points(targets))
+    elif snap_type == "EDGE":
+        targets = shapely.boundary(base_geoms)
+        tree = shapely.STRtree(targets)
+    else:
+        raise ValueError("Snap type must be VERTEX or EDGE, not " + str(snap_type))
+
+    new_coords = coords.copy()
+    for start in range(0, len(coords), chunk_size):
+        points = shapely.points(coords[start:start + chunk_size])
+        point_index, target_index = tree.query_nearest(points, max_distance=tolerance, all_matches=False)
+        if snap_type == "VERTEX":
+            new_coords[start + point_index] = targets[target_index]
+        else:
+            nearest = shapely.get_point(shapely.shortest_line(points[point_index], targets[target_index]), 1)
+            new_coords[start + point_index] = shapely.get_coordinates(nearest)
+
+    # Only rebuild the geometries that have at least one vertex moved
+    moved = np.any(new_coords != coords, axis=1)
+    changed_todo = np.zeros(len(todo_geoms), dtype=bool)
+    changed_todo[index[moved]] = True
+    changed_index = np.flatnonzero(changed_todo)
+    changed_geoms = todo_geoms[changed_index]
+    keep_vertex = changed_todo[index]
+    shapely.set_coordinates(changed_geoms, new_coords[keep_vertex])
+
+    out_geoms = geoms.copy()
+    todo_index = np.flatnonzero(todo)
+    out_geoms[todo_index[changed_index]] = changed_geoms
+    changed = np.zeros(len(geoms), dtype=bool)
+    changed[todo_index[changed_index]] = True
+    return out_geoms, changed
+
+
+def make_tiles(xmin, ymin, xmax, ymax, tile_size):
+    # Square grid of tiles covering an extent, numbered row by row from the bottom left, for the tiled merge in Tile_merge.py.
+    # Returns the number of columns and rows of the grid and arrays of the tile extents (xmin, ymin, xmax, ymax).
+    num_columns = max(1, int(np.ceil((xmax - xmin) / float(tile_size))))
+    num_rows = max(1, int(np.ceil((ymax - ymin) / float(tile_size))))
+    x, y = np.meshgrid(xmin + tile_size * np.arange(num_columns), ymin + tile_size * np.arange(num_rows))
+    x = x.ravel()
+    y = y.ravel()
+    return num_columns, num_rows, (x, y, x + tile_size, y + tile_size)
+
+
+def home_tiles(x, y, xmin, ymin, tile_size, num_columns, num_rows):
+    # Index of the 'home' tile of each point in the grid from make_tiles. With the label point of each polygon (which is always inside
+    # the polygon) every polygon belongs to exactly one tile even if it crosses tile edges, and only the points need to be in memory.
+    # Points on a tile edge go to the tile above or to the right; points just outside the grid go to the nearest edge tile.
+    column = np.floor((np.asarray(x, dtype=np.float64) - xmin) / tile_size).astype(np.int64)
+    row = np.floor((np.asarray(y, dtype=np.float64) - ymin) / tile_size).astype(np.int64)
+    return np.clip(row, 0, num_rows - 1) * num_columns + np.clip(column, 0, num_columns - 1)
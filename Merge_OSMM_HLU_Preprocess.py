@@ -14,10 +14,15 @@
 # Any phase 1 habitats which are set as 'Unknown' or 'Unidentified' should be assigned
 # categories based on the S41 habitat column  or via aerial photo interpretation
 # ----------------------------------------------------------------------------------------------------------
+# This script still needs ArcGIS (arcpy): only some of its steps go through the geometry backend (see below)
+# ----------------------------------------------------------------------------------------------------------
 
+import sys
 import time
 import arcpy
+import BackendFunctions
 import MyFunctions
+import PipelineFunctions
 
 print(''.join(["## Started on : ", time.ctime()]))
 
@@ -49,8 +54,21 @@ delete_not_needed_fields_HLU = True
 delete_OSMM_overlaps = True
 delete_and_erase_HLU = True
 elim_HLU_slivers = True
+# Eliminate slivers and delete standalone slivers and gaps in one pass with MyFunctions.eliminate_slivers.
+# Needs Python 3 (ArcGIS Pro) with shapely 2.0.
+python_eliminate = False
 check = True
 
+# Parameters can be overridden by the benchmark harness (Benchmark.py), and the gdb given on the command line
+PipelineFunctions.apply_overrides(globals())
+if len(sys.argv) > 1:
+    gdb = sys.argv[1]
+    arcpy.env.workspace = gdb
+# Clip, copy, delete rows, multipart to singlepart and delete identical go through the geometry backend (see BackendFunctions.py).
+# The erase of a selection, self-union with NO_GAPS and Eliminate (largest area) have no backend equivalent yet and still use arcpy,
+# so this script still needs ArcGIS even with NATCAP_BACKEND=open.
+backend = BackendFunctions.get_backend(gdb)
+
 # Main code
 # ----------
 print(''.join(["## Started analysing ", gdb, " on : ", time.ctime()]))
@@ -59,11 +77,11 @@ print(''.join(["## Started analysing ", gdb, " on : ", time.ctime()]))
 # Input feature classes must be suffixed with "_in" in order to clip
 if clip_HLU:
     print("Clipping " + HLU)
-    arcpy.Clip_analysis(HLU + "_in", boundary, HLU)
+    backend.clip(HLU + "_in", boundary, HLU)
     print("## Finished clipping " + HLU + "on : " + time.ctime())
 if clip_OSMM:
     print("Clipping " + OSMM)
-    arcpy.Clip_analysis(OSMM + "_in", boundary, OSMM)
+    backend.clip(OSMM + "_in", boundary, OSMM)
     print(''.join(["## Finished clipping OSMM on : ", time.ctime()]))
 # Optional step: delete not needed fields
 if delete_not_needed_fields_OSMM:
@@ -77,32 +95,23 @@ if delete_not_needed_fields_HLU:
 if delete_OSMM_overlaps:
     ###  Deleting overlapping "landform" features in OSMM
     print("   Deleting overlapping 'Landform' and 'Pylon' from OSMM")
-    arcpy.CopyFeatures_management(OSMM, "OSMM_noLandform")
-    arcpy.MakeFeatureLayer_management("OSMM_noLandform", "OSMM_layer")
+    backend.copy(OSMM, "OSMM_noLandform")
     expression = "DescriptiveGroup LIKE '%Landform%' OR DescriptiveTerm IN ('Cliff','Slope','Pylon')"
-    arcpy.SelectLayerByAttribute_management("OSMM_layer", where_clause=expression)
-    arcpy.DeleteFeatures_management("OSMM_layer")
-    arcpy.Delete_management("OSMM_layer")
+    backend.delete_rows("OSMM_noLandform", expression)
     print("   Finished deleting overlapping 'Landform' and 'Pylon' from OSMM")
 
 if delete_and_erase_HLU:
     # Delete HLU water features as we prefer to use OSMM
     print("   Deleting HLU water")
-    arcpy.CopyFeatures_management(HLU, "HLU_noWater")
-    arcpy.MakeFeatureLayer_management("HLU_noWater", "HLU_layer")
-    arcpy.SelectLayerByAttribute_management("HLU_layer", where_clause="PHASE1HAB LIKE '%ater%'")
-    arcpy.DeleteFeatures_management("HLU_layer")
-    arcpy.Delete_management("HLU_layer")
+    backend.copy(HLU, "HLU_noWater")
+    backend.delete_rows("HLU_noWater", "PHASE1HAB LIKE '%ater%'")
     print("   Finished deleting HLU water")
 
     # Delete HLU built up or unknown polygons as they do not add any useful information, unless S41 habitat is present
     # (change by Alison 21 Oct 2022, not yet tested)
     print("   Deleting HLU built-up or unknown areas")
-    arcpy.MakeFeatureLayer_management("HLU_noWater", "HLU_layer2")
     expression = "(PHASE1HAB LIKE '%uilt-up%' or PHASE1HAB IN ['Unknown','Unidentified','']) AND S41Habitat NOT IN ['none','not assessed yet','',' ']"
-    arcpy.SelectLayerByAttribute_management("HLU_layer2", where_clause=expression)
-    arcpy.DeleteFeatures_management("HLU_layer2")
-    arcpy.Delete_management("HLU_layer2")
+    backend.delete_rows("HLU_noWater", expression)
     print("   Finished deleting HLU built-up or unknown areas")
 
     ###  Erasing OSMM buildings, roads and paths from HLU
@@ -126,30 +135,32 @@ if delete_and_erase_HLU:
 
 if elim_HLU_slivers:
     # Eliminate and then delete slivers (just deleting creates gaps).
-    arcpy.MultipartToSinglepart_management("HLU_Manerase_union", "HLU_Manerase_union_sp")
-    print("   Eliminating HLU slivers")
-    arcpy.MakeFeatureLayer_management("HLU_Manerase_union_sp", "HLU_elim_layer")
-    arcpy.SelectLayerByAttribute_management("HLU_elim_layer", where_clause="(Shape_Area <1)")
-    arcpy.Eliminate_management("HLU_elim_layer", "HLU_Manerase_union_sp_elim")
-
-    print("   Deleting remaining standalone slivers")
-    arcpy.CopyFeatures_management("HLU_Manerase_union_sp_elim", "HLU_Manerase_union_sp_elim_del")
-    arcpy.MakeFeatureLayer_management("HLU_Manerase_union_sp_elim_del", "HLU_del_layer")
-    arcpy.SelectLayerByAttribute_management("HLU_del_layer", where_clause="Shape_Area < 1")
-    arcpy.DeleteFeatures_management("HLU_del_layer")
-
-    print("   Deleting larger gaps")
-    arcpy.CopyFeatures_management("HLU_Manerase_union_sp_elim_del", "HLU_Manerase_union_sp_elim_del2")
-    arcpy.MakeFeatureLayer_management("HLU_Manerase_union_sp_elim_del2", "HLU_del_gap_layer")
-    arcpy.SelectLayerByAttribute_management("HLU_del_gap_layer", where_clause="(FID_HLU_Manerase=-1)")
-    arcpy.DeleteFeatures_management("HLU_del_gap_layer")
+    backend.multipart_to_singlepart("HLU_Manerase_union", "HLU_Manerase_union_sp")
+    if python_eliminate:
+        print("   Eliminating HLU slivers and deleting remaining standalone slivers and larger gaps")
+        num_elim, num_del = MyFunctions.eliminate_slivers("HLU_Manerase_union_sp", "HLU_Manerase_union_sp_elim_del2", "(Shape_Area <1)",
+                                                          delete_size=1, delete_expression="(FID_HLU_Manerase=-1)")
+        print("   " + str(num_elim) + " slivers eliminated and " + str(num_del) + " standalone slivers and gaps deleted")
+    else:
+        print("   Eliminating HLU slivers")
+        arcpy.MakeFeatureLayer_management("HLU_Manerase_union_sp", "HLU_elim_layer")
+        arcpy.SelectLayerByAttribute_management("HLU_elim_layer", where_clause="(Shape_Area <1)")
+        arcpy.Eliminate_management("HLU_elim_layer", "HLU_Manerase_union_sp_elim")
+
+        print("   Deleting remaining standalone slivers")
+        backend.copy("HLU_Manerase_union_sp_elim", "HLU_Manerase_union_sp_elim_del")
+        backend.delete_rows("HLU_Manerase_union_sp_elim_del", "Shape_Area < 1")
+
+        print("   Deleting larger gaps")
+        backend.copy("HLU_Manerase_union_sp_elim_del", "HLU_Manerase_union_sp_elim_del2")
+        backend.delete_rows("HLU_Manerase_union_sp_elim_del2", "(FID_HLU_Manerase=-1)")
 
     print("   Deleting identical HLU polygons")
-    arcpy.CopyFeatures_management("HLU_Manerase_union_sp_elim_del2", "HLU_Manerase_union_sp_elim_delid")
-    arcpy.DeleteIdentical_management("HLU_Manerase_union_sp_elim_delid", ["Shape"])
+    backend.copy("HLU_Manerase_union_sp_elim_del2", "HLU_Manerase_union_sp_elim_delid")
+    backend.delete_identical("HLU_Manerase_union_sp_elim_delid", ["Shape"])
 
 if check:
-    arcpy.CopyFeatures_management("HLU_Manerase_union_sp_elim_delid", "HLU_preprocessed")
+    backend.copy("HLU_Manerase_union_sp_elim_delid", "HLU_preprocessed")
     MyFunctions.check_and_repair("HLU_preprocessed")
 
 print(''.join(["## Completed on : ", time.ctime()]))
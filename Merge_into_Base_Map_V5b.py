@@ -30,6 +30,8 @@ import os
 import MyFunctions
 import sys
 import traceback
+import collections
+import PipelineFunctions
 
 arcpy.CheckOutExtension("Spatial")
 
@@ -47,6 +49,8 @@ merge_type = "Oxon_Designations"
 # merge_type = "CROME_PHI"
 # merge_type = "Designations"
 # merge_type = "Arc_access"
+# The benchmark harness (Benchmark.py) can choose the merge type and override any parameter set below
+merge_type = PipelineFunctions.override("merge_type", merge_type)
 
 region = "Oxon"
 # region = "Arc"
@@ -289,10 +293,59 @@ if merge_type == "Designations" or merge_type == "Arc_access" or merge_type == "
 else:
     clip_new = False
 snap_new_features = False      # No need to snap if input features are consistent with base map geometry
+# The python_snap, python_tabulate and python_eliminate engines use shapely 2.0, so they need Python 3 (ArcGIS Pro) with shapely
+# installed. Leave them False when running this script in ArcMap (Python 2).
+# Snap with the STRtree vertex/edge snapping engine in MergeFunctions instead of Snap_edit (minutes instead of hours for a county)
+python_snap = False
 tabulate_intersections = True
+# Use the pure Python (shapely STRtree) overlap engine in MergeFunctions instead of TabulateIntersection_analysis,
+# and classify the overlaps in a single vectorised pass instead of a CalculateField codeblock.
+# Much faster for large LADs; needs shapely (see above).
+python_tabulate = False
 make_joint_shapes = True
+# Group the TI table by base map polygon in memory and apply the results with dictionary-keyed update cursors, instead of
+# copying, sorting and de-duplicating Base_TI and running AddJoin / CalculateField / RemoveJoin cycles on the joint layer.
+# Only needs numpy, so this also works in ArcMap.
+in_memory_joins = True
+# Eliminate and delete slivers in one pass with MyFunctions.eliminate_slivers, writing one output instead of three feature classes
+python_eliminate = False
 repair_before_elim = True    # This may not be needed
 join_new_attributes = True
+# Record each completed stage in a manifest next to the gdb and skip stages whose inputs and settings have not changed since they
+# last completed, so after a failure the script can simply be restarted. The flags above still switch stages off completely.
+# Only row counts and extents are compared, so after editing attributes by hand delete the stage from the manifest (or the
+# whole <gdb>_manifest.json file) to force it to rerun.
+resume_stages = True
+# Where to put intermediate datasets that are only read by the next few steps: "in_memory", "gdb" (a temporary gdb that is deleted
+# when the LAD completes) or None to write them all to the LAD gdb as before (useful for debugging). Stage outputs that are needed
+# for resuming (New_snap_clean, Base_TI, Joint_spatial_merge_repair_sp) are always written to the LAD gdb.
+scratch_mode = "in_memory"
+# Record the time and row counts of each stage in <gdb>_timings.jsonl next to the gdb (see TimingFunctions.py)
+log_timings = True
+# Extra fields to keep on the rows that are re-joined to new feature attributes (e.g. Home_tile and Orig_base_ID in Tile_merge.py)
+keep_fields = []
+
+PipelineFunctions.apply_overrides(globals())
+
+if python_tabulate or in_memory_joins:
+    import MergeFunctions
+
+# Stage graph for resuming, in the order the stages are run: input datasets, output datasets and settings for each stage.
+# When a stage is rerun, the records of all later stages are removed from the manifest so they are rerun too.
+stages = collections.OrderedDict()
+stages["sp_base"] = ([Base_map_name], [Base_map_name + "_sp"], None)
+stages["clip_new"] = ([New_in, "boundary"], [New_features], None)
+stages["snap_new_features"] = ([New_features, Base_map_name + "_sp"], ["New_snap_clean"],
+                               {"snap_env": snap_env, "xy_tol": xy_tol, "sliver_size": sliver_size})
+stages["tabulate_intersections"] = ([Base_map_name + "_sp", "New_snap_clean"], ["Base_TI"],
+                                    {"ignore_low": ignore_low, "ignore_high": ignore_high, "significant_size": significant_size})
+stages["make_joint_shapes"] = ([Base_map_name + "_sp", "New_snap_clean", "Base_TI"], ["Joint_spatial_merge_repair_sp"],
+                               {"xy_tol": xy_tol, "sliver_size": sliver_size})
+stages["join_new_attributes"] = (["Joint_spatial_merge_repair_sp", "New_snap_clean", "Base_TI"], [Output_fc], None)
+
+# If gdbs are given on the command line (e.g. by Parallel_LADs.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
 
 # Main code
 # -------------------------
@@ -302,6 +355,15 @@ error_messages = []
 for gdb in gdbs:
     arcpy.env.workspace = gdb
     Base_map = Base_map_name
+    # In-memory TI table and overlap groups for this gdb (only used with python_tabulate or in_memory_joins)
+    TI_columns = None
+    largest_overlap = None
+    scratch = MyFunctions.ScratchWorkspace(scratch_mode)
+    if resume_stages:
+        manifest = PipelineFunctions.load_manifest(gdb)
+    else:
+        manifest = None
+    timing_log = MyFunctions.step_log(gdb, "Merge_into_Base_Map_V5b") if log_timings else None
     i = i + 1
     print (''.join(["## Started processing ", gdb, " which is number " + str(i) + " out of " + str(len(gdbs)) + " on : ", time.ctime()]))
 
@@ -310,47 +372,54 @@ for gdb in gdbs:
     # # This one added at a later stage, also added to JoinGreenspace to pick up early gdbs (before County Durham)
     # MyFunctions.select_and_copy(Base_map, "Interpreted_habitat", "descriptiveterm IS NULL AND descriptivegroup = 'Tidal Water'",
     #                             "'Saltwater'")
-    if sp_base:
-        numrows = arcpy.GetCount_management(Base_map)
+    if sp_base and MyFunctions.stage_needed(manifest, stages, "sp_base", timing_log):
+        numrows = MyFunctions.count_rows(Base_map)
         print("   Converting base map to single part. " + str(numrows) + " features present initially.")
         arcpy.MultipartToSinglepart_management(Base_map, Base_map + "_sp")
-        numrows = arcpy.GetCount_management(Base_map + "_sp")
+        numrows = MyFunctions.count_rows(Base_map + "_sp")
         print("   " + str(numrows) + " features present after conversion of " + Base_map + " to single part.")
+        MyFunctions.stage_completed(gdb, manifest, stages, "sp_base", timing_log)
     # If this step is omitted during debugging, the code later on needs to know that Base_map now = Base_map_sp
     Base_map = Base_map + "_sp"
 
-    if clip_new:
+    if clip_new and MyFunctions.stage_needed(manifest, stages, "clip_new", timing_log):
         # Clip new features to match the area boundary
         print ("   Clipping new features")
-        numrows = arcpy.GetCount_management(New_in)
+        numrows = MyFunctions.count_rows(New_in)
         print("   " + str(numrows) + " features present in new feature input file")
-        numrows = arcpy.GetCount_management("boundary")
+        numrows = MyFunctions.count_rows("boundary")
         print("   " + str(numrows) + " features present in boundary file")
         arcpy.Clip_analysis(New_in, "boundary", New_features)
+        MyFunctions.stage_completed(gdb, manifest, stages, "clip_new", timing_log)
 
     try:
         msgs = ""
         pymsgs = ""
         # Snapping and cleaning new features to match base map features when similar. Takes about 10 hours for Oxon OSMM.
         # ------------------------------------------------------------------------------------------------------------
-        if snap_new_features:
+        if snap_new_features and MyFunctions.stage_needed(manifest, stages, "snap_new_features", timing_log):
             # Snapping new features to be closer to base map
             # Start of section that needs to be commented out if you need to snap manually in ArcMAP
-            print("   Snapping new features to fit base map features better. New feature rows: " + str(arcpy.GetCount_management(New_features)))
+            print("   Snapping new features to fit base map features better. New feature rows: " + str(MyFunctions.count_rows(New_features)))
             print("     Creating snap layer")
             arcpy.CopyFeatures_management(New_features, "New_snap")
-            arcpy.MakeFeatureLayer_management("New_snap", "Snap_layer")
-            # Only snap features that are not already identical
-            arcpy.SelectLayerByLocation_management("Snap_layer", "are_identical_to", Base_map, invert_spatial_relationship="INVERT")
-
-            # Optional densify currently disabled - makes snap take much longer.
-            # print("   Densifying new features")
-            # arcpy.Densify_edit("Snap_layer", "DISTANCE", "1")
-
-            print("     Snapping - takes about 15 mins for OSMM-PHI for a LAD, 12 hours for OSMM-Phase 1 habitats in Oxfordshire, "
-                  "70 minutes for merging in Oxfordshire designations")
-            arcpy.Snap_edit("Snap_layer", snap_env)
-            arcpy.Delete_management("Snap_layer")
+            if python_snap:
+                print("     Snapping")
+                num_snapped = MyFunctions.snap_features("New_snap", snap_env, skip_identical_to=Base_map)
+                print("     " + str(num_snapped) + " features snapped")
+            else:
+                arcpy.MakeFeatureLayer_management("New_snap", "Snap_layer")
+                # Only snap features that are not already identical
+                arcpy.SelectLayerByLocation_management("Snap_layer", "are_identical_to", Base_map, invert_spatial_relationship="INVERT")
+
+                # Optional densify currently disabled - makes snap take much longer.
+                # print("   Densifying new features")
+                # arcpy.Densify_edit("Snap_layer", "DISTANCE", "1")
+
+                print("     Snapping - takes about 15 mins for OSMM-PHI for a LAD, 12 hours for OSMM-Phase 1 habitats in Oxfordshire, "
+                      "70 minutes for merging in Oxfordshire designations")
+                arcpy.Snap_edit("Snap_layer", snap_env)
+                arcpy.Delete_management("Snap_layer")
             # End of section that needs to be commented out if you have to snap manually in ArcMAP
 
             print(''.join(["   ## Snapping completed on : ", time.ctime()]))
@@ -364,33 +433,46 @@ for gdb in gdbs:
             # Sometimes it will work in ArcMap instead (try not entering a numerical rank or cluster tolerance)
             # If the designation data and base map polygons have not changed, you can set 'snap_new_features' to false and omit
             # this part of the code. Sometimes it then crashes at Tabulate Intersection as well but this can be done manually in ArcMap.
+            New_snap_union = scratch.path("New_snap_union")
+            New_snap_union_sp = scratch.path("New_snap_union_sp")
+            New_snap_union_sp_delid = scratch.path("New_snap_union_sp_delid", needs_area=True)
             union_failed = True
-            arcpy.Union_analysis([["New_snap", 1]], "New_snap_union", "NO_FID", cluster_tolerance=xy_tol)
+            arcpy.Union_analysis([["New_snap", 1]], New_snap_union, "NO_FID", cluster_tolerance=xy_tol)
             union_failed = False
-            arcpy.MultipartToSinglepart_management("New_snap_union", "New_snap_union_sp")
+            arcpy.MultipartToSinglepart_management(New_snap_union, New_snap_union_sp)
+            scratch.consumed(New_snap_union)
 
             print("      Deleting identical polygons after snap and union")
-            arcpy.CopyFeatures_management("New_snap_union_sp", "New_snap_union_sp_delid")
-            arcpy.DeleteIdentical_management("New_snap_union_sp_delid", ["Shape"])
-
-            print("      Eliminating slivers after snap and union")
-            arcpy.MakeFeatureLayer_management("New_snap_union_sp_delid", "Elim_layer")
-            arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause="Shape_Area < " + str(sliver_size) )
-            arcpy.Eliminate_management("Elim_layer", "New_snap_union_sp_delid_elim")
-            arcpy.Delete_management("Elim_layer")
-
-            print("      Deleting remaining standalone slivers")
-            arcpy.CopyFeatures_management("New_snap_union_sp_delid_elim", "New_snap_union_sp_delid_elim_del")
-            arcpy.MakeFeatureLayer_management("New_snap_union_sp_delid_elim_del", "Del_layer")
-            arcpy.SelectLayerByAttribute_management("Del_layer", where_clause="Shape_Area < " + str(sliver_size) )
-            arcpy.DeleteFeatures_management("Del_layer")
-            arcpy.Delete_management("Del_layer")
-            arcpy.CopyFeatures_management("New_snap_union_sp_delid_elim_del", "New_snap_clean")
+            arcpy.CopyFeatures_management(New_snap_union_sp, New_snap_union_sp_delid)
+            scratch.consumed(New_snap_union_sp)
+            arcpy.DeleteIdentical_management(New_snap_union_sp_delid, ["Shape"])
+
+            if python_eliminate:
+                print("      Eliminating slivers after snap and union and deleting remaining standalone slivers")
+                num_elim, num_del = MyFunctions.eliminate_slivers(New_snap_union_sp_delid, "New_snap_clean",
+                                                                  "Shape_Area < " + str(sliver_size), delete_size=sliver_size)
+                print("      " + str(num_elim) + " slivers eliminated and " + str(num_del) + " standalone slivers deleted")
+            else:
+                print("      Eliminating slivers after snap and union")
+                arcpy.MakeFeatureLayer_management(New_snap_union_sp_delid, "Elim_layer")
+                arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause="Shape_Area < " + str(sliver_size) )
+                arcpy.Eliminate_management("Elim_layer", "New_snap_union_sp_delid_elim")
+                arcpy.Delete_management("Elim_layer")
+
+                print("      Deleting remaining standalone slivers")
+                arcpy.CopyFeatures_management("New_snap_union_sp_delid_elim", "New_snap_union_sp_delid_elim_del")
+                arcpy.MakeFeatureLayer_management("New_snap_union_sp_delid_elim_del", "Del_layer")
+                arcpy.SelectLayerByAttribute_management("Del_layer", where_clause="Shape_Area < " + str(sliver_size) )
+                arcpy.DeleteFeatures_management("Del_layer")
+                arcpy.Delete_management("Del_layer")
+                arcpy.CopyFeatures_management("New_snap_union_sp_delid_elim_del", "New_snap_clean")
+            scratch.consumed(New_snap_union_sp_delid)
             MyFunctions.check_and_repair("New_snap_clean")
+            MyFunctions.stage_completed(gdb, manifest, stages, "snap_new_features", timing_log)
 
         # Deciding which polygons to split, to incorporate new feature boundaries
         # -----------------------------------------------------------------------
-        if tabulate_intersections == True:
+        if tabulate_intersections == True and MyFunctions.stage_needed(manifest, stages, "tabulate_intersections", timing_log):
 
             # Save ObjectID to separate field as this will be used later (also area, just for info). Check first to see if new fields already added.
             print "   ## Tabulating intersections"
@@ -409,18 +491,32 @@ for gdb in gdbs:
             arcpy.CalculateField_management(Base_map, base_area, '!Shape_Area!', "PYTHON_9.3")
 
             print("      Calculating percentage areas of new features within each base map polygon")
-            arcpy.TabulateIntersection_analysis(Base_map, [base_ID, base_key, base_TI_fields, base_area],
-                                                "New_snap_clean", "Base_TI", [new_ID, new_key, new_TI_fields, new_area],
-                                                xy_tolerance=xy_tol)
+            if python_tabulate:
+                TI_columns, TI_fields = MyFunctions.tabulate_intersection_columns(Base_map, [base_ID, base_key, base_TI_fields, base_area],
+                                                                                  "New_snap_clean", [new_ID, new_key, new_TI_fields, new_area],
+                                                                                  xy_tol)
+
+                # Decide which polygons to split (see the ArcGIS version below). The relationship is held as an int8 code in memory
+                # and only converted to text when Base_TI is written.
+                print("      Interpreting overlaps and deciding which polygons to split")
+                TI_relationship = MergeFunctions.classify_relationships(TI_columns["AREA"], TI_columns["PERCENTAGE"],
+                                                                        ignore_low, ignore_high, significant_size)
+                TI_columns[Relationship_field] = MergeFunctions.relationship_names(TI_relationship)
+                MyFunctions.write_table(TI_columns, TI_fields + [Relationship_field], "Base_TI")
+            else:
+                arcpy.TabulateIntersection_analysis(Base_map, [base_ID, base_key, base_TI_fields, base_area],
+                                                    "New_snap_clean", "Base_TI", [new_ID, new_key, new_TI_fields, new_area],
+                                                    xy_tolerance=xy_tol)
 
             # Decide which polygons to split, based on the percentage of overlap and the absolute area of the overlap
             # Also decide whether the polygon should be interpreted as new feature or base map attributes, in cases where they conflict.
-            print("      Interpreting overlaps and deciding which polygons to split")
+            if not python_tabulate:
+                print("      Interpreting overlaps and deciding which polygons to split")
 
-            # Add Relationship field to identify which polygons to split, which to add new feature information to, and which to retain unchanged
-            MyFunctions.check_and_add_field("Base_TI", Relationship_field, "TEXT", 0)
+                # Add Relationship field to identify which polygons to split, which to add new feature information to, and which to retain unchanged
+                MyFunctions.check_and_add_field("Base_TI", Relationship_field, "TEXT", 0)
 
-            codeblock = """
+                codeblock = """
 def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, significant_size):
     if percent_overlap < ignore_low and overlap_area < significant_size:     # ignore small overlaps
         return "Base"
@@ -429,33 +525,51 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
     else:
         return "New"                     # very high overlaps - whole polygon is assigned new feature characteristics
 """
-            expression = "relationship(!AREA!, !PERCENTAGE!, " + ', '.join([str(ignore_low), str(ignore_high), str(significant_size)]) + ")"
-            arcpy.CalculateField_management("Base_TI", Relationship_field, expression, "PYTHON_9.3", codeblock)
+                expression = "relationship(!AREA!, !PERCENTAGE!, " + ', '.join([str(ignore_low), str(ignore_high), str(significant_size)]) + ")"
+                arcpy.CalculateField_management("Base_TI", Relationship_field, expression, "PYTHON_9.3", codeblock)
 
             print(''.join(["   ## Interpretation of overlaps completed on : ", time.ctime()]))
+            MyFunctions.stage_completed(gdb, manifest, stages, "tabulate_intersections", timing_log)
 
         # Combining geometry to create joint shapes, splitting base map polygons where necessary to reflect new features
         # --------------------------------------------------------------------------------------------------------------
-        if make_joint_shapes == True:
+        run_joint_shapes = make_joint_shapes and MyFunctions.stage_needed(manifest, stages, "make_joint_shapes", timing_log)
+        # If the joint shapes are remade, the new attributes must be joined again
+        run_join_attributes = join_new_attributes and (run_joint_shapes or MyFunctions.stage_needed(manifest, stages, "join_new_attributes", timing_log))
+        if (run_joint_shapes or run_join_attributes) and in_memory_joins:
+            # Group the TI rows by base map ID: the base and new feature IDs of overlaps marked 'Split', and the new feature ID
+            # and relationship of the largest non-split overlap for each base polygon. This replaces the Base_TI_split and
+            # Base_TI_not_split_sort tables, so those are not created.
+            print("      Grouping TI table rows by base map polygon")
+            if TI_columns is None:
+                TI_columns = MyFunctions.read_columns("Base_TI", [base_ID, new_ID, "AREA", Relationship_field])
+                TI_relationship = MergeFunctions.relationship_codes(TI_columns[Relationship_field])
+            split_base_IDs, split_new_IDs, largest_overlap = MergeFunctions.partition_overlaps(TI_columns[base_ID], TI_columns[new_ID],
+                                                                                                TI_columns["AREA"], TI_relationship)
+            print("      " + str(len(split_base_IDs)) + " base map polygons to split, " + str(len(largest_overlap)) +
+                  " with non-split overlaps")
+
+        if run_joint_shapes == True:
             print("   ## Combining geometry")
 
-            # Make different versions of the TI table, which we will use for the different joins
-            print("      Separating split and unsplit polygons from TI table")
-            # Need to copy to a new table, otherwise the join is not robust - it is one to many so can join to a non-split row, even with selection
-            arcpy.CopyRows_management("Base_TI", "Base_TI_not_split")
-            arcpy.MakeTableView_management("Base_TI_not_split", "Base_TI_split_lyr")
-            arcpy.SelectLayerByAttribute_management("Base_TI_split_lyr", where_clause= Relationship_field + " =  'Split'")
-            arcpy.CopyRows_management("Base_TI_split_lyr","Base_TI_split")
-            arcpy.DeleteRows_management("Base_TI_split_lyr")
-            arcpy.Delete_management("Base_TI_split_lyr")
-
-            # Sort the non-split TI table by size, and then delete identical base map IDs so that only the largest intersection is left.
-            # This should avoid problems with one-to-many joins accidentally joining slivers instead of the main new feature later.
-            # These are un-split polygons so we only want data from one new feature (the largest intersection) per base map ID.
-            # Need to use relationship (base or new / split) to distinguish slivers from new features that occupy almost the whole polygon
-            print("      Sorting un-split TI table by size so that polygons join to the correct feature")
-            arcpy.Sort_management("Base_TI_not_split", "Base_TI_not_split_sort", [["AREA", "DESCENDING"]])
-            arcpy.DeleteIdentical_management("Base_TI_not_split_sort",[base_ID])
+            if not in_memory_joins:
+                # Make different versions of the TI table, which we will use for the different joins
+                print("      Separating split and unsplit polygons from TI table")
+                # Need to copy to a new table, otherwise the join is not robust - it is one to many so can join to a non-split row, even with selection
+                arcpy.CopyRows_management("Base_TI", "Base_TI_not_split")
+                arcpy.MakeTableView_management("Base_TI_not_split", "Base_TI_split_lyr")
+                arcpy.SelectLayerByAttribute_management("Base_TI_split_lyr", where_clause= Relationship_field + " =  'Split'")
+                arcpy.CopyRows_management("Base_TI_split_lyr","Base_TI_split")
+                arcpy.DeleteRows_management("Base_TI_split_lyr")
+                arcpy.Delete_management("Base_TI_split_lyr")
+
+                # Sort the non-split TI table by size, and then delete identical base map IDs so that only the largest intersection is left.
+                # This should avoid problems with one-to-many joins accidentally joining slivers instead of the main new feature later.
+                # These are un-split polygons so we only want data from one new feature (the largest intersection) per base map ID.
+                # Need to use relationship (base or new / split) to distinguish slivers from new features that occupy almost the whole polygon
+                print("      Sorting un-split TI table by size so that polygons join to the correct feature")
+                arcpy.Sort_management("Base_TI_not_split", "Base_TI_not_split_sort", [["AREA", "DESCENDING"]])
+                arcpy.DeleteIdentical_management("Base_TI_not_split_sort",[base_ID])
 
             print("      Creating joint spatial layer")
             arcpy.CopyFeatures_management(Base_map, "Joint_spatial")
@@ -464,6 +578,20 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
             print ("      Adding relationship field")
             MyFunctions.check_and_add_field("Joint_spatial", Relationship_field, "TEXT", 10)
 
+            if in_memory_joins:
+                # Mark the base map polygons to be split, and the new features that split them, with one update cursor pass each
+                print("      Copying relationship for polygons to be split")
+                split_lookup = dict((ID, "Split") for ID in split_base_IDs)
+                MyFunctions.update_field_from_dict("Joint_spatial", base_ID, Relationship_field, split_lookup)
+                print("      First join completed (base map)")
+
+                arcpy.CopyFeatures_management("New_snap_clean", "New_snap_clean_spatial")
+                MyFunctions.check_and_add_field("New_snap_clean_spatial", Relationship_field, "TEXT", 10)
+                split_lookup = dict((ID, "Split") for ID in split_new_IDs)
+                MyFunctions.update_field_from_dict("New_snap_clean_spatial", new_ID, Relationship_field, split_lookup)
+                print("      Second join completed (new features)")
+
+        if run_joint_shapes == True and not in_memory_joins:
             # Identify which polygons should be split, by joining to the TI table rows marked 'split'.
             print("      Making split polygon layer")
             arcpy.MakeFeatureLayer_management("Joint_spatial","join_lyr")
@@ -487,17 +615,25 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
             arcpy.JoinField_management("New_snap_clean_spatial", new_ID, "Base_TI_split", new_ID, [Relationship_field])
             print("      Second join completed (new features)")
 
+        if run_joint_shapes == True:
             print("      Clipping")
             arcpy.MakeFeatureLayer_management("Joint_spatial", "Joint_lyr")
             arcpy.SelectLayerByAttribute_management("Joint_lyr", where_clause=Relationship_field + " = 'Split'")
             arcpy.MakeFeatureLayer_management("New_snap_clean_spatial", "clip_lyr")
-            arcpy.Clip_analysis("clip_lyr", "Joint_lyr", "Joint_spatial_clip", cluster_tolerance=xy_tol)
+            Joint_spatial_clip = scratch.path("Joint_spatial_clip")
+            arcpy.Clip_analysis("clip_lyr", "Joint_lyr", Joint_spatial_clip, cluster_tolerance=xy_tol)
             arcpy.Delete_management("clip_lyr")
 
             print("      Unioning clipped new features with the base map polygons that they split")
-            arcpy.Union_analysis([["Joint_lyr", 1], ["Joint_spatial_clip", 1]], "Joint_spatial_clip_union", "NO_FID",
+            if in_memory_joins:
+                Joint_spatial_clip_union = scratch.path("Joint_spatial_clip_union")
+            else:
+                # Also read by the sort below
+                Joint_spatial_clip_union = scratch.path("Joint_spatial_clip_union", consumers=2, needs_area=True)
+            arcpy.Union_analysis([["Joint_lyr", 1], [Joint_spatial_clip, 1]], Joint_spatial_clip_union, "NO_FID",
                                  cluster_tolerance=xy_tol)
             arcpy.Delete_management("Joint_lyr")
+            scratch.consumed(Joint_spatial_clip)
 
             # CAUTION: There are now two copies of the Relationship field - one from the one from the unioned base map with all rows 'split'
             # and one from the clipped new features, with some polygons marked 'split' and some either null or blank.
@@ -507,48 +643,64 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
             # So we now want to match the non-split parts of these polygons (joined in via the Union) with the correct
             # ID from the TI table, so that attributes can be transferred later. We do this by sorting both the TI tables and
             # the unioned clip file by size, so that the split polygon parts are matched with the intersections of the same size.
-            arcpy.Sort_management("Joint_spatial_clip_union", "Joint_spatial_clip_union_sort", [["Shape_Area", "DESCENDING"]])
-            arcpy.MakeFeatureLayer_management("Joint_spatial_clip_union_sort", "join_lyr2")
-            arcpy.AddJoin_management("join_lyr2", base_ID, "Base_TI_not_split_sort", base_ID, "KEEP_ALL")
-            expression = "Joint_spatial_clip_union_sort." + new_key + " IS NULL OR Joint_spatial_clip_union_sort." + new_key + " = ''"
-            arcpy.SelectLayerByAttribute_management("join_lyr2", where_clause=expression)
-
-            # Copy the new feature ID across
-            arcpy.CalculateField_management("join_lyr2", "Joint_spatial_clip_union_sort." + new_ID,
-                                            "!Base_TI_not_split_sort." + new_ID + "!", "PYTHON_9.3")
-
-            # Remove the join
-            arcpy.RemoveJoin_management("join_lyr2", "Base_TI_not_split_sort")
-            arcpy.Delete_management("join_lyr2")
+            # Note: the sorted copy is not used by the following steps (they start again from Joint_spatial_clip_union), so this
+            # join is not repeated when in_memory_joins is used.
+            if not in_memory_joins:
+                arcpy.Sort_management(Joint_spatial_clip_union, "Joint_spatial_clip_union_sort", [["Shape_Area", "DESCENDING"]])
+                scratch.consumed(Joint_spatial_clip_union)
+                arcpy.MakeFeatureLayer_management("Joint_spatial_clip_union_sort", "join_lyr2")
+                arcpy.AddJoin_management("join_lyr2", base_ID, "Base_TI_not_split_sort", base_ID, "KEEP_ALL")
+                expression = "Joint_spatial_clip_union_sort." + new_key + " IS NULL OR Joint_spatial_clip_union_sort." + new_key + " = ''"
+                arcpy.SelectLayerByAttribute_management("join_lyr2", where_clause=expression)
+
+                # Copy the new feature ID across
+                arcpy.CalculateField_management("join_lyr2", "Joint_spatial_clip_union_sort." + new_ID,
+                                                "!Base_TI_not_split_sort." + new_ID + "!", "PYTHON_9.3")
+
+                # Remove the join
+                arcpy.RemoveJoin_management("join_lyr2", "Base_TI_not_split_sort")
+                arcpy.Delete_management("join_lyr2")
 
             print(''.join(["   ## New polygon file created on : ", time.ctime()]))
 
             print("   Cleaning clipped shapes")
-            arcpy.CopyFeatures_management("Joint_spatial_clip_union","Joint_spatial_clip_union_delid")
-            arcpy.DeleteIdentical_management("Joint_spatial_clip_union_delid", ["Shape"])
-            arcpy.MultipartToSinglepart_management("Joint_spatial_clip_union_delid", "Joint_spatial_clip_union_delid_sp")
+            Joint_spatial_clip_union_delid = scratch.path("Joint_spatial_clip_union_delid")
+            Joint_spatial_clip_union_delid_sp = scratch.path("Joint_spatial_clip_union_delid_sp", needs_area=True)
+            arcpy.CopyFeatures_management(Joint_spatial_clip_union, Joint_spatial_clip_union_delid)
+            scratch.consumed(Joint_spatial_clip_union)
+            arcpy.DeleteIdentical_management(Joint_spatial_clip_union_delid, ["Shape"])
+            arcpy.MultipartToSinglepart_management(Joint_spatial_clip_union_delid, Joint_spatial_clip_union_delid_sp)
+            scratch.consumed(Joint_spatial_clip_union_delid)
 
             # Eliminate slivers. Note: this may lose integrity of original base map boundaries, e.g. losing genuine small OSMM polygons.
             # But cannot just delete, or will get odd slivers in middle of new features with no attribute data.
             # For OSMM base map, need to restrict this to 1m2, but that also restricts the size of the standalone sliver deletion below,
             # which ideally would be larger (say 5m2).
             if repair_before_elim:
-                MyFunctions.check_and_repair("Joint_spatial_clip_union_delid_sp")
+                MyFunctions.check_and_repair(Joint_spatial_clip_union_delid_sp)
             print("      Eliminating spatial clip slivers. Note: this may lose integrity of original base map boundaries.")
-            arcpy.MakeFeatureLayer_management("Joint_spatial_clip_union_delid_sp", "Elim_layer")
-            arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause="Shape_Area < " + str(sliver_size))
-            arcpy.Eliminate_management("Elim_layer","Joint_spatial_clip_union_delid_sp_elim")
-            arcpy.Delete_management("Elim_layer")
-
-            print("      Deleting standalone clip slivers")
-            arcpy.CopyFeatures_management("Joint_spatial_clip_union_delid_sp_elim", "Joint_spatial_clip_union_clean")
-            arcpy.MakeFeatureLayer_management("Joint_spatial_clip_union_clean", "Del_layer")
-            arcpy.SelectLayerByAttribute_management("Del_layer", where_clause="Shape_Area < " + str(sliver_size))
-            arcpy.DeleteFeatures_management("Del_layer")
-            arcpy.Delete_management("Del_layer")
+            # Read by Erase and Merge below
+            Joint_spatial_clip_union_clean = scratch.path("Joint_spatial_clip_union_clean", consumers=2, needs_area=True)
+            if python_eliminate:
+                num_elim, num_del = MyFunctions.eliminate_slivers(Joint_spatial_clip_union_delid_sp, Joint_spatial_clip_union_clean,
+                                                                  "Shape_Area < " + str(sliver_size), delete_size=sliver_size)
+                print("      " + str(num_elim) + " clip slivers eliminated and " + str(num_del) + " standalone clip slivers deleted")
+            else:
+                arcpy.MakeFeatureLayer_management(Joint_spatial_clip_union_delid_sp, "Elim_layer")
+                arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause="Shape_Area < " + str(sliver_size))
+                arcpy.Eliminate_management("Elim_layer","Joint_spatial_clip_union_delid_sp_elim")
+                arcpy.Delete_management("Elim_layer")
+
+                print("      Deleting standalone clip slivers")
+                arcpy.CopyFeatures_management("Joint_spatial_clip_union_delid_sp_elim", Joint_spatial_clip_union_clean)
+                arcpy.MakeFeatureLayer_management(Joint_spatial_clip_union_clean, "Del_layer")
+                arcpy.SelectLayerByAttribute_management("Del_layer", where_clause="Shape_Area < " + str(sliver_size))
+                arcpy.DeleteFeatures_management("Del_layer")
+                arcpy.Delete_management("Del_layer")
+            scratch.consumed(Joint_spatial_clip_union_delid_sp)
 
             # Create a tag to identify the unioned parts of the split polygons that are not within the new features. This is needed later.
-            arcpy.MakeFeatureLayer_management("Joint_spatial_clip_union_clean", "tag_lyr")
+            arcpy.MakeFeatureLayer_management(Joint_spatial_clip_union_clean, "tag_lyr")
             arcpy.SelectLayerByAttribute_management("tag_lyr", where_clause=new_ID + " IS NULL OR " + new_ID + " = 0")
             arcpy.CalculateField_management("tag_lyr", Relationship_field, "'Not new'", "PYTHON_9.3")
 
@@ -557,20 +709,30 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
             print("   Creating Joint layer with base map polygons split where needed")
             # Merge the clipped new features (unioned with the split base map polygons) with the base map with the new shapes erased.
             # This produces new internal boundaries for polygons that need to be split.
-            arcpy.Erase_analysis(Base_map, "Joint_spatial_clip_union_clean", "Joint_spatial_erase", cluster_tolerance=xy_tol)
-            arcpy.Merge_management(["Joint_spatial_erase", "Joint_spatial_clip_union_clean"], "Joint_spatial_merge")
-
-            arcpy.CopyFeatures_management("Joint_spatial_merge", "Joint_spatial_merge_repair")
-            MyFunctions.check_and_repair("Joint_spatial_merge_repair")
+            arcpy.Delete_management("tag_lyr")
+            Joint_spatial_erase = scratch.path("Joint_spatial_erase")
+            Joint_spatial_merge = scratch.path("Joint_spatial_merge")
+            Joint_spatial_merge_repair = scratch.path("Joint_spatial_merge_repair")
+            arcpy.Erase_analysis(Base_map, Joint_spatial_clip_union_clean, Joint_spatial_erase, cluster_tolerance=xy_tol)
+            scratch.consumed(Joint_spatial_clip_union_clean)
+            arcpy.Merge_management([Joint_spatial_erase, Joint_spatial_clip_union_clean], Joint_spatial_merge)
+            scratch.consumed(Joint_spatial_erase)
+            scratch.consumed(Joint_spatial_clip_union_clean)
+
+            arcpy.CopyFeatures_management(Joint_spatial_merge, Joint_spatial_merge_repair)
+            scratch.consumed(Joint_spatial_merge)
+            MyFunctions.check_and_repair(Joint_spatial_merge_repair)
 
             print("   Converting to single part")
-            arcpy.MultipartToSinglepart_management("Joint_spatial_merge_repair","Joint_spatial_merge_repair_sp")
+            arcpy.MultipartToSinglepart_management(Joint_spatial_merge_repair, "Joint_spatial_merge_repair_sp")
+            scratch.consumed(Joint_spatial_merge_repair)
 
             print(''.join(["   ## Joint geometry file created on : ", time.ctime()]))
+            MyFunctions.stage_completed(gdb, manifest, stages, "make_joint_shapes", timing_log)
 
         # Join new attributes to new joint shapes.
         # -------------------------------------------
-        if join_new_attributes == True:
+        if run_join_attributes == True:
             # We retain the base map attributes in the clipped and merged shapes, but now need to add in new feature attributes
             # from the non-split shapes via a table join.
             print("   Transferring attribute data from new features to joint layer, for non-split polygons")
@@ -581,50 +743,76 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
 
             # Get missing new feature IDs for the polygons that have not been split, i.e. the rows with an entry
             # in the TI tables that have not already had a new feature ID transferred. Need to join to largest intersect area, to avoid slivers.
-
-            print("      Joining Joint layer to interpretation table (Base_TI)")
-            # This is a one to many join - each base polygon could be overlapped by more than one new feature polygon, but as these polygons
-            # were not marked for splitting, we want to use the ID of the largest intersection (just ignoring slivers) so we have sorted by size.
-            arcpy.MakeFeatureLayer_management("Joint_sort", "join_lyr5")
-            arcpy.AddJoin_management("join_lyr5", base_ID, "Base_TI_not_split_sort", base_ID)
-
-            # Have to do this in two stages, because Relationship <> 'Not new' excludes NULLs.
-            expression = "(Joint_sort." + new_ID + " IS NULL OR Joint_sort." + new_ID + \
-                         " = 0) AND Base_TI_not_split_sort." + base_ID + " IS NOT NULL"
-            arcpy.SelectLayerByAttribute_management("join_lyr5", where_clause=expression)
-
-            # Copy the new feature ID across.
-            numrows = arcpy.GetCount_management("join_lyr5")
-            print("      Copying new feature ID for " + str(numrows) + " un-split polygons")
-            arcpy.CalculateField_management("join_lyr5", "Joint_sort." + new_ID, "!Base_TI_not_split_sort." + new_ID + "!", "PYTHON_9.3")
-
-            # Remove the join
-            arcpy.RemoveJoin_management("join_lyr5", "Base_TI_not_split_sort")
-            arcpy.Delete_management("join_lyr5")
-
-            # Delete New Id for the rows marked 'not new', i.e. the parts of split polygons that are not in new features
-            arcpy.MakeFeatureLayer_management("Joint_sort", "not_new_lyr")
-            expression = Relationship_field + " = 'Not new'"
-            arcpy.SelectLayerByAttribute_management("not_new_lyr", where_clause=expression)
-            numrows = arcpy.GetCount_management("not_new_lyr")
-            print("      Deleting new feature ID for " + str(numrows) + " parts of split base map polygons that are not in new features")
-            arcpy.CalculateField_management("not_new_lyr", new_ID, 0, "PYTHON_9.3")
-            arcpy.Delete_management("not_new_lyr")
-
-            # Get the missing Relationship field for the non_split features
-            arcpy.MakeFeatureLayer_management("Joint_sort", "join_lyr6")
-            arcpy.AddJoin_management("join_lyr6", base_ID, "Base_TI_not_split_sort", base_ID)
-            expression = "(Joint_sort." + new_ID + " IS NOT NULL AND Joint_sort." + new_ID + " <> 0) AND Base_TI_not_split_sort." \
-                         + base_ID + " IS NOT NULL"
-            arcpy.SelectLayerByAttribute_management("join_lyr6", where_clause=expression)
-            numrows = arcpy.GetCount_management("join_lyr6")
-
-            print ("      Copying Relationship for " + str(numrows) + " polygons where new feature ID exists")
-            arcpy.CalculateField_management("join_lyr6", "Joint_sort." + Relationship_field,
-                                            "!Base_TI_not_split_sort." + Relationship_field + "!", "PYTHON_9.3")
-            # Remove the join
-            arcpy.RemoveJoin_management("join_lyr6", "Base_TI_not_split_sort")
-            arcpy.Delete_management("join_lyr6")
+            if in_memory_joins:
+                # The three joins below are done in a single update cursor pass, looking up the largest non-split overlap for each
+                # base map ID. The steps are applied in the same order for each row, so the results are the same.
+                print("      Copying new feature IDs and relationships from the largest non-split overlaps")
+                num_new_ID = 0
+                num_not_new = 0
+                num_relationship = 0
+                with arcpy.da.UpdateCursor("Joint_sort", [base_ID, new_ID, Relationship_field]) as cursor:
+                    for row in cursor:
+                        largest = largest_overlap.get(row[0])
+                        if (row[1] is None or row[1] == 0) and largest is not None:
+                            row[1] = largest[0]
+                            num_new_ID = num_new_ID + 1
+                        # Delete New Id for the rows marked 'not new', i.e. the parts of split polygons that are not in new features
+                        if row[2] == "Not new":
+                            row[1] = 0
+                            num_not_new = num_not_new + 1
+                        # Get the missing Relationship field for the non_split features
+                        if row[1] is not None and row[1] != 0 and largest is not None:
+                            row[2] = MergeFunctions.RELATIONSHIP_NAMES[largest[1]]
+                            num_relationship = num_relationship + 1
+                        cursor.updateRow(row)
+                print("      Copied new feature ID for " + str(num_new_ID) + " un-split polygons")
+                print("      Deleted new feature ID for " + str(num_not_new) + " parts of split base map polygons that are not in new features")
+                print("      Copied Relationship for " + str(num_relationship) + " polygons where new feature ID exists")
+            else:
+
+                print("      Joining Joint layer to interpretation table (Base_TI)")
+                # This is a one to many join - each base polygon could be overlapped by more than one new feature polygon, but as these polygons
+                # were not marked for splitting, we want to use the ID of the largest intersection (just ignoring slivers) so we have sorted by size.
+                arcpy.MakeFeatureLayer_management("Joint_sort", "join_lyr5")
+                arcpy.AddJoin_management("join_lyr5", base_ID, "Base_TI_not_split_sort", base_ID)
+
+                # Have to do this in two stages, because Relationship <> 'Not new' excludes NULLs.
+                expression = "(Joint_sort." + new_ID + " IS NULL OR Joint_sort." + new_ID + \
+                             " = 0) AND Base_TI_not_split_sort." + base_ID + " IS NOT NULL"
+                arcpy.SelectLayerByAttribute_management("join_lyr5", where_clause=expression)
+
+                # Copy the new feature ID across.
+                numrows = arcpy.GetCount_management("join_lyr5")
+                print("      Copying new feature ID for " + str(numrows) + " un-split polygons")
+                arcpy.CalculateField_management("join_lyr5", "Joint_sort." + new_ID, "!Base_TI_not_split_sort." + new_ID + "!", "PYTHON_9.3")
+
+                # Remove the join
+                arcpy.RemoveJoin_management("join_lyr5", "Base_TI_not_split_sort")
+                arcpy.Delete_management("join_lyr5")
+
+                # Delete New Id for the rows marked 'not new', i.e. the parts of split polygons that are not in new features
+                arcpy.MakeFeatureLayer_management("Joint_sort", "not_new_lyr")
+                expression = Relationship_field + " = 'Not new'"
+                arcpy.SelectLayerByAttribute_management("not_new_lyr", where_clause=expression)
+                numrows = arcpy.GetCount_management("not_new_lyr")
+                print("      Deleting new feature ID for " + str(numrows) + " parts of split base map polygons that are not in new features")
+                arcpy.CalculateField_management("not_new_lyr", new_ID, 0, "PYTHON_9.3")
+                arcpy.Delete_management("not_new_lyr")
+
+                # Get the missing Relationship field for the non_split features
+                arcpy.MakeFeatureLayer_management("Joint_sort", "join_lyr6")
+                arcpy.AddJoin_management("join_lyr6", base_ID, "Base_TI_not_split_sort", base_ID)
+                expression = "(Joint_sort." + new_ID + " IS NOT NULL AND Joint_sort." + new_ID + " <> 0) AND Base_TI_not_split_sort." \
+                             + base_ID + " IS NOT NULL"
+                arcpy.SelectLayerByAttribute_management("join_lyr6", where_clause=expression)
+                numrows = arcpy.GetCount_management("join_lyr6")
+
+                print ("      Copying Relationship for " + str(numrows) + " polygons where new feature ID exists")
+                arcpy.CalculateField_management("join_lyr6", "Joint_sort." + Relationship_field,
+                                                "!Base_TI_not_split_sort." + Relationship_field + "!", "PYTHON_9.3")
+                # Remove the join
+                arcpy.RemoveJoin_management("join_lyr6", "Base_TI_not_split_sort")
+                arcpy.Delete_management("join_lyr6")
 
             print("   Selecting rows with missing new attributes")
             arcpy.CopyFeatures_management("Joint_sort", "Joint_sort_OK")
@@ -644,7 +832,7 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
 
             print("   Deleting existing new feature attribute fields from features to be joined")
             # Extend the list of fields to keep, to  retain the new interpretation fields
-            Needed.extend([base_ID, new_ID, base_area, Relationship_field])
+            Needed.extend([base_ID, new_ID, base_area, Relationship_field] + keep_fields)
             MyFunctions.delete_fields("Joint_to_join", Needed, "Joint_to_join_delfields")
 
             print("   Joining to new attributes")
@@ -654,14 +842,18 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
             arcpy.Delete_management("join_lyr10")
 
             # Merge back with main dataset
-            numrows = arcpy.GetCount_management("Joint_to_join_joined")
+            numrows = MyFunctions.count_rows("Joint_to_join_joined")
             print ("   Merging " + str(numrows) + " joined rows back into main dataset")
-            arcpy.Merge_management(["Joint_sort_OK", "Joint_to_join_joined"], "Joint_done")
+            Joint_done = scratch.path("Joint_done")
+            arcpy.Merge_management(["Joint_sort_OK", "Joint_to_join_joined"], Joint_done)
             print "   Sorting geographically to improve display speed"
-            arcpy.Sort_management("Joint_done", Output_fc, [["SHAPE", "ASCENDING"]], "PEANO")
+            arcpy.Sort_management(Joint_done, Output_fc, [["SHAPE", "ASCENDING"]], "PEANO")
+            scratch.consumed(Joint_done)
+            MyFunctions.stage_completed(gdb, manifest, stages, "join_new_attributes", timing_log)
 
         print("## Completed " + gdb + " on " + time.ctime() + ". Merged feature class name is " + Output_fc + ", rows: "
-              + str(arcpy.GetCount_management(Output_fc)))
+              + str(MyFunctions.count_rows(Output_fc)))
+        scratch.close()
 
     # Error handling: record error messages for this gdb and continue with the next one. Most errors are caused by loss of connection
     # to the server and can be sorted out by restarting the code from an appropriate point
@@ -675,6 +867,9 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
 
         failed_gdbs.append(gdb)
         error_messages.append(gdb + " failed.\n" + msgs + "\n")
+        scratch.close(success=False)
+        if timing_log is not None:
+            timing_log.fail()
         # if union_failed:
         #     union_msg = "Union failed. Try to do it manually in ArcMap (try omitting rank and cluster tolerance), " \
         #                 "then comment out the previous steps and restart the code."
@@ -700,9 +895,15 @@ def relationship(overlap_area, percent_overlap, ignore_low, ignore_high, signifi
         print(msgs)
         failed_gdbs.append(gdb)
         error_messages.append(gdb + " failed.\n" + pymsg + "\n" + msgs + "\n")
+        scratch.close(success=False)
+        if timing_log is not None:
+            timing_log.fail()
 
     if len(failed_gdbs) >0:
         print "Failed so far: " + '\n'.join(failed_gdbs)
         print "\n".join(error_messages)
 
+# Non-zero exit code so that Parallel_LADs.py can report the failure
+if len(failed_gdbs) > 0:
+    exit(1)
 exit()
\ No newline at end of file
@@ -4,6 +4,7 @@
 # These functions are research tools and have not been rigorously tested for wider use.
 # -------------------------------------------------------------------------------------
 import arcpy
+import os
 import time
 
 arcpy.env.overwriteOutput = True         # Overwrites files
@@ -104,6 +105,61 @@ def check_and_add_field(in_table, in_field, type, len):
     print ("      New field " + in_field + " added successfully to " + in_table)
     return
 
+def get_fields(in_table):
+    # List the fields of a table. Not cached: the scripts change schemas with many tools (AddField, CalculateField, JoinField,
+    # overwritten outputs), so a cached list would go stale. Each caller lists the fields once and reuses the list.
+    return arcpy.ListFields(in_table)
+
+def add_fields(in_table, field_specs):
+    # Batch version of check_and_add_field for a list of [field name, type, length]. The fields are listed once, all new fields are
+    # added together (with AddFields where available), and any existing fields that need correcting (text fields with a different
+    # length, or names in a different case) are fixed in a single rewrite: their values are read in one pass, the old fields are
+    # deleted in one step, re-added with the new fields and written back in one pass.
+    existing = dict((field.name.lower(), field) for field in get_fields(in_table))
+    to_add = []
+    to_fix = []
+    for in_field, type, length in field_specs:
+        field = existing.get(in_field.lower())
+        if field is None:
+            to_add.append([in_field, type, length])
+        elif field.name != in_field:
+            print ("*** WARNING: there is a field " + field.name + " with different case to " + in_field +
+                   ": contents will be transferred and old field will be deleted")
+            to_fix.append([in_field, type, length])
+        elif field.type == "String" and type.upper() == "TEXT" and field.length != length:
+            print ("*** WARNING: the existing text field " + in_field + " has a different length to the new field specification."
+                   " Contents will be transferred to the new field")
+            to_fix.append([in_field, type, length])
+        else:
+            print ("*** WARNING: " + in_field + " field already exists in " + in_table + ". Duplicate field will be overwritten")
+
+    if len(to_fix) > 0:
+        old_fields = [existing[spec[0].lower()].name for spec in to_fix]
+        old_values = {}
+        with arcpy.da.SearchCursor(in_table, ["OID@"] + old_fields) as cursor:
+            for row in cursor:
+                old_values[row[0]] = row[1:]
+        arcpy.DeleteField_management(in_table, old_fields)
+
+    new_fields = to_add + to_fix
+    if len(new_fields) > 0:
+        if hasattr(arcpy.management, "AddFields"):
+            arcpy.management.AddFields(in_table, [[in_field, type.upper(), "", length if type.upper() == "TEXT" and length > 0 else None]
+                                                  for in_field, type, length in new_fields])
+        else:
+            for in_field, type, length in new_fields:
+                if type.upper() == "TEXT" and length > 0:
+                    arcpy.AddField_management(in_table, in_field, type, field_length=length)
+                else:
+                    arcpy.AddField_management(in_table, in_field, type)
+        print ("      New fields " + ", ".join([spec[0] for spec in new_fields]) + " added successfully to " + in_table)
+
+    if len(to_fix) > 0:
+        with arcpy.da.UpdateCursor(in_table, ["OID@"] + [spec[0] for spec in to_fix]) as cursor:
+            for row in cursor:
+                cursor.updateRow([row[0]] + list(old_values[row[0]]))
+    return
+
 def delete_by_size (in_table, size):
     print ("      Deleting slivers under " + str(size) + " from " + in_table)
     arcpy.MakeFeatureLayer_management(in_table, "del_lyr")
@@ -114,9 +170,672 @@ def delete_by_size (in_table, size):
     return
 
 def select_and_copy (in_table, in_field, expression, copy_string):
+    # Returns the number of rows selected and updated
     arcpy.MakeFeatureLayer_management(in_table, "copy_lyr")
     arcpy.SelectLayerByAttribute_management("copy_lyr", where_clause=expression)
+    num_selected = int(arcpy.GetCount_management("copy_lyr").getOutput(0))
     arcpy.CalculateField_management("copy_lyr", in_field, copy_string, "PYTHON_9.3")
     arcpy.Delete_management("copy_lyr")
     # print ("      Finished updating " + in_field + " values in " + in_table)
+    return num_selected
+
+def apply_rules(in_table, rules):
+    # Rule-batch version of select_and_copy. rules is a list of (where clause, field, copy_string) in the order they would be run.
+    # The where clauses and copy strings are translated to Python (RuleFunctions) and all rules are applied to each row in one
+    # UpdateCursor pass, in order, so a later rule sees the values set by earlier rules exactly as with separate select_and_copy calls.
+    # Rules that cannot be translated are run with select_and_copy between the cursor passes. Returns the number of rows set by each rule.
+    import RuleFunctions
+    field_types = dict((field.name.lower(), field) for field in get_fields(in_table))
+    compiled = []
+    for expression, in_field, copy_string in rules:
+        try:
+            where, where_fields = RuleFunctions.compile_where(expression)
+            value, value_fields = RuleFunctions.compile_value(copy_string)
+            missing = [name for name in where_fields + value_fields + [in_field.lower()] if name not in field_types]
+            if missing:
+                raise ValueError("Fields not found: " + ", ".join(missing))
+            compiled.append((where, value, in_field.lower(), where_fields + value_fields))
+        except ValueError as e:
+            print ("      Rule " + expression + " will be run with CalculateField: " + str(e))
+            compiled.append(None)
+
+    def cast(field, value):
+        # Values are converted to the field type as CalculateField would do
+        if value is None:
+            return None
+        if field.type == "String" and not isinstance(value, RuleFunctions.string_types):
+            return str(value)
+        if field.type in ("Integer", "SmallInteger"):
+            return int(value)
+        if field.type in ("Single", "Double"):
+            return float(value)
+        return value
+
+    counts = [0] * len(rules)
+    start = 0
+    while start < len(rules):
+        if compiled[start] is None:
+            expression, in_field, copy_string = rules[start]
+            counts[start] = select_and_copy(in_table, in_field, expression, copy_string)
+            start = start + 1
+            continue
+        # Run all the rules up to the next one that needs CalculateField in one pass
+        end = start
+        while end < len(rules) and compiled[end] is not None:
+            end = end + 1
+        fields = []
+        for where, value, out_field, rule_fields in compiled[start:end]:
+            for name in rule_fields + [out_field]:
+                if name not in fields:
+                    fields.append(name)
+        with arcpy.da.UpdateCursor(in_table, [field_types[name].name for name in fields]) as cursor:
+            for row in cursor:
+                values = dict(zip(fields, row))
+                changed = False
+                for i in range(start, end):
+                    where, value, out_field, rule_fields = compiled[i]
+                    if where(values):
+                        values[out_field] = cast(field_types[out_field], value(values))
+                        counts[i] = counts[i] + 1
+                        changed = True
+                if changed:
+                    cursor.updateRow([values[name] for name in fields])
+        start = end
+    return counts
+
+def flatten_fields(fields):
+    # Field lists for the overlay tools can contain nested lists (e.g. [base_ID, base_key, base_TI_fields, base_area])
+    flat = []
+    for field in fields:
+        if isinstance(field, (list, tuple)):
+            flat.extend(flatten_fields(field))
+        elif field:
+            flat.append(field)
+    return flat
+
+def read_geometries(in_table, fields):
+    # Read polygon geometries and attribute fields into memory for the pure Python engines in MergeFunctions.
+    # Returns an array of shapely geometries and a dictionary of numpy arrays, one per field, in cursor order.
+    import numpy as np
+    import shapely
+    wkbs = []
+    values = [[] for field in fields]
+    with arcpy.da.SearchCursor(in_table, ["SHAPE@WKB"] + fields) as cursor:
+        for row in cursor:
+            wkbs.append(bytes(row[0]) if row[0] is not None else None)
+            for i in range(len(fields)):
+                values[i].append(row[i + 1])
+    columns = {}
+    for i in range(len(fields)):
+        columns[fields[i]] = np.array(values[i])
+    return shapely.from_wkb(wkbs), columns
+
+def write_table(columns, field_order, out_table):
+    # Write a dictionary of numpy arrays to a new geodatabase table. Text columns are written as strings with nulls as ''.
+    import numpy as np
+    dtypes = []
+    arrays = []
+    for field in field_order:
+        values = np.asarray(columns[field])
+        if values.dtype.kind in "OSU":
+            values = np.array(["" if value is None else value for value in values], dtype=np.str_)
+            if values.dtype.itemsize == 0:
+                values = values.astype("<U1")
+        dtypes.append((str(field), values.dtype))
+        arrays.append(values)
+    table = np.empty(len(arrays[0]) if arrays else 0, dtype=dtypes)
+    for field, values in zip(field_order, arrays):
+        table[field] = values
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+    arcpy.da.NumPyArrayToTable(table, os.path.join(arcpy.env.workspace, out_table) if arcpy.env.workspace else out_table)
     return
+
+def tabulate_intersection_columns(zone_table, zone_fields, class_table, class_fields, xy_tolerance=None):
+    # Replacement for TabulateIntersection_analysis using the STRtree overlap engine in MergeFunctions.
+    # Returns the zone fields, class fields, AREA and PERCENTAGE as a dictionary of numpy arrays, plus the field order.
+    # xy_tolerance is as for the ArcGIS tool, e.g. "0.001 Meters" (map units are assumed to be metres).
+    import MergeFunctions
+    zone_fields = flatten_fields(zone_fields)
+    class_fields = flatten_fields(class_fields)
+    print ("      Reading zone polygons from " + zone_table + " on " + time.ctime())
+    zone_geoms, zone_columns = read_geometries(zone_table, zone_fields)
+    print ("      Reading class polygons from " + class_table + " on " + time.ctime())
+    class_geoms, class_columns = read_geometries(class_table, class_fields)
+    print ("      Tabulating intersections of " + str(len(zone_geoms)) + " zone and " + str(len(class_geoms)) + " class polygons")
+    tolerance = float(str(xy_tolerance).split()[0]) if xy_tolerance else 0.0
+    zone_index, class_index, area, percentage = MergeFunctions.tabulate_intersection(zone_geoms, class_geoms, xy_tolerance=tolerance)
+
+    # Duplicate field names in the class table get a suffix of _1, as they do in the ArcGIS tool
+    columns = {}
+    field_order = []
+    for field in zone_fields:
+        columns[field] = zone_columns[field][zone_index]
+        field_order.append(field)
+    for field in class_fields:
+        out_field = field
+        if out_field in field_order:
+            out_field = field + "_1"
+        columns[out_field] = class_columns[field][class_index]
+        field_order.append(out_field)
+    columns["AREA"] = area
+    columns["PERCENTAGE"] = percentage
+    field_order.extend(["AREA", "PERCENTAGE"])
+    print ("      " + str(len(area)) + " intersections found on " + time.ctime())
+    return columns, field_order
+
+def tabulate_intersection_table(zone_table, zone_fields, class_table, class_fields, out_table):
+    # As tabulate_intersection_columns, but writes the output table (like TabulateIntersection_analysis)
+    columns, field_order = tabulate_intersection_columns(zone_table, zone_fields, class_table, class_fields)
+    write_table(columns, field_order, out_table)
+    return columns
+
+def read_columns(in_table, fields, where_clause=None):
+    # Read attribute fields into a dictionary of numpy arrays (one SearchCursor pass, no geometry)
+    import numpy as np
+    values = [[] for field in fields]
+    with arcpy.da.SearchCursor(in_table, fields, where_clause) as cursor:
+        for row in cursor:
+            for i in range(len(fields)):
+                values[i].append(row[i])
+    columns = {}
+    for i in range(len(fields)):
+        columns[fields[i]] = np.array(values[i])
+    return columns
+
+def write_columns(in_table, columns, fields, key_field="OID@"):
+    # Write numpy columns back to an existing table in one UpdateCursor pass. Rows are matched on columns[key_field], so the columns
+    # must have been read with the key field (e.g. read_columns(in_table, ["OID@", ...])). NaN is written as null.
+    import numpy as np
+    field_types = dict((field.name.lower(), field.type) for field in get_fields(in_table))
+    index = dict((key, i) for i, key in enumerate(columns[key_field].tolist()))
+    converters = []
+    for field in fields:
+        if field_types.get(field.lower()) in ("Integer", "SmallInteger"):
+            converters.append(lambda value: None if value is None or value != value else int(value))
+        elif columns[field].dtype.kind == "f":
+            converters.append(lambda value: None if value != value else value)
+        else:
+            converters.append(lambda value: value)
+    values = [columns[field].tolist() for field in fields]
+    with arcpy.da.UpdateCursor(in_table, [key_field] + fields) as cursor:
+        for row in cursor:
+            i = index.get(row[0])
+            if i is not None:
+                cursor.updateRow([row[0]] + [converters[j](values[j][i]) for j in range(len(fields))])
+    return
+
+def calculate_scores(in_table, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier=1.1,
+                     Max_food_mult=2.4, LERC_LWS=False, distinct=False):
+    # Calculate all the scores for the selected SetUpScoreTable.py stages with one read of the input fields and one write of the
+    # score fields (see ScoreFunctions.calculate_scores). The score fields must already exist. With distinct=True the scores are
+    # calculated once for each distinct combination of the categorical inputs (ScoreFunctions.calculate_distinct_scores).
+    import ScoreFunctions
+    fields = ScoreFunctions.fields_to_read(stages, hab_field, nature_fields, culture_fields, education_fields, LERC_LWS)
+    print ("      Reading " + str(len(fields)) + " input fields from " + in_table)
+    columns = read_columns(in_table, ["OID@"] + fields)
+    if distinct:
+        calculate = ScoreFunctions.calculate_distinct_scores
+    else:
+        calculate = ScoreFunctions.calculate_scores
+    out_fields = calculate(columns, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier, Max_food_mult,
+                           LERC_LWS)
+    print ("      Writing " + str(len(out_fields)) + " score fields to " + in_table)
+    write_columns(in_table, columns, out_fields)
+    return out_fields
+
+def calculate_des_mult(in_table, hab_field, scheduled_monuments=True):
+    # Education_desig, Nature_desig and Sense_desig from the designation counts in one read and one write (see ScoreFunctions.des_mult),
+    # instead of a DesMult CalculateField for each. Set scheduled_monuments to False for tables without SchMon (UpdateScores.py).
+    import ScoreFunctions
+    fields = ["NatureDesig", "CultureDesig", "EdDesig", "Education", "Nature", "SensePlace"]
+    if scheduled_monuments:
+        fields = fields + ["SchMon", hab_field]
+    columns = read_columns(in_table, ["OID@"] + fields)
+    scores = dict((service, columns[service]) for service in ["Education", "Nature", "SensePlace"])
+    if scheduled_monuments:
+        new_scores = ScoreFunctions.des_mult(columns["NatureDesig"], columns["CultureDesig"], columns["EdDesig"], scores,
+                                             columns["SchMon"], columns[hab_field])
+    else:
+        new_scores = ScoreFunctions.des_mult(columns["NatureDesig"], columns["CultureDesig"], columns["EdDesig"], scores)
+    columns["Education_desig"] = new_scores["Education"]
+    columns["Nature_desig"] = new_scores["Nature"]
+    columns["Sense_desig"] = new_scores["SensePlace"]
+    write_columns(in_table, columns, ["Education_desig", "Nature_desig", "Sense_desig"])
+    return
+
+def read_lookups(lookup_tables):
+    # Snapshot of each lookup table in lookup_tables, a list of (name, table, key field, key field in the score table)
+    import ScoreFunctions
+    lookups = {}
+    for name, table, key_field, table_key in lookup_tables:
+        fields = [field.name for field in arcpy.ListFields(table) if field.type not in ("OID", "Geometry") and field.name != key_field]
+        lookups[name] = ScoreFunctions.lookup_snapshot(read_columns(table, [key_field] + fields), key_field, fields)
+    return lookups
+
+def record_lookups(gdb, lookup_tables):
+    # Save a snapshot of the lookup tables used to score this gdb in its manifest, for rescore_changed_lookups
+    import PipelineFunctions
+    manifest = PipelineFunctions.load_manifest(gdb)
+    manifest["lookups"] = read_lookups(lookup_tables)
+    PipelineFunctions.save_manifest(gdb, manifest)
+
+def rescore_changed_lookups(gdb, in_table, lookup_tables, stages, hab_field, nature_fields, culture_fields, education_fields,
+                            AONB_multiplier=1.1, Max_food_mult=2.4, LERC_LWS=False):
+    # Incremental alternative to rejoining the lookup tables and recalculating every score. The lookup tables are compared with the
+    # snapshot saved by record_lookups, and only the rows of in_table whose keys refer to a changed lookup row are read. Their lookup
+    # values are replaced (only from the tables in which their key changed) and their scores recalculated with calculate_scores.
+    # Returns the number of rows rescored, or None if there is no snapshot (a full run is needed first).
+    import ScoreFunctions
+    import PipelineFunctions
+    manifest = PipelineFunctions.load_manifest(gdb)
+    old_lookups = manifest.get("lookups")
+    if old_lookups is None:
+        print ("      No snapshot of the lookup tables for " + gdb + ": run without incremental rescoring first")
+        return None
+    new_lookups = read_lookups(lookup_tables)
+    table_fields = [field.name for field in get_fields(in_table)]
+    clauses = []
+    changed = {}
+    for name, table, key_field, table_key in lookup_tables:
+        changed[name] = set(ScoreFunctions.changed_keys(old_lookups.get(name), new_lookups[name]))
+        print ("      " + name + ": " + str(len(changed[name])) + " changed rows")
+        if changed[name]:
+            clauses.append(ScoreFunctions.sql_in(table_key, sorted(changed[name])))
+    if not clauses:
+        return 0
+
+    copy_fields = []
+    read_fields = []
+    for name, table, key_field, table_key in lookup_tables:
+        for field in [table_key] + [field for field in new_lookups[name]["fields"] if field in table_fields]:
+            if field not in read_fields:
+                read_fields.append(field)
+            if field != table_key and changed[name] and field not in copy_fields:
+                copy_fields.append(field)
+    for field in ScoreFunctions.fields_to_read(stages, hab_field, nature_fields, culture_fields, education_fields, LERC_LWS):
+        if field not in read_fields:
+            read_fields.append(field)
+    columns = read_columns(in_table, ["OID@"] + read_fields, " OR ".join(clauses))
+    num_rows = len(columns["OID@"])
+    print ("      Rescoring " + str(num_rows) + " rows")
+    if num_rows == 0:
+        manifest["lookups"] = new_lookups
+        PipelineFunctions.save_manifest(gdb, manifest)
+        return 0
+
+    # Replace the lookup values (as AddJoin with KEEP_ALL, a key that is no longer in the lookup table gives nulls)
+    for name, table, key_field, table_key in lookup_tables:
+        if not changed[name]:
+            continue
+        fields = new_lookups[name]["fields"]
+        for field in [field for field in fields if field in table_fields]:
+            values = columns[field].astype(object)
+            j = fields.index(field)
+            for i, key in enumerate(columns[table_key].tolist()):
+                if key is not None and str(key) in changed[name]:
+                    row = new_lookups[name]["rows"].get(str(key))
+                    values[i] = None if row is None else row[j]
+            columns[field] = values
+    out_fields = ScoreFunctions.calculate_scores(columns, stages, hab_field, nature_fields, culture_fields, education_fields,
+                                                 AONB_multiplier, Max_food_mult, LERC_LWS)
+    write_columns(in_table, columns, copy_fields + out_fields)
+    manifest["lookups"] = new_lookups
+    PipelineFunctions.save_manifest(gdb, manifest)
+    return num_rows
+
+def calculate_field_by_lookup(in_table, out_field, function, key_fields, extra_args=(), area_fields=None, area_ratio=None,
+                              max_size=100000):
+    # Replacement for CalculateField with a code block function of a few categorical fields (e.g. Simplify_OSMM). The function is run
+    # once for each distinct combination of key_fields values, with the results kept in a cache of up to max_size entries, and the
+    # results are written with one UpdateCursor pass (see RuleFunctions.lookup). For functions that also compare two areas
+    # (Interpret_hab), area_fields is [area, area_limit] and area_ratio the ratio in the test area < area_limit * area_ratio
+    # (see RuleFunctions.lookup_with_area).
+    import RuleFunctions
+    columns = read_columns(in_table, ["OID@"] + key_fields + (area_fields or []))
+    key_columns = [columns[field] for field in key_fields]
+    if area_fields:
+        results, num_residual, cache = RuleFunctions.lookup_with_area(function, key_columns, columns[area_fields[0]],
+                                                                      columns[area_fields[1]], area_ratio, extra_args, max_size)
+        print ("      " + str(num_residual) + " of " + str(len(results)) + " rows depend on " + " and ".join(area_fields))
+    else:
+        results, cache = RuleFunctions.lookup(function, key_columns, extra_args, max_size)
+    print ("      " + out_field + " for " + str(len(results)) + " rows: " + cache.report())
+    columns[out_field] = results
+    write_columns(in_table, columns, [out_field])
+    return
+
+def export_geoparquet(in_table, path=None, gdb=None):
+    # Mirror a feature class or table into a GeoParquet cache file (see CacheFunctions.py), with typed attribute columns and WKB
+    # geometry, in one SearchCursor pass. Default path is CacheFunctions.cache_path for the current workspace gdb. Returns the path.
+    import CacheFunctions
+    if gdb is None:
+        gdb = arcpy.env.workspace
+    if path is None:
+        path = CacheFunctions.cache_path(gdb, in_table)
+    # Stamp taken before reading, so edits made during the export make the cache stale
+    stamp = CacheFunctions.gdb_stamp(gdb)
+    field_types = [[field.name, field.type] for field in arcpy.ListFields(in_table) if field.type in CacheFunctions.arrow_type_names]
+    names = [name for name, field_type in field_types]
+    desc = arcpy.Describe(in_table)
+    has_geometry = hasattr(desc, "shapeType")
+    cursor_fields = names + (["SHAPE@WKB"] if has_geometry else [])
+    values = [[] for field in cursor_fields]
+    with arcpy.da.SearchCursor(in_table, cursor_fields) as cursor:
+        for row in cursor:
+            for i in range(len(cursor_fields)):
+                values[i].append(row[i])
+    columns = dict(zip(names, values))
+    if has_geometry:
+        CacheFunctions.write_geoparquet(path, columns, field_types, values[-1], desc.spatialReference.exportToString(), in_table, stamp)
+    else:
+        CacheFunctions.write_geoparquet(path, columns, field_types, None, None, in_table, stamp)
+    print ("      Exported " + str(len(values[0]) if values else 0) + " rows of " + in_table + " to " + path)
+    return path
+
+def read_columns_cached(in_table, fields, gdb=None, cache_folder=None, refresh=True):
+    # Column-projected alternative to read_columns: reads only the given fields from the GeoParquet cache of in_table. If the cache
+    # is missing or older than the last edit to the gdb it is rewritten first (refresh=True), or the table is read with a
+    # SearchCursor as usual (refresh=False). "OID@" can be used for the object ID field and "SHAPE@WKB" for the geometries as with
+    # cursors. Unlike read_columns, integer fields with nulls come back as float arrays with NaN for the nulls (text fields still
+    # have None), so test with np.isnan rather than "is None" where an integer field can be null.
+    import numpy as np
+    import CacheFunctions
+    if gdb is None:
+        gdb = arcpy.env.workspace
+    path = CacheFunctions.cache_path(gdb, in_table, cache_folder)
+    attribute_fields = [field for field in fields if field != "SHAPE@WKB"]
+    if not CacheFunctions.cache_is_current(path, CacheFunctions.gdb_stamp(gdb)):
+        if not refresh:
+            if "SHAPE@WKB" not in fields:
+                return read_columns(in_table, fields)
+            import shapely
+            geoms, columns = read_geometries(in_table, attribute_fields)
+            columns["SHAPE@WKB"] = shapely.to_wkb(geoms)
+            return columns
+        export_geoparquet(in_table, path, gdb)
+    OID_field = arcpy.Describe(in_table).OIDFieldName
+    names = [OID_field if field == "OID@" else field for field in attribute_fields]
+    columns, wkbs = CacheFunctions.read_geoparquet(path, names, geometry="SHAPE@WKB" in fields)
+    result = dict((field, columns[name]) for field, name in zip(attribute_fields, names))
+    if wkbs is not None:
+        result["SHAPE@WKB"] = np.array(wkbs, dtype=object)
+    return result
+
+def aggregate_scenarios(score_table, scenario_table, scenario_field, service_fields, clip=True, expressions=(), hab_field=None,
+                        abs_values=False, cached=False, null_as_zero=False):
+    # In-memory replacement for the per-scenario select / copy / clip and per-service SearchCursor sums in SpatialNatCapAnalysis.py.
+    # The score polygons are read once and overlaid with all the scenario outlines in one STRtree query (ScenarioFunctions).
+    # expressions are where clauses for the high natural capital areas, evaluated by arcpy on the score table.
+    # Returns the sorted scenario names and a dictionary for each: area (ha), scores (sum of score x area in ha, in the order of
+    # service_fields), high_nc (area in ha for each expression) and habitats ({habitat: (count, area in m2)} if hab_field is given).
+    # With cached=True the score polygons are read from the GeoParquet cache of the score table (see read_columns_cached), which is
+    # only rewritten when the gdb has changed, so repeated runs with new scenarios do not read the score table again.
+    # Null scores in polygons in any scenario raise a TypeError unless null_as_zero is True (see ScenarioFunctions.score_matrix).
+    import numpy as np
+    import shapely
+    import ScenarioFunctions
+    print ("    Reading scenario outlines from " + scenario_table + " on " + time.ctime())
+    scenario_geoms, scenario_columns = read_geometries(scenario_table, [scenario_field])
+    names, outlines = ScenarioFunctions.scenario_outlines(scenario_geoms, scenario_columns[scenario_field])
+    print ("    Reading score polygons from " + score_table + " on " + time.ctime())
+    fields = ["OID@"] + service_fields + ([hab_field] if hab_field else [])
+    if cached:
+        columns = read_columns_cached(score_table, ["SHAPE@WKB"] + fields, os.path.dirname(score_table))
+        geoms = shapely.from_wkb(columns.pop("SHAPE@WKB"))
+    else:
+        geoms, columns = read_geometries(score_table, fields)
+    print ("    Overlaying " + str(len(geoms)) + " polygons with " + str(len(names)) + " scenarios")
+    scenario_index, polygon_index, area = ScenarioFunctions.overlay_scenarios(geoms, outlines, clip)
+    values = ScenarioFunctions.score_matrix([columns[field] for field in service_fields], abs_values, service_fields, null_as_zero,
+                                            polygon_index)
+    sums = ScenarioFunctions.area_weighted_sums(scenario_index, polygon_index, area, values, len(names))
+    areas = ScenarioFunctions.scenario_areas(scenario_index, area, len(names))
+    high_nc = []
+    for expression in expressions:
+        selected = np.isin(columns["OID@"], read_columns(score_table, ["OID@"], expression)["OID@"])
+        high_nc.append(ScenarioFunctions.scenario_areas(scenario_index, area, len(names), selected[polygon_index]))
+    habitats = None
+    if hab_field:
+        habitats = ScenarioFunctions.class_areas(scenario_index, polygon_index, area, columns[hab_field], len(names))
+    results = {}
+    for i, name in enumerate(names):
+        results[name] = {"area": areas[i], "scores": sums[i].tolist(), "high_nc": [high[i] for high in high_nc],
+                         "habitats": habitats[i] if habitats is not None else None}
+    print ("    " + str(len(area)) + " pieces in " + str(len(names)) + " scenarios on " + time.ctime())
+    return names, results
+
+def area_weighted_sums(in_table, service_fields, abs_values=False, null_as_zero=False):
+    # Replacement for one SearchCursor per service when adding up scores: reads all the service fields and Shape_Area in one pass.
+    # Returns the total area in ha and a list of the sums of score x area for each service, divided by 10000 because scores are
+    # per ha but areas are in m2. With abs_values the absolute scores are used (e.g. for score differences). Null scores raise a
+    # TypeError as in the per-service sums, or with null_as_zero are counted (and printed) as zero.
+    import numpy as np
+    import ScenarioFunctions
+    columns = read_columns(in_table, service_fields + ["Shape_Area"])
+    area = np.asarray(columns["Shape_Area"], dtype=np.float64)
+    values = ScenarioFunctions.score_matrix([columns[field] for field in service_fields], abs_values, service_fields, null_as_zero)
+    return area.sum() / 10000, (np.dot(area, values) / 10000).tolist()
+
+def update_field_from_dict(in_table, key_field, out_field, lookup):
+    # Dictionary-keyed alternative to AddJoin / CalculateField / RemoveJoin: sets out_field to lookup[key] for every row
+    # whose key is in the lookup, in a single UpdateCursor pass. Returns the number of rows updated.
+    num_updated = 0
+    with arcpy.da.UpdateCursor(in_table, [key_field, out_field]) as cursor:
+        for row in cursor:
+            if row[0] in lookup:
+                row[1] = lookup[row[0]]
+                cursor.updateRow(row)
+                num_updated = num_updated + 1
+    return num_updated
+
+def eliminate_slivers(in_table, out_table, expression, delete_size=None, delete_expression=None, tolerance=0.0):
+    # Single-output replacement for the MakeFeatureLayer / Eliminate / CopyFeatures / DeleteFeatures sequence used to clean slivers.
+    # Polygons selected by expression are merged into the unselected neighbour with the longest shared boundary
+    # (as Eliminate_management with the default LENGTH option). Then polygons smaller than delete_size (the remaining
+    # standalone slivers) and polygons selected by delete_expression (tested before merging) are deleted.
+    # Adjacency is built once in memory (MergeFunctions.eliminate_slivers) and the output is written with one UpdateCursor pass.
+    # Returns the number of slivers eliminated and the number of polygons deleted.
+    import numpy as np
+    import shapely
+    import MergeFunctions
+    arcpy.CopyFeatures_management(in_table, out_table)
+    selected = set(row[0] for row in arcpy.da.SearchCursor(out_table, ["OID@"], where_clause=expression))
+    if delete_expression:
+        to_delete = set(row[0] for row in arcpy.da.SearchCursor(out_table, ["OID@"], where_clause=delete_expression))
+    else:
+        to_delete = set()
+
+    geoms, columns = read_geometries(out_table, ["OID@"])
+    oids = columns["OID@"]
+    slivers = np.array([oid in selected for oid in oids], dtype=bool)
+    out_geoms, absorbed = MergeFunctions.eliminate_slivers(geoms, slivers, tolerance)
+    changed = dict((oids[i], out_geoms[i]) for i in range(len(oids)) if out_geoms[i] is not geoms[i])
+    if delete_size is not None:
+        small = shapely.area(out_geoms) < delete_size
+        to_delete.update(oids[small & ~absorbed].tolist())
+    to_delete.update(oids[absorbed].tolist())
+
+    num_deleted = 0
+    with arcpy.da.UpdateCursor(out_table, ["OID@", "SHAPE@"]) as cursor:
+        for row in cursor:
+            if row[0] in to_delete:
+                cursor.deleteRow()
+                num_deleted = num_deleted + 1
+            elif row[0] in changed:
+                row[1] = arcpy.FromWKB(bytearray(shapely.to_wkb(changed[row[0]])))
+                cursor.updateRow(row)
+    num_eliminated = int(absorbed.sum())
+    return num_eliminated, num_deleted - num_eliminated
+
+def fingerprint(dataset):
+    # Cheap fingerprint of a dataset for the stage manifests in PipelineFunctions: row count and (for feature classes) extent.
+    # Field names are not included because later stages add fields to earlier outputs (e.g. the ID and area fields saved before
+    # Tabulate Intersection), which would otherwise force a rerun. Returns None if the dataset does not exist.
+    count = count_rows(dataset)
+    if count is None:
+        return None
+    result = {"count": count}
+    desc = arcpy.Describe(dataset)
+    if hasattr(desc, "extent") and desc.extent is not None:
+        result["extent"] = [round(desc.extent.XMin, 3), round(desc.extent.YMin, 3), round(desc.extent.XMax, 3), round(desc.extent.YMax, 3)]
+    return result
+
+# Row counts of datasets in file gdbs, kept until the gdb changes (see CacheFunctions.CountCache)
+row_counts = None
+
+def count_dataset(dataset):
+    if not arcpy.Exists(dataset):
+        return None
+    return int(arcpy.GetCount_management(dataset).getOutput(0))
+
+def count_rows(dataset):
+    # Row count of a dataset, or None if it does not exist. Use this instead of GetCount for logging: counts of feature classes and
+    # tables in a file gdb are cached until the gdb is next written to, so repeated counts of a large table do not each read it.
+    # Names are taken as in the current workspace. Layers (whose selection can change) and in_memory datasets are counted each time.
+    import CacheFunctions
+    global row_counts
+    if row_counts is None:
+        row_counts = CacheFunctions.CountCache(count_dataset)
+    path = dataset
+    if CacheFunctions.gdb_of(path) is None and arcpy.env.workspace and not os.path.isabs(path) and not path.startswith("in_memory"):
+        path = os.path.join(arcpy.env.workspace, dataset)
+    if CacheFunctions.gdb_of(path) is not None:
+        count = row_counts.count(path)
+        if count is not None:
+            return count
+    # Not in a gdb, or not a gdb dataset (e.g. a layer named like a feature class)
+    return count_dataset(dataset)
+
+def forget_counts(dataset=None):
+    # Drop cached row counts of a dataset or gdb (or all), e.g. after writing through a tool that does not change the gdb files
+    if row_counts is not None:
+        row_counts.invalidate(dataset)
+
+def step_log(gdb, script):
+    # Timing log for a run of a script on a gdb, with row counts from arcpy (see TimingFunctions.StepLog)
+    import TimingFunctions
+    return TimingFunctions.StepLog(gdb, script, count_rows)
+
+def stage_needed(manifest, stages, stage, log=None):
+    # Returns False (and says so) if the stage has already completed with unchanged inputs, outputs and settings.
+    # stages is an ordered dictionary of stage name: (input datasets, output datasets, settings), with datasets named as in the
+    # current workspace. With no manifest (resume switched off) always returns True.
+    # If a timing log is given, timing of the stage starts when it is needed and ends in stage_completed.
+    import PipelineFunctions
+    inputs, outputs, settings = stages[stage]
+    if manifest is None:
+        if log is not None:
+            log.start(stage, inputs, outputs)
+        return True
+    input_fps = dict((name, fingerprint(name)) for name in inputs)
+    output_fps = dict((name, fingerprint(name)) for name in outputs)
+    if PipelineFunctions.stage_is_current(manifest, stage, input_fps, output_fps, settings):
+        print("   Skipping " + stage + ": already completed on " + manifest[stage]["completed"] + " with the same inputs")
+        return False
+    if log is not None:
+        log.start(stage, inputs, outputs)
+    return True
+
+def stage_completed(gdb, manifest, stages, stage, log=None):
+    # Record a completed stage in the manifest, remove the records of all later stages (which must now be rerun) and save it.
+    # Input fingerprints are taken now, after the stage, because some stages add fields or rows to their inputs.
+    import PipelineFunctions
+    if log is not None:
+        log.finish(stage)
+    if manifest is None:
+        return
+    inputs, outputs, settings = stages[stage]
+    input_fps = dict((name, fingerprint(name)) for name in inputs)
+    output_fps = dict((name, fingerprint(name)) for name in outputs)
+    later_stages = list(stages.keys())[list(stages.keys()).index(stage) + 1:]
+    PipelineFunctions.record_stage(manifest, stage, input_fps, output_fps, settings, later_stages)
+    PipelineFunctions.save_manifest(gdb, manifest)
+
+class ScratchWorkspace(object):
+    # Lifecycle manager for intermediate datasets that are only read by the next few steps of a script, so they do not have to be
+    # written to (and later tidied out of) the main gdb.
+    # mode "in_memory": intermediates go to the in_memory workspace. In-memory feature classes have no Shape_Area field, so
+    #                   datasets that are later selected by Shape_Area must be requested with needs_area=True and go to a temporary gdb.
+    # mode "gdb":       intermediates go to a temporary file gdb in the ArcGIS scratch folder.
+    # mode None:        intermediates are written to the current workspace as before, and kept.
+    # Each dataset is deleted as soon as its last consumer has run (see consumed), and close() deletes anything left over,
+    # including the temporary gdb if the run succeeded.
+    def __init__(self, mode="in_memory", temp_folder=None):
+        self.mode = mode
+        self.temp_folder = temp_folder
+        self.temp_gdb = None
+        self.consumers = {}
+
+    def _get_temp_gdb(self):
+        if self.temp_gdb is None:
+            folder = self.temp_folder or arcpy.env.scratchFolder
+            name = "Scratch_" + str(os.getpid()) + "_" + str(int(time.time())) + ".gdb"
+            arcpy.CreateFileGDB_management(folder, name)
+            self.temp_gdb = os.path.join(folder, name)
+        return self.temp_gdb
+
+    def path(self, name, consumers=1, needs_area=False):
+        # Path for a new intermediate dataset that will be read by the given number of later steps
+        if self.mode is None:
+            return name
+        if self.mode == "in_memory" and not needs_area:
+            dataset = os.path.join("in_memory", name)
+        else:
+            dataset = os.path.join(self._get_temp_gdb(), name)
+        self.consumers[dataset] = consumers
+        return dataset
+
+    def consumed(self, dataset):
+        # Call after each step that reads the dataset. It is deleted once all its consumers have run.
+        if dataset not in self.consumers:
+            return
+        self.consumers[dataset] = self.consumers[dataset] - 1
+        if self.consumers[dataset] <= 0:
+            self.release(dataset)
+
+    def release(self, dataset):
+        if dataset in self.consumers:
+            del self.consumers[dataset]
+            if arcpy.Exists(dataset):
+                arcpy.Delete_management(dataset)
+
+    def close(self, success=True):
+        # Delete all remaining intermediates. The temporary gdb is kept after a failure, for debugging.
+        for dataset in list(self.consumers.keys()):
+            if success or self.temp_gdb is None or not dataset.startswith(self.temp_gdb):
+                self.release(dataset)
+        if self.mode == "in_memory":
+            arcpy.Delete_management("in_memory")
+        if success and self.temp_gdb is not None:
+            arcpy.Delete_management(self.temp_gdb)
+            self.temp_gdb = None
+
+def snap_features(in_features, snap_env, skip_identical_to=None):
+    # Geometry-only replacement for Snap_edit. Edits in_features in place, applying each [dataset, "VERTEX" or "EDGE", "tolerance units"]
+    # entry of snap_env in turn, as Snap_edit does. Tolerances are taken to be in the units of the spatial reference (metres for BNG).
+    # Features identical to a polygon in skip_identical_to are not snapped. Returns the number of features changed.
+    import numpy as np
+    import shapely
+    import MergeFunctions
+    geoms, columns = read_geometries(in_features, ["OID@"])
+    if skip_identical_to:
+        skip = MergeFunctions.identical_geometries(geoms, read_geometries(skip_identical_to, [])[0])
+        print("      " + str(int(skip.sum())) + " features are identical to " + skip_identical_to + " and will not be snapped")
+    else:
+        skip = None
+    base_geoms = {}
+    changed = np.zeros(len(geoms), dtype=bool)
+    for dataset, snap_type, tolerance in snap_env:
+        if dataset not in base_geoms:
+            base_geoms[dataset] = read_geometries(dataset, [])[0]
+        geoms, env_changed = MergeFunctions.snap_geometries(geoms, base_geoms[dataset], snap_type.upper(), float(str(tolerance).split()[0]), skip)
+        changed = changed | env_changed
+
+    snapped = dict((oid, geom) for oid, geom, is_changed in zip(columns["OID@"].tolist(), geoms, changed) if is_changed)
+    with arcpy.da.UpdateCursor(in_features, ["OID@", "SHAPE@"]) as cursor:
+        for row in cursor:
+            if row[0] in snapped:
+                row[1] = arcpy.FromWKB(bytearray(shapely.to_wkb(snapped[row[0]])))
+                cursor.updateRow(row)
+    return len(snapped)
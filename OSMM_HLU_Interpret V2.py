@@ -12,7 +12,10 @@
 
 import time, arcpy
 import os
+import sys
 import MyFunctions
+import RuleFunctions
+import PipelineFunctions
 
 print(''.join(["## Started on : ", time.ctime()]))
 
@@ -124,6 +127,10 @@ else:
 # undefined_or_original = "original"
 undefined_or_original = "undefined"
 
+# Apply the habitat interpretation code blocks as lookup tables: each function is run once for each distinct combination of its input
+# fields instead of once per row in CalculateField
+lookup_interpretation = True
+
 # Check the county from the table of LADs, to identify the list of LADs to process
 LADs = []
 if region == "Oxon":
@@ -150,6 +157,14 @@ else:
     OSMM_Group = "DescriptiveGroup"
     OSMM_Make = "Make"
 
+# Parameters can be overridden by the benchmark harness (Benchmark.py)
+PipelineFunctions.apply_overrides(globals())
+
+# If gdbs are given on the command line (e.g. by Benchmark.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
+    LADs = [PipelineFunctions.gdb_name(gdb) for gdb in gdbs]
+
 print("LADs to process: " + "\n ".join(LADs))
 
 i=0
@@ -367,8 +382,12 @@ def Simplify_OSMM(OSMM_Group, OSMM_Term, OSMM_Make):
         else:
             return "Undefined"
 """
-            expression = "Simplify_OSMM(!" + OSMM_Group + "!, !" + OSMM_Term + "!, !" + OSMM_Make + "!)"
-            arcpy.CalculateField_management(in_file, "OSMM_hab", expression, "PYTHON_9.3", codeblock)
+            if lookup_interpretation:
+                MyFunctions.calculate_field_by_lookup(in_file, "OSMM_hab", RuleFunctions.compile_function(codeblock, "Simplify_OSMM"),
+                                                      [OSMM_Group, OSMM_Term, OSMM_Make])
+            else:
+                expression = "Simplify_OSMM(!" + OSMM_Group + "!, !" + OSMM_Term + "!, !" + OSMM_Make + "!)"
+                arcpy.CalculateField_management(in_file, "OSMM_hab", expression, "PYTHON_9.3", codeblock)
 
         # Simplify the HLU habitats
         #--------------------------
@@ -436,7 +455,11 @@ def Simplify_HLU(HLU_Hab):
     else:
         return HLU_Hab.capitalize()
 """
-            arcpy.CalculateField_management(in_file, "HLU_hab", "Simplify_HLU(!" + in_hab_field + "!)", "PYTHON_9.3", codeblock)
+            if lookup_interpretation:
+                MyFunctions.calculate_field_by_lookup(in_file, "HLU_hab", RuleFunctions.compile_function(codeblock, "Simplify_HLU"),
+                                                      [in_hab_field])
+            else:
+                arcpy.CalculateField_management(in_file, "HLU_hab", "Simplify_HLU(!" + in_hab_field + "!)", "PYTHON_9.3", codeblock)
 
         # Choose whether to use OSMM or HLU
         # ----------------------------------
@@ -523,8 +546,14 @@ def Interpret_hab(HLU_hab, OSMM_hab, OSMM_Make, OSMM_area, HLU_area, undefined_o
     else:
         return HLU_hab.capitalize()
  """
-            expression = "Interpret_hab(!HLU_hab!, !OSMM_hab!, !Make!, !OSMM_Area!, !HLU_Area!, '" + undefined_or_original + "')"
-            arcpy.CalculateField_management(in_file, Hab_field, expression, "PYTHON_9.3", codeblock)
+            if lookup_interpretation:
+                # Only the last rule uses the areas (OSMM_area < HLU_area * 0.6), so the area test is only needed for some rows
+                MyFunctions.calculate_field_by_lookup(in_file, Hab_field, RuleFunctions.compile_function(codeblock, "Interpret_hab"),
+                                                      ["HLU_hab", "OSMM_hab", "Make"], [undefined_or_original],
+                                                      ["OSMM_Area", "HLU_Area"], 0.6)
+            else:
+                expression = "Interpret_hab(!HLU_hab!, !OSMM_hab!, !Make!, !OSMM_Area!, !HLU_Area!, '" + undefined_or_original + "')"
+                arcpy.CalculateField_management(in_file, Hab_field, expression, "PYTHON_9.3", codeblock)
 
         # Update Interpreted_habitat column where appropriate using S41 Habitat information (previously known as BAP habitat)
         if interpret_BAP:
@@ -592,8 +621,12 @@ def interpretBAP(Hab, BAP):
     else:
         return Hab
 """
-            arcpy.CalculateField_management(in_file, Hab_field,
-                                            "interpretBAP( !" + Hab_field + "! , !" + BAP_field + "!)", "PYTHON_9.3", codeblock)
+            if lookup_interpretation:
+                MyFunctions.calculate_field_by_lookup(in_file, Hab_field, RuleFunctions.compile_function(codeblock, "interpretBAP"),
+                                                      [Hab_field, BAP_field])
+            else:
+                arcpy.CalculateField_management(in_file, Hab_field,
+                                                "interpretBAP( !" + Hab_field + "! , !" + BAP_field + "!)", "PYTHON_9.3", codeblock)
 
 print(''.join(["## Completed on : ", time.ctime()]))
 exit()
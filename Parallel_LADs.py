@@ -0,0 +1,48 @@
+# Runs one of the per-LAD scripts over many LAD geodatabases in parallel, one Python process per gdb.
+# Works with Merge_into_Base_Map_V5b.py, Public_accessV3.py, SetUpScoreTable.py and Join_Greenspace.py, which all accept
+# a list of gdbs on the command line instead of their own gdbs list.
+# -----------------------------------------------------------------------------------------------------------------------
+# BEFORE RUNNING THIS SCRIPT
+# Set the region, method and stage flags in the script to be run as usual. Any region-wide steps that are run before the
+# loop over gdbs (e.g. create_access_layer in Public_accessV3.py, prep_openGS in Join_Greenspace.py) must be run first on
+# their own and then switched off, otherwise every worker would repeat them on the shared data.
+# Each worker needs its own ArcGIS licence seat and enough memory for the largest LAD, so do not set more workers than cores.
+# -----------------------------------------------------------------------------------------------------------------------
+# Usage: python Parallel_LADs.py [script] [number of workers]
+# or set the parameters below and run without arguments.
+import os
+import sys
+import time
+import PipelineFunctions
+import TimingFunctions
+
+# Script to run, folder containing the LAD gdbs and number of worker processes
+script = "Merge_into_Base_Map_V5b.py"
+folder = r"M:\urban_development_natural_capital\LADs"
+num_workers = 8
+# Log files for each gdb and the failure report are written here
+log_folder = os.path.join(folder, "logs")
+
+# All gdbs in the folder, or comment out and list the gdbs to (re)run, one row per gdb
+gdbs = PipelineFunctions.list_gdbs(folder)
+# gdbs = []
+# gdbs.append(os.path.join(folder, "Oxford.gdb"))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        script = sys.argv[1]
+    if len(sys.argv) > 2:
+        num_workers = int(sys.argv[2])
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+
+    print(''.join(["## Started on : ", time.ctime()]))
+    results = PipelineFunctions.run_parallel(script, gdbs, num_workers, log_folder)
+    report = PipelineFunctions.failure_report(results)
+    # Slowest steps in each gdb, from the timing logs written by the scripts (see TimingFunctions.py)
+    report = report + "\n\n" + TimingFunctions.timing_report(gdbs)
+    print(report)
+    report_file = os.path.join(log_folder, os.path.splitext(os.path.basename(script))[0] + "_report.txt")
+    with open(report_file, "w") as f:
+        f.write(report + "\n")
+    print("Report saved in " + report_file)
+    print(''.join(["## Completed on : ", time.ctime()]))
@@ -0,0 +1,163 @@
+# Pipeline functions
+# ------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Helpers for running the per-LAD scripts (Merge_into_Base_Map_V5b.py, Public_accessV3.py, SetUpScoreTable.py,
+# Join_Greenspace.py) over many LAD geodatabases. They do not import arcpy, so the runner process does not start ArcGIS:
+# each gdb is processed by a separate Python process that runs the script with the gdb as its command line argument.
+# Also holds the per-gdb stage manifest used to skip completed stages when a script is restarted.
+# -------------------------------------------------------------------------------------------------------------------
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+
+def list_gdbs(folder):
+    # All file geodatabases in a folder, in alphabetical order (equivalent of arcpy.ListWorkspaces("*", "FileGDB"))
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith(".gdb") and os.path.isdir(os.path.join(folder, name))]
+
+
+def gdb_name(gdb):
+    # LAD name from the gdb path, e.g. "D:\LADs\Oxford.gdb" -> "Oxford"
+    return os.path.splitext(os.path.basename(gdb.rstrip("\\/")))[0]
+
+
+def run_script_on_gdb(task):
+    # Worker: run one script on one gdb in a new Python process. Output goes to a log file per gdb. Each process gets its own
+    # TEMP folder so that arcpy scratch files from different LADs do not clash. Returns (gdb, return code, seconds, log file).
+    script, gdb, log_folder = task
+    name = gdb_name(gdb)
+    log_file = os.path.join(log_folder, name + "_" + os.path.splitext(os.path.basename(script))[0] + ".log")
+    temp_folder = os.path.join(log_folder, "temp_" + name)
+    if not os.path.exists(temp_folder):
+        os.makedirs(temp_folder)
+    env = dict(os.environ)
+    env["TEMP"] = temp_folder
+    env["TMP"] = temp_folder
+
+    start = time.time()
+    with open(log_file, "w") as log:
+        try:
+            return_code = subprocess.call([sys.executable, "-u", script, gdb], stdout=log, stderr=subprocess.STDOUT, env=env)
+        except Exception as e:
+            log.write("Could not start " + script + ": " + str(e) + "\n")
+            return_code = -1
+    return gdb, return_code, time.time() - start, log_file
+
+
+def run_parallel(script, gdbs, num_workers=None, log_folder=None):
+    # Run a per-LAD script on each gdb using a pool of num_workers processes (default: one per CPU).
+    # Prints progress as each gdb finishes and returns the list of results from run_script_on_gdb, in order of completion.
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if log_folder is None:
+        log_folder = os.path.join(os.path.dirname(os.path.abspath(gdbs[0])), "logs")
+    if not os.path.exists(log_folder):
+        os.makedirs(log_folder)
+    script = os.path.abspath(script)
+
+    print("Running " + os.path.basename(script) + " on " + str(len(gdbs)) + " gdbs with " + str(num_workers) + " workers on " + time.ctime())
+    results = []
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        for result in pool.imap_unordered(run_script_on_gdb, [(script, gdb, log_folder) for gdb in gdbs]):
+            results.append(result)
+            gdb, return_code, seconds, log_file = result
+            status = "completed" if return_code == 0 else "FAILED (exit code " + str(return_code) + ")"
+            print("   " + str(len(results)) + " of " + str(len(gdbs)) + ": " + gdb_name(gdb) + " " + status + " in "
+                  + str(int(seconds)) + " s on " + time.ctime())
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def failure_report(results, num_lines=30):
+    # Single report of all failed gdbs, with the last lines of each log (which hold the error messages printed by the scripts)
+    failed = [result for result in results if result[1] != 0]
+    lines = [str(len(results) - len(failed)) + " gdbs completed, " + str(len(failed)) + " failed."]
+    if len(failed) > 0:
+        lines.append("Failed gdbs:")
+        lines.extend(["   " + result[0] for result in failed])
+    for gdb, return_code, seconds, log_file in failed:
+        lines.append("")
+        lines.append(gdb + " failed (exit code " + str(return_code) + "). Log: " + log_file)
+        with open(log_file) as log:
+            lines.extend([line.rstrip() for line in log.readlines()[-num_lines:]])
+    return "\n".join(lines)
+
+
+# Checkpoint and resume
+# ---------------------
+# Each gdb has a manifest (a JSON file next to the gdb) recording the stages that have completed, with fingerprints of their
+# input and output datasets and the settings used. On a rerun, a stage is skipped if its record matches the current fingerprints
+# and settings. When a stage is rerun, the records of all later stages are removed, so they are rerun too.
+# Fingerprints are calculated by MyFunctions.fingerprint.
+
+def manifest_path(gdb):
+    return os.path.splitext(gdb.rstrip("\\/"))[0] + "_manifest.json"
+
+
+def load_manifest(gdb):
+    path = manifest_path(gdb)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(gdb, manifest):
+    # Write to a temporary file first so that a crash while saving does not leave a corrupt manifest
+    path = manifest_path(gdb)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(path + ".tmp", path)
+
+
+def stage_is_current(manifest, stage, inputs, outputs, settings=None):
+    # True if the stage has completed before with the same input and output fingerprints and settings.
+    # Values are compared after a round trip through JSON so that e.g. tuples and lists compare equal.
+    record = manifest.get(stage)
+    if record is None or any(fingerprint is None for fingerprint in outputs.values()):
+        return False
+    current = json.loads(json.dumps({"inputs": inputs, "outputs": outputs, "settings": settings}))
+    return all(record.get(key) == current[key] for key in current)
+
+
+def record_stage(manifest, stage, inputs, outputs, settings=None, later_stages=()):
+    # Record a completed stage. Records of later stages are removed, because their inputs may now be different.
+    manifest[stage] = json.loads(json.dumps({"inputs": inputs, "outputs": outputs, "settings": settings}))
+    manifest[stage]["completed"] = time.ctime()
+    for later_stage in later_stages:
+        manifest.pop(later_stage, None)
+
+
+# Parameter overrides
+# -------------------
+# The benchmark harness (Benchmark.py) runs the per-LAD scripts with some parameters changed (e.g. significant_size or the
+# python_* engine flags) by passing a JSON dictionary of parameter name: value in the NATCAP_OVERRIDES environment variable.
+# Scripts call override() for parameters that select a parameter block (e.g. merge_type) and apply_overrides(globals()) after
+# their parameter block for the rest.
+
+def override(name, value):
+    # The overridden value of one parameter, or value if it is not overridden
+    overrides = json.loads(os.environ.get("NATCAP_OVERRIDES") or "{}")
+    return overrides.get(name, value)
+
+
+def apply_overrides(namespace):
+    # Set the overridden parameters in a script's namespace. Names that the script does not define are an error, so a typo
+    # in a benchmark configuration does not silently run the default settings.
+    overrides = json.loads(os.environ.get("NATCAP_OVERRIDES") or "{}")
+    for name in sorted(overrides):
+        if name not in namespace:
+            raise ValueError("Parameter " + name + " is not defined in this script")
+        namespace[name] = overrides[name]
+        print("   Parameter " + name + " set to " + repr(overrides[name]))
+    return overrides
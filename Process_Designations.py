@@ -18,6 +18,9 @@ first_part = False
 check_identical = False
 second_part = False
 elim_slivers = False
+# Eliminate and delete slivers and gaps in one pass with MyFunctions.eliminate_slivers instead of Eliminate / DeleteFeatures.
+# Needs Python 3 (ArcGIS Pro) with shapely 2.0.
+python_eliminate = False
 
 if region == "Arc":
     Union_gdb = r"D:\cenv0389\Oxon_GIS\OxCamArc\Data\Union_Designations.gdb"
@@ -89,36 +92,51 @@ if second_part:
     exit()
 
 if elim_slivers:
-    print("Eliminating sliver gaps")
-    arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid", "Elim_layer")
-    expression = "(Type = 'Gap' AND Shape_Area < 500) OR Type = 'sliver'"
-    arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause = expression)
-    arcpy.Eliminate_management("Elim_layer","Desig_union_repair_sp_delid_elim")
-    arcpy.Delete_management("Elim_layer")
-
-    # Delete remaining (larger) gaps
-    print("Deleting large gaps")
-    arcpy.CopyFeatures_management("Desig_union_repair_sp_delid_elim","Desig_union_repair_sp_delid_elim_del")
-    arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Del_layer")
-    arcpy.SelectLayerByAttribute_management("Del_layer", where_clause = "Type = 'Gap' AND Shape_Area >= 500")
-    arcpy.DeleteFeatures_management("Del_layer")
-    arcpy.Delete_management("Del_layer")
-
-    # Eliminate non-gap slivers
-    print("Eliminating non-gap slivers")
-    if road_verge:
-        # Eliminate in two stages: do small features (Road verge NR) separately
-        arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Elim_layer2")
-        arcpy.SelectLayerByAttribute_management("Elim_layer2", where_clause = "(Shape_Area < 500 AND FID_RVNR_input_diss = -1)")
-        arcpy.Eliminate_management("Elim_layer2", "Desig_elim2")
-        arcpy.MakeFeatureLayer_management("Desig_elim2", "Elim_layer3")
-        arcpy.SelectLayerByAttribute_management("Elim_layer3", where_clause = "(Shape_Area < 50 AND FID_RVNR_input_diss >= 0)")
-        arcpy.Eliminate_management("Elim_layer2", "Desig_clean")
+    if python_eliminate:
+        print("Eliminating sliver gaps and deleting large gaps")
+        expression = "(Type = 'Gap' AND Shape_Area < 500) OR Type = 'sliver'"
+        num_elim, num_del = MyFunctions.eliminate_slivers("Desig_union_repair_sp_delid", "Desig_union_repair_sp_delid_elim_del", expression,
+                                                          delete_expression="Type = 'Gap' AND Shape_Area >= 500")
+        print("   " + str(num_elim) + " sliver gaps eliminated and " + str(num_del) + " large gaps deleted")
+
+        print("Eliminating non-gap slivers")
+        if road_verge:
+            # Eliminate in two stages: do small features (Road verge NR) separately
+            MyFunctions.eliminate_slivers("Desig_union_repair_sp_delid_elim_del", "Desig_elim2", "(Shape_Area < 500 AND FID_RVNR_input_diss = -1)")
+            MyFunctions.eliminate_slivers("Desig_elim2", "Desig_clean", "(Shape_Area < 50 AND FID_RVNR_input_diss >= 0)")
+        else:
+            MyFunctions.eliminate_slivers("Desig_union_repair_sp_delid_elim_del", "Desig_clean", "Shape_Area < 500")
     else:
-        arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Elim_layer2")
-        arcpy.SelectLayerByAttribute_management("Elim_layer2", where_clause = "Shape_Area < 500")
-        arcpy.Eliminate_management("Elim_layer2","Desig_clean")
-    arcpy.Delete_management("Elim_layer")
+        print("Eliminating sliver gaps")
+        arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid", "Elim_layer")
+        expression = "(Type = 'Gap' AND Shape_Area < 500) OR Type = 'sliver'"
+        arcpy.SelectLayerByAttribute_management("Elim_layer", where_clause = expression)
+        arcpy.Eliminate_management("Elim_layer","Desig_union_repair_sp_delid_elim")
+        arcpy.Delete_management("Elim_layer")
+
+        # Delete remaining (larger) gaps
+        print("Deleting large gaps")
+        arcpy.CopyFeatures_management("Desig_union_repair_sp_delid_elim","Desig_union_repair_sp_delid_elim_del")
+        arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Del_layer")
+        arcpy.SelectLayerByAttribute_management("Del_layer", where_clause = "Type = 'Gap' AND Shape_Area >= 500")
+        arcpy.DeleteFeatures_management("Del_layer")
+        arcpy.Delete_management("Del_layer")
+
+        # Eliminate non-gap slivers
+        print("Eliminating non-gap slivers")
+        if road_verge:
+            # Eliminate in two stages: do small features (Road verge NR) separately
+            arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Elim_layer2")
+            arcpy.SelectLayerByAttribute_management("Elim_layer2", where_clause = "(Shape_Area < 500 AND FID_RVNR_input_diss = -1)")
+            arcpy.Eliminate_management("Elim_layer2", "Desig_elim2")
+            arcpy.MakeFeatureLayer_management("Desig_elim2", "Elim_layer3")
+            arcpy.SelectLayerByAttribute_management("Elim_layer3", where_clause = "(Shape_Area < 50 AND FID_RVNR_input_diss >= 0)")
+            arcpy.Eliminate_management("Elim_layer2", "Desig_clean")
+        else:
+            arcpy.MakeFeatureLayer_management("Desig_union_repair_sp_delid_elim_del", "Elim_layer2")
+            arcpy.SelectLayerByAttribute_management("Elim_layer2", where_clause = "Shape_Area < 500")
+            arcpy.Eliminate_management("Elim_layer2","Desig_clean")
+        arcpy.Delete_management("Elim_layer")
 
     # Repair geometry again
     arcpy.CopyFeatures_management("Desig_clean", "Designations")
@@ -10,7 +10,9 @@
 import time
 import arcpy
 import os
+import sys
 import MyFunctions
+import PipelineFunctions
 
 arcpy.CheckOutExtension("Spatial")
 
@@ -217,7 +219,7 @@ if create_access_layer:
                 # Buffer paths separately for each LAD
                 for gdb in gdbs:
                     arcpy.env.workspace = gdb
-                    numrows = arcpy.GetCount_management(os.path.join(gdb, base_map))
+                    numrows = MyFunctions.count_rows(os.path.join(gdb, base_map))
                     print ("Buffering paths for " + gdb)
                     print("   Clipping paths")
                     arcpy.Clip_analysis(os.path.join(data_gdb,"Paths_merge"), boundary, "Paths_merge_clip")
@@ -308,7 +310,7 @@ if create_access_layer:
             else:
                 # Check for any duplicate polygons
                 arcpy.FindIdentical_management(in_file + "_input", "Identical_" + in_file, ["Shape"], output_record_option="ONLY_DUPLICATES")
-                numrows = arcpy.GetCount_management("Identical_" + in_file)
+                numrows = MyFunctions.count_rows("Identical_" + in_file)
                 if numrows>0:
                     print ("Warning - " + str(numrows) + " duplicate polygons found in " + in_file +
                            "_input. All but one of each shape will be deleted.")
@@ -342,7 +344,7 @@ if create_access_layer:
 
         print ("Merging paths and areas")
         arcpy.Merge_management(["Access_areas_merge", "Access_paths_erase"], "Access_merge")
-        print("After merge there are " + str(arcpy.GetCount_management("Access_merge")) + " rows")
+        print("After merge there are " + str(MyFunctions.count_rows("Access_merge")) + " rows")
 
         print ("Dissolving - retaining type, name and description")
         arcpy.Dissolve_management("Access_merge", "Access_merge_diss", ["PAType", "PADescription", "PAName"], multi_part="SINGLE_PART")
@@ -352,7 +354,7 @@ if create_access_layer:
         except:
             print ("Union failed. Please do manually then comment out preceding steps and restart.")
             exit()
-        print("After union there are " + str(arcpy.GetCount_management("Access_merge_union")) + " rows")
+        print("After union there are " + str(MyFunctions.count_rows("Access_merge_union")) + " rows")
 
     # If description is blank, fill in with Type
     print ("Filling in missing Descriptions")
@@ -378,7 +380,7 @@ if create_access_layer:
     arcpy.RemoveJoin_management("join_lyr2", AccessTable_name)
     arcpy.Delete_management("join_lyr2")
 
-    print("Sorting " + str(arcpy.GetCount_management("Access_merge_union")) + " rows")
+    print("Sorting " + str(MyFunctions.count_rows("Access_merge_union")) + " rows")
     # Sort by access multiplier (descending) so highest multipliers are at the top
     arcpy.Sort_management("Access_merge_union", "Access_merge_union_sort", [["AccessMult", "DESCENDING"]])
 
@@ -389,21 +391,28 @@ if create_access_layer:
     if dissolve_paths:
         arcpy.SelectLayerByAttribute_management("del_lyr", where_clause="AccessType <> 'Path'")
     arcpy.DeleteIdentical_management("del_lyr", ["Shape"])
-    print("After deleting identical polygons there are " + str(arcpy.GetCount_management("Access_merge_union_sort")) + " rows")
+    print("After deleting identical polygons there are " + str(MyFunctions.count_rows("Access_merge_union_sort")) + " rows")
     arcpy.Delete_management("del_lyr")
 
     print ("Dissolving")
     dissolve_fields = ["PAType", "PADescription", "PAName", "Source", "AccessType", "AccessMult"]
     arcpy.Dissolve_management("Access_merge_union_sort","Access_merge_union_sort_diss", dissolve_field=dissolve_fields)
-    print("After dissolving there are " + str(arcpy.GetCount_management("Access_merge_union_sort_diss")) + " rows")
+    print("After dissolving there are " + str(MyFunctions.count_rows("Access_merge_union_sort_diss")) + " rows")
     arcpy.MultipartToSinglepart_management("Access_merge_union_sort_diss", "Public_access")
-    print("After converting to single part there are " + str(arcpy.GetCount_management("Public_access")) + " rows")
+    print("After converting to single part there are " + str(MyFunctions.count_rows("Public_access")) + " rows")
 
     MyFunctions.check_and_repair("Public_access")
 
+# Parameters can be overridden by the benchmark harness (Benchmark.py)
+PipelineFunctions.apply_overrides(globals())
+
+# If gdbs are given on the command line (e.g. by Parallel_LADs.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
+
 for gdb in gdbs:
     arcpy.env.workspace = gdb
-    numrows = arcpy.GetCount_management(os.path.join(gdb, base_map))
+    numrows = MyFunctions.count_rows(os.path.join(gdb, base_map))
     print (''.join(["### Started processing ", gdb, " on ", time.ctime(), ": ", str(numrows), " rows"]))
 
     if clip_PA_into_LAD_gdb:
@@ -469,7 +478,7 @@ for gdb in gdbs:
         print("    Converting to single part and sorting")
         arcpy.MultipartToSinglepart_management(base_map + "_merge", base_map + "_merge_sp")
         arcpy.Sort_management(base_map + "_merge_sp", base_map + "_PA", [["SHAPE", "ASCENDING"]], "PEANO")
-        print ("    Rows have increased from " + str(numrows) + " to " + str(arcpy.GetCount_management(base_map + "_PA")))
+        print ("    Rows have increased from " + str(numrows) + " to " + str(MyFunctions.count_rows(base_map + "_PA")))
 
         # Check and repair geometry
         MyFunctions.check_and_repair(base_map + "_PA")
@@ -0,0 +1,413 @@
+# Rule functions
+# --------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Pure Python evaluation of the attribute rules used with MyFunctions.select_and_copy, so that a whole list of rules can be applied
+# in a single UpdateCursor pass (MyFunctions.apply_rules) instead of one layer selection and CalculateField per rule.
+# - compile_where turns an SQL where clause into a Python function of a row. It covers the SQL used in these scripts:
+#   comparisons, + - * /, AND / OR / NOT, IS [NOT] NULL, [NOT] LIKE, [NOT] IN (...), [NOT] BETWEEN, UPPER() and LOWER().
+#   Nulls follow SQL three-valued logic, so a comparison with a null is unknown and the row is not selected.
+# - compile_value turns a CalculateField PYTHON_9.3 expression (or a plain number) with !field! references into a Python function.
+# Rows are dictionaries keyed by lower case field name. Anything that cannot be translated raises ValueError, so the caller
+# can fall back to the ArcGIS tools for that rule.
+# -----------------------------------------------------------------------------------------------------------------------
+import collections
+import re
+
+string_types = (str, type(u""))
+
+token_pattern = re.compile(r"""\s*(?:
+    (?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?) |
+    (?P<string>'(?:[^']|'')*') |
+    (?P<quoted>"[^"]+") |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<op><>|!=|<=|>=|=|<|>|\(|\)|,|\+|-|\*|/)
+    )""", re.VERBOSE)
+
+keywords = set(["AND", "OR", "NOT", "IS", "NULL", "LIKE", "IN", "BETWEEN", "ESCAPE"])
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("Cannot translate SQL near: " + expression[position:])
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "number":
+            tokens.append(("value", float(text) if ("." in text or "e" in text.lower()) else int(text)))
+        elif kind == "string":
+            tokens.append(("value", text[1:-1].replace("''", "'")))
+        elif kind == "quoted":
+            tokens.append(("field", text[1:-1].lower()))
+        elif kind == "name" and text.upper() in keywords:
+            tokens.append(("keyword", text.upper()))
+        elif kind == "name":
+            tokens.append(("name", text))
+        else:
+            tokens.append(("op", text))
+    return tokens
+
+
+# Three-valued logic helpers: None stands for SQL 'unknown'
+
+def sql_and(a, b):
+    if a is False or b is False:
+        return False
+    if a is None or b is None:
+        return None
+    return True
+
+
+def sql_or(a, b):
+    if a is True or b is True:
+        return True
+    if a is None or b is None:
+        return None
+    return False
+
+
+def sql_not(a):
+    if a is None:
+        return None
+    return not a
+
+
+comparisons = {"=": lambda a, b: a == b, "<>": lambda a, b: a != b, "!=": lambda a, b: a != b,
+               "<": lambda a, b: a < b, ">": lambda a, b: a > b, "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b}
+arithmetic = {"+": lambda a, b: a + b, "-": lambda a, b: a - b, "*": lambda a, b: a * b, "/": lambda a, b: a / b}
+
+
+def like_to_regex(pattern):
+    # SQL LIKE pattern to a compiled regular expression (% = any characters, _ = one character). Case sensitive, as in file gdbs.
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts) + r"\Z", re.DOTALL)
+
+
+class WhereParser(object):
+    # Recursive descent parser producing nested Python closures. The field names used are collected in self.fields.
+
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.fields = []
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def accept(self, kind, text=None):
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.position = self.position + 1
+            return True
+        return False
+
+    def expect(self, kind, text=None):
+        if not self.accept(kind, text):
+            raise ValueError("Cannot translate SQL: expected " + str(text or kind) + " but found " + str(self.peek()[1]))
+
+    def parse(self):
+        node = self.or_expression()
+        if self.position != len(self.tokens):
+            raise ValueError("Cannot translate SQL: unexpected " + str(self.peek()[1]))
+        return node
+
+    def or_expression(self):
+        node = self.and_expression()
+        while self.accept("keyword", "OR"):
+            left, right = node, self.and_expression()
+            node = (lambda left, right: lambda row: sql_or(left(row), right(row)))(left, right)
+        return node
+
+    def and_expression(self):
+        node = self.not_expression()
+        while self.accept("keyword", "AND"):
+            left, right = node, self.not_expression()
+            node = (lambda left, right: lambda row: sql_and(left(row), right(row)))(left, right)
+        return node
+
+    def not_expression(self):
+        if self.accept("keyword", "NOT"):
+            inner = self.not_expression()
+            return lambda row: sql_not(inner(row))
+        return self.predicate()
+
+    def predicate(self):
+        left = self.additive()
+        token = self.peek()
+        if token[0] == "op" and token[1] in comparisons:
+            self.position = self.position + 1
+            right = self.additive()
+            compare = comparisons[token[1]]
+
+            def node(row):
+                a = left(row)
+                b = right(row)
+                if a is None or b is None:
+                    return None
+                return compare(a, b)
+            return node
+        if self.accept("keyword", "IS"):
+            negate = self.accept("keyword", "NOT")
+            self.expect("keyword", "NULL")
+            if negate:
+                return lambda row: left(row) is not None
+            return lambda row: left(row) is None
+        negate = self.accept("keyword", "NOT")
+        if self.accept("keyword", "LIKE"):
+            token = self.peek()
+            self.expect("value")
+            if not isinstance(token[1], string_types):
+                raise ValueError("Cannot translate SQL: LIKE needs a string pattern")
+            regex = like_to_regex(token[1])
+
+            def node(row):
+                a = left(row)
+                if a is None:
+                    return None
+                return (regex.match(a) is not None) != negate
+            return node
+        if self.accept("keyword", "IN"):
+            self.expect("op", "(")
+            values = [self.additive()]
+            while self.accept("op", ","):
+                values.append(self.additive())
+            self.expect("op", ")")
+
+            def node(row):
+                a = left(row)
+                if a is None:
+                    return None
+                items = [value(row) for value in values]
+                if a in items:
+                    return not negate
+                if None in items:
+                    return None
+                return negate
+            return node
+        if self.accept("keyword", "BETWEEN"):
+            low = self.additive()
+            self.expect("keyword", "AND")
+            high = self.additive()
+
+            def node(row):
+                a, lo, hi = left(row), low(row), high(row)
+                if a is None or lo is None or hi is None:
+                    return None
+                return (lo <= a <= hi) != negate
+            return node
+        if negate:
+            raise ValueError("Cannot translate SQL: unexpected NOT")
+        return left
+
+    def additive(self):
+        node = self.term()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-"):
+            operation = arithmetic[self.peek()[1]]
+            self.position = self.position + 1
+            node = self.binary(operation, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/"):
+            operation = arithmetic[self.peek()[1]]
+            self.position = self.position + 1
+            node = self.binary(operation, node, self.unary())
+        return node
+
+    def binary(self, operation, left, right):
+        def node(row):
+            a = left(row)
+            b = right(row)
+            if a is None or b is None:
+                return None
+            return operation(a, b)
+        return node
+
+    def unary(self):
+        if self.accept("op", "-"):
+            inner = self.unary()
+            return lambda row: None if inner(row) is None else -inner(row)
+        return self.primary()
+
+    def primary(self):
+        token = self.peek()
+        if self.accept("value"):
+            value = token[1]
+            return lambda row: value
+        if self.accept("keyword", "NULL"):
+            return lambda row: None
+        if self.accept("op", "("):
+            node = self.or_expression()
+            self.expect("op", ")")
+            return node
+        if token[0] == "name" and self.peek(1) == ("op", "("):
+            function = token[1].upper()
+            if function not in ("UPPER", "LOWER"):
+                raise ValueError("Cannot translate SQL function " + token[1])
+            self.position = self.position + 2
+            inner = self.additive()
+            self.expect("op", ")")
+            if function == "UPPER":
+                return lambda row: None if inner(row) is None else inner(row).upper()
+            return lambda row: None if inner(row) is None else inner(row).lower()
+        if token[0] in ("name", "field"):
+            self.position = self.position + 1
+            name = token[1].lower()
+            if name not in self.fields:
+                self.fields.append(name)
+            return lambda row: row[name]
+        raise ValueError("Cannot translate SQL near " + str(token[1]))
+
+
+def compile_where(expression):
+    # Returns (function of a row that is True if the row is selected, list of lower case field names used).
+    parser = WhereParser(expression)
+    node = parser.parse()
+    return (lambda row: node(row) is True), parser.fields
+
+
+field_reference = re.compile(r"!([^!]+)!")
+string_literal = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*\"""")
+
+
+def compile_value(value):
+    # Returns (function of a row giving the value to copy, list of lower case field names used) for a select_and_copy copy_string.
+    # Numbers are used as they are. Strings are CalculateField PYTHON_9.3 expressions: each !field! is replaced by the row value.
+    # CalculateField substitutes text values as quoted strings, so a field next to a string literal (e.g. "!A!' vs '!B!") is
+    # implicit string concatenation; an explicit + is inserted in that case. Where the expression fails for a row with a TypeError
+    # (e.g. !field! + ' text' with a null field) the value is None, as CalculateField writes null for that row.
+    if not isinstance(value, string_types):
+        return (lambda row: value), []
+    fields = []
+    pieces = []
+    position = 0
+    previous_is_string = False
+    # Split into string literals, field references and other code, inserting + between adjacent strings and text fields
+    pattern = re.compile(string_literal.pattern + "|" + field_reference.pattern)
+    for match in pattern.finditer(value):
+        between = value[position:match.start()]
+        if between.strip() == "" and previous_is_string and pieces:
+            between = " + "
+        pieces.append(between)
+        if match.group(1) is not None:
+            name = match.group(1).lower()
+            if name not in fields:
+                fields.append(name)
+            pieces.append("row[" + repr(name) + "]")
+        else:
+            pieces.append(match.group(0))
+        previous_is_string = True
+        position = match.end()
+        if value[position:].strip() and not value[position:].lstrip()[0] in "'\"!":
+            previous_is_string = False
+    pieces.append(value[position:])
+    code = "".join(pieces)
+    try:
+        compiled = compile(code, "<copy_string>", "eval")
+    except SyntaxError:
+        raise ValueError("Cannot translate expression: " + value)
+
+    def evaluate(row):
+        try:
+            return eval(compiled, {}, {"row": row})
+        except TypeError:
+            return None
+    return evaluate, fields
+
+
+# Lookup tables for code block functions
+# --------------------------------------
+# The habitat interpretation code blocks (e.g. Simplify_OSMM in OSMM_HLU_Interpret V2.py) are functions of a few categorical fields,
+# which have far fewer distinct combinations than there are rows. Instead of running the branch chain for every row in CalculateField,
+# the function is run once per distinct combination and the results are kept in a bounded cache, so each row is a dictionary lookup.
+
+def compile_function(codeblock, function_name):
+    # The function defined in a CalculateField code block
+    namespace = {}
+    exec(codeblock, namespace)
+    return namespace[function_name]
+
+
+class MemoCache(object):
+    # Bounded memo cache for a function of hashable arguments, counting hits and misses. When the cache is full the least recently
+    # used result is dropped, so memory stays bounded even if a key field turns out to have many distinct values.
+
+    def __init__(self, function, max_size=100000):
+        self.function = function
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, *args):
+        if args in self.entries:
+            value = self.entries.pop(args)
+            self.hits = self.hits + 1
+        else:
+            value = self.function(*args)
+            self.misses = self.misses + 1
+            if len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+        self.entries[args] = value
+        return value
+
+    def report(self):
+        text = str(self.hits) + " cache hits, " + str(self.misses) + " misses"
+        if self.evictions > 0:
+            text = text + ", " + str(self.evictions) + " evictions (consider a larger cache)"
+        return text
+
+
+def lookup(function, key_columns, extra_args=(), max_size=100000):
+    # Result of function(*key, *extra_args) for each row, where key is the tuple of the row's values in key_columns, calculated
+    # once per distinct key through a MemoCache. Returns the results and the cache (for its hit and miss counts).
+    import numpy as np
+    cache = MemoCache(function, max_size)
+    keys = list(zip(*[np.asarray(column).tolist() for column in key_columns]))
+    extra_args = tuple(extra_args)
+    results = np.empty(len(keys), dtype=object)
+    for i, key in enumerate(keys):
+        results[i] = cache(*(key + extra_args))
+    return results, cache
+
+
+def lookup_with_area(function, key_columns, area, area_limit, ratio, extra_args=(), max_size=100000):
+    # As lookup, for functions of (*key, area, area_limit, *extra_args) whose only use of the areas is the test area < area_limit * ratio
+    # (e.g. Interpret_hab, which uses the OSMM habitat if the OSMM polygon is much smaller than the HLU polygon).
+    # The function is run once per key with the test true and once with it false. Keys with the same result either way use the lookup;
+    # for the remaining rows the area test is done on the whole arrays at once. Nulls behave as in the row-by-row function under
+    # Python 2: a null area is smaller than any number, and a null area_limit fails (None * ratio), so a TypeError is raised if any
+    # row that needs the area test has a null area_limit. Returns the results, the number of rows that needed the area test and the
+    # cache of one of the two passes.
+    import numpy as np
+    small, cache = lookup(lambda *args: function(*(args[:len(key_columns)] + (0.0, 1.0) + args[len(key_columns):])),
+                          key_columns, extra_args, max_size)
+    large, large_cache = lookup(lambda *args: function(*(args[:len(key_columns)] + (1.0, 0.0) + args[len(key_columns):])),
+                                key_columns, extra_args, max_size)
+    residual = np.array([a != b for a, b in zip(small.tolist(), large.tolist())], dtype=bool)
+    area = np.array([np.nan if value is None else value for value in np.asarray(area).tolist()], dtype=np.float64)
+    area_limit = np.array([np.nan if value is None else value for value in np.asarray(area_limit).tolist()], dtype=np.float64)
+    num_null_limits = int((residual & np.isnan(area_limit)).sum())
+    if num_null_limits > 0:
+        raise TypeError(str(num_null_limits) + " rows need the area test but have a null area_limit. Fill in the missing areas first.")
+    with np.errstate(invalid="ignore"):
+        is_small = np.isnan(area) | (area < area_limit * ratio)
+    results = np.where(residual & ~is_small, large, small)
+    return results, int(residual.sum()), cache
@@ -0,0 +1,137 @@
+# Scenario functions
+# ------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# In-memory version of the Spatial_scenarios aggregation in SpatialNatCapAnalysis.py. Instead of selecting, copying and clipping the
+# natural capital polygons for each scenario and then reading the clipped feature class once per service, one STRtree is built over
+# the natural capital polygons and queried with all the scenario outlines at once. Each overlapping (scenario, polygon) pair is
+# clipped in one vectorised intersection, and the area-weighted sums of every service for every scenario are added up in one pass
+# over the pieces (see MyFunctions.aggregate_scenarios). The overlay functions require shapely 2.0 or later (Python 3, ArcGIS Pro);
+# shapely is imported inside them, so score_matrix (used by MyFunctions.area_weighted_sums) only needs numpy and runs in ArcMap.
+# -------------------------------------------------------------------------------------------------------------------
+import numpy as np
+
+
+def scenario_outlines(geoms, names):
+    # One outline per scenario name (the union of its rows, as Clip uses all the selected clip features), in sorted name order.
+    # Returns the names and an array of geometries.
+    import shapely
+    geoms = np.asarray(geoms, dtype=object)
+    names = np.asarray(names, dtype=object)
+    scenario_names = sorted(set(names.tolist()))
+    outlines = np.empty(len(scenario_names), dtype=object)
+    for i, name in enumerate(scenario_names):
+        outlines[i] = shapely.union_all(geoms[names == name])
+    return scenario_names, outlines
+
+
+def overlay_scenarios(geoms, outlines, clip=True, chunk_size=500000):
+    # Overlay of the natural capital polygons with all the scenario outlines. Returns three arrays with one entry per piece:
+    # index of the scenario, index of the polygon and area of the piece. With clip=True the piece is the part of the polygon inside
+    # the scenario (as Clip_analysis; pieces that only touch the outline are dropped). With clip=False it is the whole polygon
+    # (as SelectLayerByLocation INTERSECT then CopyFeatures).
+    import shapely
+    geoms = np.asarray(geoms, dtype=object)
+    outlines = np.asarray(outlines, dtype=object)
+    tree = shapely.STRtree(geoms)
+    scenario_index, polygon_index = tree.query(outlines, predicate="intersects")
+    if not clip:
+        return scenario_index, polygon_index, shapely.area(geoms)[polygon_index]
+
+    # Polygons wholly inside their scenario do not need clipping. The rest are clipped in chunks to limit the memory used.
+    shapely.prepare(outlines)
+    inside = shapely.contains_properly(outlines[scenario_index], geoms[polygon_index])
+    area = shapely.area(geoms)[polygon_index]
+    edge = np.flatnonzero(~inside)
+    for start in range(0, len(edge), chunk_size):
+        rows = edge[start:start + chunk_size]
+        area[rows] = shapely.area(shapely.intersection(geoms[polygon_index[rows]], outlines[scenario_index[rows]]))
+    keep = area > 0
+    return scenario_index[keep], polygon_index[keep], area[keep]
+
+
+def score_matrix(columns, abs_values=False, names=None, null_as_zero=False, used=None):
+    # Array of scores with one row per polygon and one column per service (names, for the messages). A null score in a polygon
+    # that is used (all polygons, or the polygon indexes in used) raises a TypeError, as None * area did in the per-service
+    # SearchCursor sums, unless null_as_zero is True: then the number of null scores of each service is printed and they count as 0.
+    values = np.empty((len(columns[0]) if columns else 0, len(columns)), dtype=np.float64)
+    for j, column in enumerate(columns):
+        column = np.asarray(column)
+        if column.dtype.kind == "O":
+            column = np.array([np.nan if value is None else value for value in column.tolist()], dtype=np.float64)
+        values[:, j] = column
+    null = np.isnan(values)
+    null_counts = (null if used is None else null[np.unique(used)]).sum(axis=0)
+    if null_counts.any():
+        if names is None:
+            names = ["column " + str(j + 1) for j in range(len(columns))]
+        message = ", ".join(str(count) + " in " + name for name, count in zip(names, null_counts.tolist()) if count > 0)
+        if not null_as_zero:
+            raise TypeError("Null scores (" + message + "). Fill them in, or count them as zero with null_as_zero.")
+        print("      Null scores counted as zero: " + message)
+    values[null] = 0.0
+    if abs_values:
+        values = np.abs(values)
+    return values
+
+
+def area_weighted_sums(scenario_index, polygon_index, area, values, num_scenarios):
+    # Sum of score x area for each scenario (rows) and service (columns), in score x ha (scores are per ha, areas in m2)
+    sums = np.zeros((num_scenarios, values.shape[1]), dtype=np.float64)
+    np.add.at(sums, scenario_index, values[polygon_index] * area[:, None])
+    return sums / 10000
+
+
+def scenario_areas(scenario_index, area, num_scenarios, selected=None):
+    # Area in ha of each scenario, or of the pieces of the selected polygons (a boolean array over the pieces) in each scenario
+    weights = area if selected is None else np.where(selected, area, 0.0)
+    return np.bincount(scenario_index, weights=weights, minlength=num_scenarios) / 10000
+
+
+def class_areas(scenario_index, polygon_index, area, classes, num_scenarios):
+    # Number of pieces and total area (m2) of each class (e.g. habitat) in each scenario, as Statistics_analysis SUM of Shape_Area
+    # with the class field as case field. Returns a list with one dictionary {class: (count, area)} per scenario.
+    classes = np.asarray(classes, dtype=object)[polygon_index]
+    results = [{} for i in range(num_scenarios)]
+    for scenario, value, piece_area in zip(scenario_index.tolist(), classes.tolist(), area.tolist()):
+        count, total = results[scenario].get(value, (0, 0.0))
+        results[scenario][value] = (count + 1, total + piece_area)
+    return results
+
+
+def check_scenarios():
+    # Self-check against a direct per-scenario calculation on a grid of 10 m squares with two overlapping scenarios, one of two rows
+    import shapely
+    geoms = np.array([shapely.box(x, y, x + 10, y + 10) for x in range(0, 100, 10) for y in range(0, 100, 10)], dtype=object)
+    scores = [np.arange(len(geoms), dtype=np.float64), np.array([None if i % 7 == 0 else -1.0 for i in range(len(geoms))], dtype=object)]
+    names, outlines = scenario_outlines([shapely.box(5, 5, 35, 25), shapely.box(35, 5, 45, 25), shapely.box(50, 50, 100, 100)],
+                                        ["A", "A", "B"])
+    checks = [names == ["A", "B"]]
+    values = score_matrix(scores, null_as_zero=True)
+    try:
+        score_matrix(scores, names=["Score", "Score_diff"])
+        checks.append(False)
+    except TypeError:
+        checks.append(True)
+    for clip in [True, False]:
+        scenario_index, polygon_index, area = overlay_scenarios(geoms, outlines, clip)
+        sums = area_weighted_sums(scenario_index, polygon_index, area, values, len(names))
+        totals = scenario_areas(scenario_index, area, len(names))
+        for s in range(len(names)):
+            if clip:
+                pieces = shapely.intersection(geoms, outlines[s])
+                piece_area = shapely.area(pieces)
+            else:
+                piece_area = np.where(shapely.intersects(geoms, outlines[s]), shapely.area(geoms), 0.0)
+            expected = [sum((value or 0.0) * a for value, a in zip(column.tolist(), piece_area)) / 10000 for column in scores]
+            checks.append(np.allclose(sums[s], expected) and np.isclose(totals[s], piece_area.sum() / 10000))
+    habitats = class_areas(scenario_index, polygon_index, area, ["Grass" if i % 2 else "Wood" for i in range(len(geoms))], len(names))
+    counts, totals = zip(*habitats[1].values())
+    checks.append(sum(counts) == 36 and np.isclose(sum(totals), 3600))
+    print(str(sum(checks)) + " of " + str(len(checks)) + " scenario checks passed")
+    return all(checks)
+
+
+if __name__ == "__main__":
+    if not check_scenarios():
+        exit(1)
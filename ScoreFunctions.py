@@ -0,0 +1,408 @@
+# Score functions
+# ---------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Vectorised version of the score calculations in SetUpScoreTable.py (food ALC multiplier, AONB multiplier, designation counts
+# and multipliers, recreation access, averages and maxima). The input columns are read once into numpy arrays, all the scores are
+# calculated in memory and written back in one pass (see MyFunctions.calculate_scores), instead of one CalculateField per score.
+# Nulls are held as NaN and propagate through the arithmetic, so a score is null where one of its inputs is null. max() ignores
+# nulls as in Python 2. Scores saved in Float fields are rounded to single precision before they are used by later scores,
+# as they would be when CalculateField reads them back from the table.
+# Self-check (regression test of des_mult against the DesMult code blocks for every combination of inputs): python ScoreFunctions.py,
+# which exits with status 1 if there are any differences.
+# -----------------------------------------------------------------------------------------------------------------------
+import json
+import re
+import numpy as np
+
+# Fields written by each stage, with their types, in the order used by SetUpScoreTable.py
+stage_outputs = [("food_scores", [["FoodxALC", "Float"], ["Food_ALC_norm", "Float"]]),
+                 ("aesthetic_scores", [["Aesthetic_AONB", "Float"], ["Aesthetic_norm", "Float"]]),
+                 ("other_cultural", [["NatureDesig", "SHORT"], ["CultureDesig", "SHORT"], ["EdDesig", "SHORT"],
+                                     ["Education_desig", "Float"], ["Nature_desig", "Float"], ["Sense_desig", "Float"]]),
+                 ("public_access_multiplier", [["Rec_access", "Float"]]),
+                 ("calc_averages", [["AvSoilWatReg", "Float"], ["AvCAQCoolNs", "Float"], ["Av7Reg", "Float"], ["AvPollPest", "Float"],
+                                    ["Av9Reg", "Float"], ["AvCultNoRec", "Float"], ["Av5Cult", "Float"], ["Av14RegCult", "Float"],
+                                    ["Av15WSRegCult", "Float"]]),
+                 ("calc_max", [["MaxRegCult", "Float"], ["MaxWSRegCult", "Float"], ["MaxRegCultFood", "Float"],
+                               ["MaxWSRegCultFood", "Float"]])]
+
+# Regulating and cultural services used for the maximum scores
+reg_cult_fields = ["Flood", "Erosion", "WaterQual", "Carbon", "AirQuality", "Cooling", "Noise", "Pollination", "PestControl",
+                   "Aesthetic_norm", "Education_desig", "Nature_desig", "Sense_desig", "Rec_access"]
+
+
+# DesMult CalculateField code blocks. desmult_codeblock (SetUpScoreTable.py) sets a minimum score for scheduled monuments;
+# desmult_codeblock_no_schmon (UpdateScores.py) is the earlier version without the scheduled monument minimum.
+# des_mult is the vectorised equivalent and check_des_mult compares the two.
+desmult_codeblock = """
+def DesMult(NatureDesig, CultureDesig, EdDesig, ScheduledMonument, Habitat, GreenSpace, Score, Service):
+    # GreenSpace currently not used (see notes for reasons) but could be in future
+    if Service == "SensePlace":
+        if NatureDesig is None or NatureDesig == 0:
+            if CultureDesig is None or CultureDesig == 0:
+                NumDesig = 0
+            else:
+                NumDesig = CultureDesig
+        elif CultureDesig is None or CultureDesig == 0:
+            NumDesig = NatureDesig
+        else:
+            NumDesig = NatureDesig + CultureDesig
+    elif Service == "Nature":
+        NumDesig = NatureDesig
+    elif Service == "Education":
+        NumDesig = EdDesig
+    else:
+        return Score
+
+    if NumDesig is None or NumDesig == 0:
+        NewScore = Score / 1.2
+    elif NumDesig == 1:
+        NewScore = 1.1 * Score / 1.2
+    elif NumDesig == 2:
+        NewScore = 1.15 * Score / 1.2
+    elif NumDesig >=3:
+        NewScore = 1.2 * Score / 1.2
+    else:
+        NewScore = Score
+
+    # Minimum score of 7/10 for scheduled monuments unless arable (min score 3) or sealed surface (Score =0)
+    if Service == "SensePlace" or Service == "Education":
+        if ScheduledMonument == 1 and Score > 0:
+            if Habitat == "Arable":
+                if NewScore <3:
+                    NewScore = 3
+            elif NewScore <7:
+                NewScore = 7
+ 
+    return NewScore
+"""
+
+desmult_codeblock_no_schmon = """
+def DesMult(NatureDesig, CultureDesig, EdDesig, GreenSpace, Score, Service):
+    # GreenSpace currently not used (see notes for reasons) but could be in future
+    if Service == "SensePlace":
+        if NatureDesig is None or NatureDesig == 0:
+            if CultureDesig is None or CultureDesig == 0:
+                NumDesig = 0
+            else:
+                NumDesig = CultureDesig
+        elif CultureDesig is None or CultureDesig == 0:
+            NumDesig = NatureDesig
+        else:
+            NumDesig = NatureDesig + CultureDesig
+    elif Service == "Nature":
+        NumDesig = NatureDesig
+    elif Service == "Education":
+        NumDesig = EdDesig
+    else:
+        return Score
+
+    if NumDesig is None or NumDesig == 0:
+        return Score / 1.2
+    elif NumDesig == 1:
+        return 1.1 * Score / 1.2
+    elif NumDesig == 2:
+        return 1.15 * Score / 1.2
+    elif NumDesig >=3:
+        return 1.2 * Score / 1.2
+    else:
+        return Score
+"""
+
+
+def expression_fields(expression):
+    # Field names in a CalculateField sum such as "!SAC! + !RSPB! + !SSSI!"
+    return re.findall(r"!([^!]+)!", expression)
+
+
+def stage_inputs(hab_field, nature_fields, culture_fields, education_fields, LERC_LWS=False):
+    # Input fields needed by each stage (including the outputs of earlier stages)
+    des_fields = []
+    for field in expression_fields(nature_fields) + expression_fields(culture_fields) + expression_fields(education_fields):
+        if field not in des_fields:
+            des_fields.append(field)
+    return {"food_scores": [hab_field, "Food", "ALC_mult"],
+            "aesthetic_scores": ["Aesthetic", "AONB"],
+            "other_cultural": des_fields + (["LWS_p"] if LERC_LWS else []) +
+                              ["SchMon", hab_field, "Education", "Nature", "SensePlace"],
+            "public_access_multiplier": ["Recreation", "AccessMult", "AccessType"],
+            "calc_averages": ["Flood", "Erosion", "WaterQual", "Carbon", "AirQuality", "Cooling", "Noise", "Pollination", "PestControl",
+                              "Aesthetic_norm", "Education_desig", "Nature_desig", "Sense_desig", "Rec_access", "WaterProv"],
+            "calc_max": reg_cult_fields + ["WaterProv", "Food_ALC_norm"]}
+
+
+def fields_to_read(stages, hab_field, nature_fields, culture_fields, education_fields, LERC_LWS=False):
+    # Fields to read from the table for the selected stages: the inputs of each stage that are not calculated by an earlier selected stage
+    inputs = stage_inputs(hab_field, nature_fields, culture_fields, education_fields, LERC_LWS)
+    calculated = []
+    fields = []
+    for stage, outputs in stage_outputs:
+        if stage not in stages:
+            continue
+        for field in inputs[stage]:
+            if field not in calculated and field not in fields:
+                fields.append(field)
+        calculated.extend([field for field, field_type in outputs])
+    return fields
+
+
+def fields_to_write(stages):
+    return [field for stage, outputs in stage_outputs if stage in stages for field, field_type in outputs]
+
+
+def numbers(values):
+    # Numeric array with nulls as NaN
+    values = np.asarray(values)
+    if values.dtype.kind == "O":
+        values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return values.astype(np.float64)
+
+
+def is_text(values):
+    if values.dtype.kind in "SU":
+        return True
+    return values.dtype.kind == "O" and any(isinstance(value, (str, type(u""))) for value in values)
+
+
+def single(values):
+    # Round to the precision of a Float (single) field
+    return values.astype(np.float32).astype(np.float64)
+
+
+def starts_with(values, prefixes):
+    return np.array([value is not None and value.startswith(prefixes) for value in values], dtype=bool)
+
+
+def calculate_scores(columns, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier=1.1, Max_food_mult=2.4,
+                     LERC_LWS=False):
+    # Calculate the scores for the selected stages from a dictionary of input columns (see fields_to_read). The new score columns
+    # are added to the dictionary.
+    n = len(columns[list(columns.keys())[0]]) if columns else 0
+    c = {}
+    for field, values in columns.items():
+        values = np.asarray(values)
+        if field in (hab_field, "AccessType") or is_text(values):
+            c[field] = values
+        else:
+            c[field] = numbers(values)
+
+    if "food_scores" in stages:
+        # Intensive food production habitats are multiplied by the ALC multiplier (ignore 'Arable field margins')
+        hab = c[hab_field]
+        intensive = (hab == "Arable") | starts_with(hab, ("Arable and", "Cultivated", "Improved grass", "Agric")) | (hab == "Orchard")
+        intensive = intensive & ~np.isnan(c["ALC_mult"])
+        c["FoodxALC"] = single(np.where(intensive, c["Food"] * c["ALC_mult"], c["Food"]))
+        c["Food_ALC_norm"] = single(c["FoodxALC"] / Max_food_mult)
+
+    if "aesthetic_scores" in stages:
+        c["Aesthetic_AONB"] = single(np.where(c["AONB"] == 1, c["Aesthetic"] * AONB_multiplier, c["Aesthetic"]))
+        c["Aesthetic_norm"] = single(c["Aesthetic_AONB"] / AONB_multiplier)
+
+    if "other_cultural" in stages:
+        for field, expression in [("NatureDesig", nature_fields), ("CultureDesig", culture_fields), ("EdDesig", education_fields)]:
+            total = np.zeros(n)
+            for des_field in expression_fields(expression):
+                total = total + c[des_field]
+            c[field] = total
+        if LERC_LWS:
+            LWS = c["LWS_p"] >= 0.5
+            for field in ["NatureDesig", "EdDesig"]:
+                c[field] = np.where(np.isnan(c[field]), 0, c[field]) + LWS
+        new_scores = des_mult(c["NatureDesig"], c["CultureDesig"], c["EdDesig"],
+                              dict((service, c[service]) for service in ["Education", "Nature", "SensePlace"]), c["SchMon"], c[hab_field])
+        c["Education_desig"] = single(new_scores["Education"])
+        c["Nature_desig"] = single(new_scores["Nature"])
+        c["Sense_desig"] = single(new_scores["SensePlace"])
+
+    if "public_access_multiplier" in stages:
+        rec_access = c["Recreation"] * c["AccessMult"]
+        # All habitats within path buffers have an absolute score of 7.5 out of 10 (unless sealed surface)
+        rec_access = np.where((c["AccessType"] == "Path") & (c["Recreation"] > 0), 7.5, rec_access)
+        # Nulls are set to zero (needed later for calculating scenario impact)
+        c["Rec_access"] = single(np.where(np.isnan(rec_access), 0, rec_access))
+
+    if "calc_averages" in stages:
+        c["AvSoilWatReg"] = single((c["Flood"] + c["Erosion"] + c["WaterQual"]) / 3)
+        c["AvCAQCoolNs"] = single((c["Carbon"] + c["AirQuality"] + c["Cooling"] + c["Noise"]) / 4)
+        c["Av7Reg"] = single(((c["AvSoilWatReg"] * 3) + (c["AvCAQCoolNs"] * 4)) / 7)
+        c["AvPollPest"] = single((c["Pollination"] + c["PestControl"]) / 2)
+        c["Av9Reg"] = single(((c["Av7Reg"] * 7) + (c["AvPollPest"] * 2)) / 9)
+        c["AvCultNoRec"] = single((c["Aesthetic_norm"] + c["Education_desig"] + c["Nature_desig"] + c["Sense_desig"]) / 4)
+        c["Av5Cult"] = single((c["Rec_access"] + (c["AvCultNoRec"] * 4)) / 5)
+        c["Av14RegCult"] = single(((c["Av9Reg"] * 9) + c["Av5Cult"] * 5) / 14)
+        c["Av15WSRegCult"] = single(((c["Av14RegCult"] * 14) + c["WaterProv"]) / 15)
+
+    if "calc_max" in stages:
+        # fmax ignores NaN, like max() ignores None in Python 2. MaxRegCultFood includes food production.
+        c["MaxRegCult"] = single(np.fmax.reduce([c[field] for field in reg_cult_fields]))
+        c["MaxWSRegCult"] = single(np.fmax(c["WaterProv"], c["MaxRegCult"]))
+        c["MaxRegCultFood"] = single(np.fmax(c["Food_ALC_norm"], c["MaxRegCult"]))
+        c["MaxWSRegCultFood"] = single(np.fmax(c["WaterProv"], c["MaxRegCultFood"]))
+
+    for field in fields_to_write(stages):
+        columns[field] = c[field]
+    return fields_to_write(stages)
+
+
+def des_mult(nature_desig, culture_desig, ed_desig, scores, sch_mon=None, habitat=None):
+    # Vectorised DesMult for the three services at once. scores is a dictionary of Education, Nature and SensePlace arrays and the
+    # result is a dictionary of the adjusted scores for each of them. Null designation counts count as 0 and a null score gives a
+    # null result. If sch_mon and habitat are given, the scheduled monument minimum of desmult_codeblock is applied
+    # (7/10, or 3/10 if arable, unless the score is 0), otherwise the result matches desmult_codeblock_no_schmon.
+    nature_desig = numbers(nature_desig)
+    culture_desig = numbers(culture_desig)
+    num_desig = {"SensePlace": np.nan_to_num(nature_desig) + np.nan_to_num(culture_desig),
+                 "Nature": np.nan_to_num(nature_desig),
+                 "Education": np.nan_to_num(numbers(ed_desig))}
+    if sch_mon is not None:
+        monument = numbers(sch_mon) == 1
+        arable = np.array([value == "Arable" for value in habitat], dtype=bool)
+    new_scores = {}
+    for service, score in scores.items():
+        score = numbers(score)
+        num = num_desig[service]
+        # Same operations in the same order as the code block, so the results are identical rather than just close.
+        # Other counts (negative or fractional) leave the score unchanged.
+        new_score = np.select([num == 0, num == 1, num == 2, num >= 3],
+                              [score / 1.2, 1.1 * score / 1.2, 1.15 * score / 1.2, 1.2 * score / 1.2], score)
+        if sch_mon is not None and service in ("SensePlace", "Education"):
+            floor = monument & (score > 0)
+            new_score = np.where(floor & arable & (new_score < 3), 3, new_score)
+            new_score = np.where(floor & ~arable & (new_score < 7), 7, new_score)
+        new_scores[service] = new_score
+    return new_scores
+
+
+def check_des_mult():
+    # Regression check of des_mult against the DesMult code blocks, for every combination of null, zero, whole, fractional and
+    # negative designation counts, scheduled monument flags, habitats and scores. Run this module to check (python ScoreFunctions.py).
+    import itertools
+    counts = [None, 0, 1, 2, 3, 4, 1.5, -1]
+    combinations = list(itertools.product(counts, counts, counts, [None, 0, 1], ["Arable", "Woodland", None],
+                                          [None, 0, 0.5, 2, 2.9, 5, 6.8, 9.7, 10]))
+    columns = [np.array(column, dtype=object) for column in zip(*combinations)]
+    nature_desig, culture_desig, ed_desig, sch_mon, habitat, score = columns
+    scores = dict((service, score) for service in ["Education", "Nature", "SensePlace"])
+    num_errors = 0
+    for codeblock, monuments in [(desmult_codeblock, True), (desmult_codeblock_no_schmon, False)]:
+        namespace = {}
+        exec(codeblock, namespace)
+        DesMult = namespace["DesMult"]
+        if monuments:
+            new_scores = des_mult(nature_desig, culture_desig, ed_desig, scores, sch_mon, habitat)
+        else:
+            new_scores = des_mult(nature_desig, culture_desig, ed_desig, scores)
+        for service in scores:
+            for i, row in enumerate(combinations):
+                if row[5] is None:
+                    # The code block fails on a null score (None / 1.2); des_mult leaves it null
+                    expected = np.nan
+                elif monuments:
+                    expected = DesMult(row[0], row[1], row[2], row[3], row[4], None, row[5], service)
+                else:
+                    expected = DesMult(row[0], row[1], row[2], None, row[5], service)
+                result = new_scores[service][i]
+                if not (result == expected or (np.isnan(result) and np.isnan(expected))):
+                    num_errors = num_errors + 1
+                    if num_errors <= 10:
+                        print("DesMult mismatch for " + service + " " + str(row) + ": " + str(result) + " should be " + str(expected))
+    print("Checked des_mult against DesMult for " + str(len(combinations)) + " combinations: " + str(num_errors) + " differences")
+    return num_errors == 0
+
+
+# Scores are a function of a polygon's habitat (which gives all its Matrix scores), ALC multiplier, designations, AONB, SchMon and
+# access, and there are far fewer distinct combinations of these than polygons, so calculate_distinct_scores groups the rows on
+# these categorical inputs only and calculates each combination once. The Matrix score fields are taken from the first row of each
+# group, so they must be the same for every row with the same habitat (as they are when joined from the Matrix by habitat).
+matrix_fields = ["Food", "Aesthetic", "Education", "Nature", "SensePlace", "Recreation", "WaterProv"] + reg_cult_fields[:9]
+
+
+def factorize(values):
+    # Integer code for each distinct value of an array and the number of codes. Nulls (None or NaN) all have the same code.
+    values = np.asarray(values)
+    if values.dtype.kind in "OSU":
+        items = [None if value != value else value for value in values.tolist()] if values.dtype.kind == "O" else values.tolist()
+        lookup = {}
+        for value in set(items):
+            lookup[value] = len(lookup)
+        return np.fromiter(map(lookup.__getitem__, items), dtype=np.int64, count=len(items)), max(len(lookup), 1)
+    values = values.astype(np.float64)
+    null = np.isnan(values)
+    filled = np.where(null, 0, values)
+    high = filled.max() if len(filled) else 0
+    # Small whole numbers (designation counts, flags) are their own codes
+    if len(filled) == 0 or (filled.min() >= 0 and high < 1000 and (filled == np.floor(filled)).all()):
+        return np.where(null, high + 1, filled).astype(np.int64), int(high) + 2
+    distinct, codes = np.unique(filled, return_inverse=True)
+    return codes.ravel() * 2 + null, 2 * len(distinct)
+
+
+def distinct_rows(columns, fields):
+    # Index of the first row with each distinct combination of values of the fields, and the combination number of every row.
+    # The codes of the fields are packed into one integer key, renumbered if it would overflow, and sorted once.
+    n = len(columns[fields[0]])
+    key = np.zeros(n, dtype=np.int64)
+    num_keys = 1
+    for field in fields:
+        codes, num_codes = factorize(columns[field])
+        if num_keys * num_codes >= 2 ** 62:
+            key = np.unique(key, return_inverse=True)[1].ravel()
+            num_keys = int(key.max()) + 1 if n else 1
+        key = key * num_codes + codes
+        num_keys = num_keys * num_codes
+    distinct, first, key = np.unique(key, return_index=True, return_inverse=True)
+    return first, key.ravel()
+
+
+def calculate_distinct_scores(columns, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier=1.1,
+                              Max_food_mult=2.4, LERC_LWS=False):
+    # Same as calculate_scores, but the scores are calculated once for each distinct combination of the categorical inputs and
+    # copied to all the rows with that combination. Without the habitat field the Matrix score fields are grouped on as well.
+    inputs = [field for field in fields_to_read(stages, hab_field, nature_fields, culture_fields, education_fields, LERC_LWS)
+              if field in columns]
+    key_fields = [field for field in inputs if field not in matrix_fields or hab_field not in inputs]
+    if not key_fields:
+        return calculate_scores(columns, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier,
+                                Max_food_mult, LERC_LWS)
+    first, key = distinct_rows(columns, key_fields)
+    print("      " + str(len(first)) + " distinct combinations of " + str(len(key_fields)) + " input fields in " + str(len(key)) + " rows")
+    distinct = dict((field, np.asarray(columns[field])[first]) for field in inputs)
+    out_fields = calculate_scores(distinct, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier,
+                                  Max_food_mult, LERC_LWS)
+    for field in out_fields:
+        columns[field] = distinct[field][key]
+    return out_fields
+
+# Incremental rescoring
+# ---------------------
+# The scores of a polygon depend only on its rows in the lookup tables (Matrix, ALC_multipliers, AccessMultipliers). A snapshot
+# of the lookup tables used is kept in the gdb manifest (see PipelineFunctions), so after a lookup table is edited only the polygons
+# whose habitat, ALC grade or access description refers to a changed row need to be rescored (MyFunctions.rescore_changed_lookups).
+
+def lookup_snapshot(columns, key_field, fields):
+    # {"fields": value fields, "rows": {key: [values]}} in a form that can be saved as JSON
+    rows = {}
+    values = [columns[field].tolist() for field in fields]
+    for i, key in enumerate(columns[key_field].tolist()):
+        rows[str(key)] = [column[i] for column in values]
+    return json.loads(json.dumps({"fields": fields, "rows": rows}))
+
+
+def changed_keys(old, new):
+    # Keys of rows that have been added, removed or changed between two snapshots of a lookup table. If the fields have changed,
+    # every key is returned.
+    if old is None or old["fields"] != new["fields"]:
+        return sorted(set(new["rows"]) | set(old["rows"] if old else []))
+    keys = set(old["rows"]) | set(new["rows"])
+    return sorted(key for key in keys if old["rows"].get(key) != new["rows"].get(key))
+
+
+def sql_in(field, values):
+    # SQL where clause selecting rows where field is one of the values (strings)
+    return field + " IN (" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + ")"
+
+
+if __name__ == "__main__":
+    if not check_des_mult():
+        exit(1)
@@ -7,8 +7,10 @@
 # Option to merge all LADs into a single file at the end
 #----------------------------------------------------------------------------------------------
 
-import time, arcpy, os
+import time, arcpy, os, sys
 import MyFunctions
+import ScoreFunctions
+import PipelineFunctions
 
 print(''.join(["## Started on : ", time.ctime()]))
 
@@ -156,10 +158,31 @@ other_cultural = True
 public_access_multiplier = True
 calc_averages = True
 calc_max = True
+# Calculate all the selected score stages above with one read and one write of the table (see ScoreFunctions.py),
+# instead of a CalculateField for each score
+fused_scores = True
+# With fused_scores, calculate each score once per distinct combination of habitat, ALC multiplier, designations, AONB and access
+# rather than once per polygon. About 25% faster for 2 million rows with few combinations, no faster with very many.
+distinct_scores = True
+# Incremental rescoring after editing the Matrix, ALC_multipliers or AccessMultipliers tables: only the polygons whose habitat,
+# ALC grade or access description uses a changed row are rescored. Needs a previous full run, which saves a snapshot of the
+# lookup tables in the gdb manifest. Falls back to a full run if there is no snapshot.
+incremental_rescore = False
+Access_multipliers = r"M:\urban_development_natural_capital\Public_access.gdb\AccessMultipliers"
+
+# Designation multiplier for education, interaction with nature and sense of place, used by CalculateField when fused_scores is False
+codeblock = ScoreFunctions.desmult_codeblock
+
+# Parameters can be overridden by the benchmark harness (Benchmark.py)
+PipelineFunctions.apply_overrides(globals())
+
+# If gdbs are given on the command line (e.g. by Parallel_LADs.py), process only those
+if len(sys.argv) > 1:
+    gdbs = sys.argv[1:]
 
 for gdb in gdbs:
     arcpy.env.workspace = gdb
-    numrows = arcpy.GetCount_management(os.path.join(gdb, Base_map))
+    numrows = MyFunctions.count_rows(os.path.join(gdb, Base_map))
     print (''.join(["### Started processing ", gdb, " on ", time.ctime(), ": ", str(numrows), " rows"]))
     if region == "Arc" or region == "NP" or (region == "Oxon" and method == "CROME_PHI"):
         path, file = os.path.split(gdb)
@@ -171,33 +194,51 @@ for gdb in gdbs:
 
     print ("Area is " + area_name)
     NatCap_scores = "NatCap_" + area_name.replace("-", "")
+    # Lookup tables: name, table, key field and key field in the NatCap table
+    lookup_tables = [("Matrix", Matrix, "Habitat", hab_field), ("ALC_multipliers", ALC_multipliers, "ALC_grade", "ALC_grade"),
+                     ("AccessMultipliers", Access_multipliers, "Description", "PADescription")]
+
+    if incremental_rescore:
+        print("Rescoring polygons affected by changes to the lookup tables")
+        all_stages = [stage for stage, outputs in ScoreFunctions.stage_outputs]
+        num_rescored = MyFunctions.rescore_changed_lookups(gdb, NatCap_scores, lookup_tables, all_stages, hab_field, nature_fields,
+                                                           culture_fields, education_fields, AONB_multiplier, Max_food_mult, LERC_LWS)
+        if num_rescored is not None:
+            print("## Completed " + gdb + " on " + time.ctime() + ": " + str(num_rescored) + " rows rescored")
+            continue
 
     if correct_habitats:
         AccessTable_name = "AccessMultipliers"
         AccessTable = r"M:\urban_development_natural_capital\Public_access.gdb\AccessMultipliers"
 
-        print "Correcting OMHD where there is a greenspace designation"
-        print "Allotments"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats' AND GreenSpace = 'Allotments Or Community Growing Spaces'"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Allotments, city farm, community garden'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Allotments, city farm, community garden'")
-        print "Sport and play"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats'"
-        expression = expression + " AND GreenSpace IN ('Playing Field', 'Other Sports Facility', 'Play Space', 'Tennis Court','Bowling Green')"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Natural sports facility, recreation ground or playground'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Natural sports facility, recreation ground or playground'")
-        print "Churchyards"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats' AND (GreenSpace = 'Cemetery' OR GreenSpace = 'Religious Grounds')"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Cemeteries and churchyards'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Cemeteries and churchyards'")
-        print "Golf"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats' AND GreenSpace = 'Golf Course'"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Golf course'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Golf course'")
-        print "Amenity"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats' AND GreenSpace IN ('Amenity - Residential Or Business', 'Public Park Or Garden')"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Amenity grassland'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Amenity grassland'")
+        print "Correcting OMHD where there is a greenspace designation or sealed surface"
+        # Rules are (expression, field, new value), applied in order in one pass through each table. Sealed surface used to be
+        # corrected after the public access corrections below. Moving it here does not change their results: they do not change
+        # Interpreted_habitat_temp, and their only test on it (NOT IN the arable habitats) is true both before and after this rule,
+        # which only changes 'Open mosaic habitats' to 'Sealed surface'.
+        OMHD = "Interpreted_habitat_temp = 'Open mosaic habitats'"
+        hab_rules = []
+        # Allotments
+        expression = OMHD + " AND GreenSpace = 'Allotments Or Community Growing Spaces'"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Allotments, city farm, community garden'"))
+        # Sport and play
+        expression = OMHD + " AND GreenSpace IN ('Playing Field', 'Other Sports Facility', 'Play Space', 'Tennis Court','Bowling Green')"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Natural sports facility, recreation ground or playground'"))
+        # Churchyards
+        expression = OMHD + " AND (GreenSpace = 'Cemetery' OR GreenSpace = 'Religious Grounds')"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Cemeteries and churchyards'"))
+        # Golf
+        expression = OMHD + " AND GreenSpace = 'Golf Course'"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Golf course'"))
+        # Amenity
+        expression = OMHD + " AND GreenSpace IN ('Amenity - Residential Or Business', 'Public Park Or Garden')"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Amenity grassland'"))
+        # Sealed surfaces
+        expression = OMHD + " AND Interpreted_habitat = 'Sealed surface'"
+        hab_rules.append((expression, "Interpreted_habitat_temp", "'Sealed surface'"))
+        for hab_table in ["OSMM_CR_PHI_ALC_Desig_GS", "OSMM_CR_PHI_ALC_Desig_GS_PA"]:
+            counts = MyFunctions.apply_rules(hab_table, hab_rules)
+            print "      " + hab_table + ": " + ", ".join(str(count) for count in counts) + " rows corrected"
 
         print "Correcting Public Access for new greenspace rows"
         # Green spaces (from OS green space and OS open green space) - correct for Rail in OSGS Amenity residential
@@ -232,11 +273,6 @@ for gdb in gdbs:
             arcpy.RemoveJoin_management("school_lyr", AccessTable_name)
         arcpy.Delete_management("school_lyr")
 
-        print "Correcting OMHD for sealed surfaces"
-        expression = "Interpreted_habitat_temp = 'Open mosaic habitats' AND Interpreted_habitat = 'Sealed surface'"
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS","Interpreted_habitat_temp", expression,"'Sealed surface'")
-        MyFunctions.select_and_copy("OSMM_CR_PHI_ALC_Desig_GS_PA","Interpreted_habitat_temp", expression,"'Sealed surface'")
-
         # print "Correcting natural land within PHI woodland (should be rides)"
         # Decided not to do this because sometimes PHI is correct
         # expression = "PHI = 'Deciduous woodland' AND Interpreted_habitat_temp = 'Woodland: broadleaved, semi-natural' AND OSMM_hab = 'Natural surface'"
@@ -275,12 +311,56 @@ for gdb in gdbs:
             MyFunctions.check_and_add_field(NatCap_scores,"SchMon","Short", 0)
             arcpy.CalculateField_management(NatCap_scores,"SchMon",0,"Python_9.3")
 
+    # Add all the new score fields for the selected stages in one batch, instead of one schema change per field
+    new_fields = []
+    if food_scores:
+        new_fields.extend([["FoodxALC", "Float", 0],
+                           ["Food_ALC_norm", "Float", 0]])
+    if aesthetic_scores:
+        new_fields.extend([["Aesthetic_AONB", "Float", 0],
+                           ["Aesthetic_norm", "Float", 0]])
+    if other_cultural:
+        new_fields.extend([["NatureDesig", "SHORT", 0],
+                           ["CultureDesig", "SHORT", 0],
+                           ["EdDesig", "SHORT", 0],
+                           ["Education_desig", "Float", 0],
+                           ["Nature_desig", "Float", 0],
+                           ["Sense_desig", "Float", 0]])
+    if public_access_multiplier:
+        new_fields.extend([["Rec_access", "FLOAT", 0]])
+    if calc_averages:
+        new_fields.extend([["AvSoilWatReg", "Float", 0],
+                           ["AvCAQCoolNs", "Float", 0],
+                           ["Av7Reg", "Float", 0],
+                           ["AvPollPest", "Float", 0],
+                           ["Av9Reg", "Float", 0],
+                           ["AvCultNoRec", "Float", 0],
+                           ["Av5Cult", "Float", 0],
+                           ["Av14RegCult", "Float", 0],
+                           ["Av15WSRegCult", "Float", 0]])
+    if calc_max:
+        new_fields.extend([["MaxRegCult", "FLOAT", 0],
+                           ["MaxWSRegCult", "Float", 0],
+                           ["MaxRegCultFood", "Float", 0],
+                           ["MaxWSRegCultFood", "Float", 0]])
+    MyFunctions.add_fields(NatCap_scores, new_fields)
+
+    if fused_scores:
+        print("Calculating scores")
+        if other_cultural and null_to_zero:
+            print ("Replacing nulls with zeros in designation indices, before adding")
+            MyFunctions.apply_rules(NatCap_scores, [(des_field + " IS NULL", des_field, 0) for des_field in all_des_fields])
+        stages = [stage for stage, selected in [("food_scores", food_scores), ("aesthetic_scores", aesthetic_scores),
+                                                ("other_cultural", other_cultural), ("public_access_multiplier", public_access_multiplier),
+                                                ("calc_averages", calc_averages), ("calc_max", calc_max)] if selected]
+        MyFunctions.calculate_scores(NatCap_scores, stages, hab_field, nature_fields, culture_fields, education_fields, AONB_multiplier,
+                                     Max_food_mult, LERC_LWS, distinct_scores)
+
     # Food: apply ALC multiplier
     # --------------------------
-    if food_scores:
+    if food_scores and not fused_scores:
         # Add new field and copy over basic food score (this is the default for habitats not used for intensive food production)
         print("Setting up food multiplier field")
-        MyFunctions.check_and_add_field(NatCap_scores,"FoodxALC", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores,"FoodxALC","!Food!", "PYTHON_9.3")
 
         # Select intensive food production habitats and multiply food score by ALC multiplier (ignore 'Arable field margins')
@@ -295,15 +375,13 @@ for gdb in gdbs:
 
         # Add new field and calculate normalised food score
         print("Calculating normalised food score")
-        MyFunctions.check_and_add_field(NatCap_scores,"Food_ALC_norm","Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Food_ALC_norm", "!FoodxALC!  / " + str(Max_food_mult), "PYTHON_9.3")
 
     # Aesthetic value: apply AONB multiplier
     #--------------------------------------
-    if aesthetic_scores:
+    if aesthetic_scores and not fused_scores:
         # Add new field and populate with aesthetic value score (default for habitats not in AONB)
         print("Setting up new field for adjusted aesthetic value")
-        MyFunctions.check_and_add_field(NatCap_scores, "Aesthetic_AONB", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Aesthetic_AONB", "!Aesthetic!", "PYTHON_9.3")
 
         # Select AONB areas and multiply aesthetic value score by AONB multiplier
@@ -315,12 +393,11 @@ for gdb in gdbs:
 
         # Add new field and calculate normalised aesthetic value score
         print("Calculating normalised aesthetic score")
-        MyFunctions.check_and_add_field(NatCap_scores, "Aesthetic_norm", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Aesthetic_norm", "!Aesthetic_AONB! / " + str(AONB_multiplier), "PYTHON_9.3")
 
     # Education, Interaction with Nature and Sense of Place: apply multiplier based on number of designations
     # -------------------------------------------------------------------------------------------------------
-    if other_cultural:
+    if other_cultural and not fused_scores:
         # Add new fields and populate with number of nature and cultural designations
         # Replace null values with zeros - not usually needed as all rows containing designations should not contain nulls
         if null_to_zero:
@@ -328,18 +405,12 @@ for gdb in gdbs:
             for des_field in all_des_fields:
                 MyFunctions.select_and_copy(NatCap_scores, des_field, des_field + " IS NULL", 0)
         print("Adding nature, cultural and education designation fields")
-        MyFunctions.check_and_add_field(NatCap_scores, "NatureDesig", "SHORT", 0)
         arcpy.CalculateField_management(NatCap_scores, "NatureDesig", nature_fields, "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "CultureDesig", "SHORT", 0)
         arcpy.CalculateField_management(NatCap_scores, "CultureDesig", culture_fields, "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "EdDesig", "SHORT", 0)
         arcpy.CalculateField_management(NatCap_scores, "EdDesig", education_fields, "PYTHON_9.3")
 
         # Add new fields and populate with adjusted scores
         print("Setting up new fields for adjusted education, interaction with nature and sense of place values")
-        MyFunctions.check_and_add_field(NatCap_scores, "Education_desig", "Float", 0)
-        MyFunctions.check_and_add_field(NatCap_scores, "Nature_desig", "Float", 0)
-        MyFunctions.check_and_add_field(NatCap_scores, "Sense_desig", "Float", 0)
 
         # Special case for LERC LWS - add extra designation if proportion of polygon overlapping LWS site is >0.5
         if LERC_LWS:
@@ -349,48 +420,6 @@ for gdb in gdbs:
             MyFunctions.select_and_copy(NatCap_scores, "NatureDesig","LWS_p >= 0.5", "!NatureDesig! + 1")
             MyFunctions.select_and_copy(NatCap_scores, "EdDesig","LWS_p >= 0.5", "!EdDesig! + 1")
 
-        codeblock = """
-def DesMult(NatureDesig, CultureDesig, EdDesig, ScheduledMonument, Habitat, GreenSpace, Score, Service):
-    # GreenSpace currently not used (see notes for reasons) but could be in future
-    if Service == "SensePlace":
-        if NatureDesig is None or NatureDesig == 0:
-            if CultureDesig is None or CultureDesig == 0:
-                NumDesig = 0
-            else:
-                NumDesig = CultureDesig
-        elif CultureDesig is None or CultureDesig == 0:
-            NumDesig = NatureDesig
-        else:
-            NumDesig = NatureDesig + CultureDesig
-    elif Service == "Nature":
-        NumDesig = NatureDesig
-    elif Service == "Education":
-        NumDesig = EdDesig
-    else:
-        return Score
-
-    if NumDesig is None or NumDesig == 0:
-        NewScore = Score / 1.2
-    elif NumDesig == 1:
-        NewScore = 1.1 * Score / 1.2
-    elif NumDesig == 2:
-        NewScore = 1.15 * Score / 1.2
-    elif NumDesig >=3:
-        NewScore = 1.2 * Score / 1.2
-    else:
-        NewScore = Score
-
-    # Minimum score of 7/10 for scheduled monuments unless arable (min score 3) or sealed surface (Score =0)
-    if Service == "SensePlace" or Service == "Education":
-        if ScheduledMonument == 1 and Score > 0:
-            if Habitat == "Arable":
-                if NewScore <3:
-                    NewScore = 3
-            elif NewScore <7:
-                NewScore = 7
- 
-    return NewScore
-"""
         print("Calculating education field")
         expression = 'DesMult(!NatureDesig!, !CultureDesig!, !EdDesig!, !SchMon!, !Interpreted_habitat!, !GreenSpace!, !Education!, ' \
                      '"Education" )'
@@ -403,63 +432,53 @@ def DesMult(NatureDesig, CultureDesig, EdDesig, ScheduledMonument, Habitat, Gree
                      '"SensePlace")'
         arcpy.CalculateField_management(NatCap_scores, "Sense_desig", expression, "PYTHON_9.3", codeblock)
 
-    if public_access_multiplier:
+    if public_access_multiplier and not fused_scores:
         # Add field and multiply by access indicator
         print ("Calculating recreation field with public access multiplier")
-        MyFunctions.check_and_add_field(NatCap_scores, "Rec_access", "FLOAT", 0)
         arcpy.CalculateField_management(NatCap_scores, "Rec_access", "!Recreation! * !AccessMult!", "PYTHON_9.3")
         # Set all habitats within path buffers to an absolute score of 7.5 out of 10 (unless sealed surface)
         MyFunctions.select_and_copy(NatCap_scores, "Rec_access", "AccessType = 'Path' AND Recreation > 0", 7.5)
         # Replace null values with zeros (needed later for calculating scenario impact)
         MyFunctions.select_and_copy(NatCap_scores, "Rec_access", "Rec_access IS NULL", 0)
 
-    if calc_averages:
+    if calc_averages and not fused_scores:
         print("Calculating averages")
-        MyFunctions.check_and_add_field(NatCap_scores, "AvSoilWatReg", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "AvSoilWatReg",
                                         '(!Flood! + !Erosion! + !WaterQual!)/3', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "AvCAQCoolNs", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "AvCAQCoolNs",
                                         '(!Carbon! + !AirQuality! + !Cooling! + !Noise!)/4', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "Av7Reg", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Av7Reg",
                                         '((!AvSoilWatReg! * 3) + (!AvCAQCoolNs! * 4))/7', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "AvPollPest", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "AvPollPest",
                                         '(!Pollination! + !PestControl!)/2', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "Av9Reg", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Av9Reg",
                                         '((!Av7Reg! * 7) + (!AvPollPest! * 2))/ 9', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "AvCultNoRec", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "AvCultNoRec",
                                         '(!Aesthetic_norm! + !Education_desig! + !Nature_desig! + !Sense_desig!)/4', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "Av5Cult", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Av5Cult", '(!Rec_access! + (!AvCultNoRec! * 4))/5', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "Av14RegCult", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Av14RegCult",
                                         '((!Av9Reg! * 9) + (!Av5Cult!) * 5)/14', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "Av15WSRegCult", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "Av15WSRegCult",
                                         '((!Av14RegCult! * 14)+ !WaterProv!)/15', "PYTHON_9.3")
 
-    if calc_max:
+    if calc_max and not fused_scores:
         print("Calculating maximum scores")
-        MyFunctions.check_and_add_field(NatCap_scores, "MaxRegCult", "FLOAT", 0)
         arcpy.CalculateField_management(NatCap_scores, "MaxRegCult",
                                         'max(!Flood!, !Erosion!, !WaterQual!, !Carbon!, !AirQuality!, !Cooling!, !Noise!, '
                                         '!Pollination!, !PestControl!, !Aesthetic_norm!, !Education_desig!, !Nature_desig!,'
                                         ' !Sense_desig!, !Rec_access!)', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "MaxWSRegCult", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "MaxWSRegCult",
                                         'max(!WaterProv!, !Flood!, !Erosion!, !WaterQual!, !Carbon!, !AirQuality!, !Cooling!, !Noise!, '
                                         '!Pollination!, !PestControl!, !Aesthetic_norm!, !Education_desig!, !Nature_desig!,'
                                         ' !Sense_desig!, !Rec_access!)', "PYTHON_9.3")
         # MaxRegCultFood is the max of all regulating and cultural services or food production
-        MyFunctions.check_and_add_field(NatCap_scores, "MaxRegCultFood", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "MaxRegCultFood", 'max(!Food_ALC_norm!, !MaxRegCult!)', "PYTHON_9.3")
-        MyFunctions.check_and_add_field(NatCap_scores, "MaxWSRegCultFood", "Float", 0)
         arcpy.CalculateField_management(NatCap_scores, "MaxWSRegCultFood", 'max(!WaterProv!, !MaxRegCultFood!)', "PYTHON_9.3")
 
+    if join_tables:
+        # Snapshot of the lookup tables used, for incremental rescoring
+        MyFunctions.record_lookups(gdb, lookup_tables)
+
     print("## Completed " + gdb + " on " +  time.ctime())
 
 exit()
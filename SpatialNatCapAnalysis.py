@@ -17,6 +17,8 @@
 #     e.g. for adjacent areas or multiple versions of the same area)
 # 2. Spatial_scenarios: Export for a series of sub-areas ('Scenario_features'), e.g. different development scenarios.
 #    Separate clipped feature classes will be created for each scenario and can be exported as Excel files if required (see below).
+#    With Python 3 and shapely (ArcGIS Pro), scores for all scenarios can instead be added up in memory from one overlay
+#    (in_memory_scenarios, see ScenarioFunctions.py), and the clipped feature classes are then optional.
 # 3. Select_attributes: Analyse a series of options based on sub-selecting by attribute. These will not be exported
 #    as separate feature classes, to save space and avoid cluttering up the geodatabases. The script will find all the unique values
 #    of the specified attribute and select rows matching each value each in turn. Only one input score dataset should be used.
@@ -160,7 +162,16 @@ high_nc_polygons = True
 calculate_scores = True
 
 if method == "Spatial_scenarios":
-    intersect_scenarios = True   # usually True but can turn off if done already
+    # Add up the areas, scores and habitats for all scenarios in memory, with one overlay of the score features and the scenario
+    # outlines (see ScenarioFunctions.py), instead of from clipped copies of the score features made for each scenario.
+    # Needs shapely 2.0, so Python 3 (ArcGIS Pro).
+    in_memory_scenarios = False
+    # With in_memory_scenarios, read the score features from a GeoParquet cache (see CacheFunctions.py), rewritten only when the data
+    # gdb changes, so re-running with new scenarios does not read the score features from the gdb again. Needs pyarrow.
+    cached_score_reads = False
+    # Save the score features for each scenario as feature classes in the output gdb(s)? Needed if in_memory_scenarios is False,
+    # otherwise only to keep or export them. Usually True in that case but can turn off if done already.
+    intersect_scenarios = not in_memory_scenarios
     # Do we want to clip to the exact boundary of the spatial scenarios (True), or select all polygons that intersect and therefore could
     # in theory be affected by the development (False)? Set this to True even if we are clipping but the stage has already been completed,
     # as it is needed to decide whether the intersection file name ends in "_clip" or not.
@@ -168,13 +179,15 @@ if method == "Spatial_scenarios":
     calculate_habitat_areas = True
     calc_trees = True       # Optional
     calc_lines = True       # Optional
-    export_to_excel = True  # Optional
+    export_to_excel = intersect_scenarios  # Optional: exports the clipped score features, so needs intersect_scenarios
     # Find scenario names as unique values in scenario file. This contains outlines of different spatial scenarios and
     # must have an attribute called 'Scenario' which lists the scenario names
     cursor = arcpy.da.SearchCursor(Scenario_features, "Scenario")
     scenarios = sorted({row[0] for row in cursor})
     del cursor
 else:
+    in_memory_scenarios = False
+    cached_score_reads = False
     intersect_scenarios = False
     clip_scenario_intersections = False
     if method == "Single_area":
@@ -206,6 +219,9 @@ if method == "Score_differences":
     abs_values = True
 else:
     abs_values = False
+# Count null scores as zero when adding up the scores (the number of nulls for each service is printed)? If False, a null score
+# stops the run, as it did with the per-service sums.
+null_scores_as_zero = False
 
 # Do we want to get list of services from a lookup table or hardcoded?
 service_lookup = "hardcoded"
@@ -339,6 +355,18 @@ if second_part:
         file3 = os.path.join(outdir, outfile3)
         print ("Opening output file: " + file3)
         f3 = open(file3, "w")
+        expressions = ["MaxRegCult > 5", "MaxRegCult > 7.5", "MaxRegCult > 7.5 AND Av15WSRegCult >5", "Food_ALC_norm > 7.5"]
+    else:
+        expressions = []
+
+    if in_memory_scenarios:
+        # Areas, scores, high scoring areas and habitats for every scenario from a single overlay of each score feature class
+        scenario_results = {}
+        for score_feature in Score_features:
+            print("Adding up scores in all scenarios for " + score_feature)
+            names, scenario_results[score_feature] = MyFunctions.aggregate_scenarios(
+                os.path.join(data_gdb, score_feature), Scenario_features, "Scenario", service_list, clip_scenario_intersections,
+                expressions, hab_field if calculate_habitat_areas else None, abs_values, cached_score_reads, null_scores_as_zero)
     for scenario in scenarios:
         i = i + 1
         print("Scenario " + scenario)
@@ -351,7 +379,6 @@ if second_part:
                 # Write header of service names
                 f2.writelines("Services, Area (ha), " + ", ".join(service_list))
             if high_nc_polygons:
-                expressions = ["MaxRegCult > 5", "MaxRegCult > 7.5", "MaxRegCult > 7.5 AND Av15WSRegCult >5", "Food_ALC_norm > 7.5"]
                 f3.writelines("\nHigh natural capital asset areas (ha): criteria, " + ", ".join(expressions))
 
         print("Processing " + scenario)
@@ -366,6 +393,9 @@ if second_part:
 
             if method == "Single_area":
                 sfile = score_feature
+            elif in_memory_scenarios:
+                sfile = os.path.join(data_gdb, score_feature) + " (in memory)"
+                result = scenario_results[score_feature][scenario]
             elif method == "Spatial_scenarios":
                 sfile = os.path.join(out_gdb, label + "_" + score_feature + "_intersect")
                 if clip_scenario_intersections:
@@ -381,41 +411,35 @@ if second_part:
                 print ("    Summarising habitats")
                 hab_table_name = label + "_" + score_feature + "_habitats"
                 hab_table = os.path.join(out_gdb, hab_table_name)
-                arcpy.Statistics_analysis(sfile, hab_table, [["Shape_Area", "SUM"]], hab_field)
+                if in_memory_scenarios:
+                    habitats = sorted(result["habitats"].items())
+                    MyFunctions.write_table({hab_field: [habitat for habitat, (count, area) in habitats],
+                                             "FREQUENCY": [count for habitat, (count, area) in habitats],
+                                             "SUM_Shape_Area": [area for habitat, (count, area) in habitats]},
+                                            [hab_field, "FREQUENCY", "SUM_Shape_Area"], hab_table)
+                else:
+                    arcpy.Statistics_analysis(sfile, hab_table, [["Shape_Area", "SUM"]], hab_field)
                 print ("    Exporting habitat table to Excel")
                 arcpy.TableToExcel_conversion(hab_table, os.path.join(ssdir, hab_table_name + "_" + region + ".xls"))
 
             if calculate_scores:
-                print("    Calculating area")
-                area_list = []
-                with arcpy.da.SearchCursor(sfile, ["Shape_Area"]) as cursor:
-                    for row in cursor:
-                        area_list.append(row[0])
-                # Convert from m2 to ha
-                scenario_area = sum(area_list)/10000
-                print("    Area is: " + str(scenario_area))
-                f2.writelines("\n" + scenario + " " + score_feature + ", " + str(scenario_area) + ", ")
-
-                # Work out total scores for each ecosystem service
-                result_list = []
-                for service in service_list:
+                if in_memory_scenarios:
+                    scenario_area = result["area"]
+                    result_list = result["scores"]
+                else:
+                    # Total area, and total score x area for each ecosystem service, from one read of all the service fields
+                    print("    Calculating area and total scores")
                     if method == "Score_differences":
-                        service = service + "_diff"
                         # Need to sort out absolute values for non-habitat differences - or maybe use abs as standard and post-process later?
                         # Set use of abs as a flag
-                    # Multiply score by shape area for each row, and add up total
-                    print("    Service: " + service)
-                    list = []
-                    with arcpy.da.SearchCursor(sfile, [service, "Shape_Area"]) as cursor:
-                        for row in cursor:
-                            if abs_values:
-                                list.append(abs(row[0]) * row[1])
-                            else:
-                                list.append(row[0] * row[1])
-                    # Divide by 10000 because score is per ha but areas are per m2 (added 15/9/2020; previously we did this manually afterwards)
-                    sumlist = sum(list)/10000
-                    print(service + " sum is:" + str(sumlist))
-                    result_list.append(sumlist)
+                        fields = [service + "_diff" for service in service_list]
+                    else:
+                        fields = service_list
+                    scenario_area, result_list = MyFunctions.area_weighted_sums(sfile, fields, abs_values, null_scores_as_zero)
+                    for service, sumlist in zip(fields, result_list):
+                        print(service + " sum is:" + str(sumlist))
+                print("    Area is: " + str(scenario_area))
+                f2.writelines("\n" + scenario + " " + score_feature + ", " + str(scenario_area) + ", ")
 
                 # Enter results into output table
                 print ("    Results for " + scenario + " are " + str(result_list))
@@ -423,7 +447,13 @@ if second_part:
                 result_strings = [str(res) for res in result_list]
                 f2.writelines(", ".join(result_strings))
 
-            if high_nc_polygons:
+            if high_nc_polygons and in_memory_scenarios:
+                f3.writelines("\n" + scenario + " " + score_feature)
+                for expression, sumlist in zip(expressions, result["high_nc"]):
+                    print("   " + expression + " area (ha) is: " + str(sumlist))
+                    f3.writelines(", " + str(sumlist))
+
+            elif high_nc_polygons:
                 print("    Identifying high scoring polygons")
                 f3.writelines("\n" + scenario + " " + score_feature)
                 for expression in expressions:
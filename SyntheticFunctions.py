@@ -0,0 +1,316 @@
+# Synthetic data functions
+# ------------------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Generates synthetic inputs for the merge, interpretation and scoring stages, so they can be benchmarked reproducibly without
+# licensed OSMM data: an OSMM-like base map, a Phase 1 habitat (HLU) layer digitised on it with jittered boundaries, processed
+# designations and OS open greenspace. Output layers are BackendFunctions.Layer objects (see Make_synthetic_data.py).
+# - The base map is a Voronoi tessellation of jittered grid points covering a square, with smaller polygons in towns.
+#   DescriptiveGroup, DescriptiveTerm and Make are drawn from urban or rural class frequencies; TOIDs are sequential.
+# - HLU, designation and greenspace polygons are groups of neighbouring base map polygons, dissolved and then moved by a smooth
+#   displacement field of up to 'jitter' metres. Shared boundaries move together, so each layer stays free of gaps and overlaps,
+#   but its edges are offset from the base map edges as digitised data are, which creates slivers in the merge.
+# The same scale, seed and settings always give the same data. Requires numpy and shapely 2.0 or later.
+# -------------------------------------------------------------------------------------------------------------------
+import numpy as np
+import shapely
+from BackendFunctions import Layer
+
+# Side of the square study area in metres for each named scale
+scales = {"parish": 2000, "town": 5000, "district": 20000, "county": 50000}
+
+# OSMM classes (DescriptiveGroup, DescriptiveTerm, Make) and their relative frequencies in towns and in the countryside
+urban_classes = [("Building", "", "Manmade", 35), ("General Surface", "", "Multiple", 25), ("General Surface", "", "Manmade", 12),
+                 ("Road Or Track", "", "Manmade", 12), ("Roadside", "", "Natural", 6), ("Path", "", "Manmade", 4),
+                 ("General Surface", "", "Natural", 4), ("Natural Environment", "Nonconiferous Trees", "Natural", 2)]
+rural_classes = [("General Surface", "", "Natural", 50), ("Natural Environment", "Nonconiferous Trees", "Natural", 10),
+                 ("Natural Environment", "Coniferous Trees", "Natural", 3),
+                 ("Natural Environment", "Coniferous Trees,Nonconiferous Trees", "Natural", 2),
+                 ("Natural Environment", "Rough Grassland", "Natural", 8), ("Natural Environment", "Scrub", "Natural", 3),
+                 ("Natural Environment", "Marsh", "Natural", 1), ("Inland Water", "Static Water", "Natural", 2),
+                 ("Inland Water", "Watercourse", "Natural", 2), ("Building", "", "Manmade", 4), ("Road Or Track", "", "Manmade", 6),
+                 ("Roadside", "", "Natural", 4), ("General Surface", "", "Manmade", 3), ("General Surface", "", "Multiple", 3),
+                 ("Landform", "Slope", "Natural", 1)]
+
+# Phase 1 habitats (with relative frequencies) for HLU polygons, chosen by the OSMM class of their largest base map polygon
+phase1_habitats = {"Building": [("Built-up areas", 1)], "Road Or Track": [("Built-up areas", 1)], "Path": [("Built-up areas", 1)],
+                   "Multiple": [("Gardens", 1)], "Manmade": [("Built-up areas", 1)],
+                   "Natural": [("Arable", 45), ("Improved grassland", 35), ("Semi-improved neutral grassland", 15),
+                               ("Amenity grassland", 5)],
+                   "Roadside": [("Amenity grassland", 1)],
+                   "Nonconiferous Trees": [("Broadleaved woodland - semi-natural", 2), ("Broadleaved woodland - plantation", 1)],
+                   "Coniferous Trees": [("Coniferous woodland - plantation", 1)],
+                   "Coniferous Trees,Nonconiferous Trees": [("Mixed woodland - plantation", 1)],
+                   "Rough Grassland": [("Semi-improved neutral grassland", 2), ("Unimproved neutral grassland", 1),
+                                       ("Unimproved calcareous grassland", 1)],
+                   "Scrub": [("Dense scrub", 2), ("Scattered scrub", 1)], "Marsh": [("Marsh/marshy grassland", 1)],
+                   "Static Water": [("Standing water", 1)], "Watercourse": [("Running water", 1)], "Slope": [("Improved grassland", 1)]}
+# Section 41 habitats given to a small share of semi-natural HLU polygons
+s41_habitats = {"Semi-improved neutral grassland": "Lowland meadows", "Unimproved neutral grassland": "Lowland meadows",
+                "Unimproved calcareous grassland": "Lowland calcareous grassland",
+                "Broadleaved woodland - semi-natural": "Lowland mixed deciduous woodland", "Marsh/marshy grassland": "Lowland fens"}
+
+# Designation flag fields (as in the processed designations joined to the base map) with the number of sites per 100 km2,
+# the typical site radius in metres and whether sites are rural (True) or urban. Every type whose sites fit in the area gets at
+# least one site, so that small scales still have designations of most types.
+designation_types = [("SSSI", 3, 400, True), ("SAC", 0.5, 800, True), ("NNR", 0.5, 300, True), ("LNR", 2, 200, False),
+                     ("LWS", 8, 150, True), ("AncientWood", 4, 200, True), ("CountryPk", 0.5, 400, True),
+                     ("NT", 1, 500, True), ("SchMon", 4, 60, True), ("HistPkGdn", 1, 250, True), ("MillenGn", 0.5, 100, False),
+                     ("DoorstepGn", 2, 80, False), ("LGS", 2, 80, False), ("GreenBelt", 0.3, 3000, True), ("AONB", 0.1, 8000, True)]
+
+# OS open greenspace functions with relative frequencies, and the typical site radius in metres
+greenspace_functions = [("Public Park Or Garden", 30, 150), ("Playing Field", 25, 100), ("Allotments Or Community Growing Spaces", 10, 60),
+                        ("Cemetery", 5, 80), ("Religious Grounds", 10, 30), ("Play Space", 10, 30), ("Golf Course", 3, 400),
+                        ("Other Sports Facility", 7, 60)]
+
+
+def choose(random, choices, size):
+    # Random indexes into a list of (..., weight) tuples, weighted by the last item of each tuple
+    weights = np.array([choice[-1] for choice in choices], dtype=np.float64)
+    return random.choice(len(choices), size=size, p=weights / weights.sum())
+
+
+def make_towns(random, size):
+    # Centres and radii of towns: about one town per 30 km2, at least one, covering roughly 10-15% of the area
+    num_towns = max(1, int(round(size * size / 30e6)))
+    centres = random.uniform(0, size, (num_towns, 2))
+    radii = np.minimum(random.uniform(400, 2500, num_towns), size / 4.0)
+    return centres, radii
+
+
+def urban_distance(points, centres, radii):
+    # Distance of each point inside the nearest town as a fraction of the town radius (< 1 means urban)
+    distances = np.sqrt(((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)) / radii[None, :]
+    return distances.min(axis=1)
+
+
+def jittered_grid(random, xmin, ymin, xmax, ymax, cell_size):
+    # One random point in each cell of a grid
+    xs = np.arange(xmin, xmax, cell_size)
+    ys = np.arange(ymin, ymax, cell_size)
+    x, y = np.meshgrid(xs, ys)
+    points = np.column_stack([x.ravel(), y.ravel()])
+    return points + random.uniform(0, cell_size, points.shape)
+
+
+def make_base_map(size, seed=0, rural_cell=80.0, urban_cell=25.0):
+    # OSMM-like base map covering a square of side 'size' metres. Returns the layer and the town centres and radii.
+    random = np.random.RandomState(seed)
+    centres, radii = make_towns(random, size)
+    rural = jittered_grid(random, 0, 0, size, size, rural_cell)
+    rural = rural[urban_distance(rural, centres, radii) >= 1]
+    urban = []
+    for centre, radius in zip(centres, radii):
+        points = jittered_grid(random, centre[0] - radius, centre[1] - radius, centre[0] + radius, centre[1] + radius, urban_cell)
+        inside = (np.sqrt(((points - centre) ** 2).sum(axis=1)) < radius) & (points >= 0).all(axis=1) & (points < size).all(axis=1)
+        urban.append(points[inside])
+    points = np.unique(np.vstack([rural] + urban), axis=0)
+
+    extent = shapely.box(0, 0, size, size)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points), extend_to=extent))
+    geoms = shapely.intersection(cells, extent)
+    geoms = geoms[shapely.area(geoms) > 0]
+    # Keep a reproducible order (the Voronoi output order depends on GEOS) by sorting on the centroid
+    centroids = shapely.get_coordinates(shapely.centroid(geoms))
+    order = np.lexsort((centroids[:, 0], centroids[:, 1]))
+    geoms = geoms[order]
+    centroids = centroids[order]
+
+    is_urban = urban_distance(centroids, centres, radii) < 1
+    group = np.empty(len(geoms), dtype=object)
+    term = np.empty(len(geoms), dtype=object)
+    make = np.empty(len(geoms), dtype=object)
+    for classes, rows in [(urban_classes, np.flatnonzero(is_urban)), (rural_classes, np.flatnonzero(~is_urban))]:
+        chosen = choose(random, classes, len(rows))
+        for i, row in zip(chosen, rows):
+            group[row], term[row], make[row] = classes[i][:3]
+    toid = np.array(["osgb" + str(1000000000000000 + i) for i in range(len(geoms))], dtype=object)
+    # No Shape_Area column: the file gdb adds its own when the layer is copied in
+    columns = {"TOID": toid, "DescriptiveGroup": group, "DescriptiveTerm": term, "Make": make}
+    layer = Layer(geoms, columns, ["TOID", "DescriptiveGroup", "DescriptiveTerm", "Make"])
+    return layer, centres, radii
+
+
+def displace(geoms, jitter, seed):
+    # Moves every vertex by a smooth random displacement field of up to about 'jitter' metres. Vertices at the same place move
+    # by the same amount, so shared boundaries stay shared. Invalid results (rare, where polygons are narrower than the jitter)
+    # are repaired with make_valid.
+    if jitter <= 0:
+        return geoms
+    random = np.random.RandomState(seed)
+    # Sum of a few plane waves per axis with wavelengths of 50-500 m
+    waves = [(random.uniform(0, 2 * np.pi), 2 * np.pi / random.uniform(50, 500), random.uniform(0, 2 * np.pi)) for i in range(6)]
+    coords = shapely.get_coordinates(geoms)
+    offsets = np.zeros(coords.shape)
+    for i, (direction, frequency, phase) in enumerate(waves):
+        along = coords[:, 0] * np.cos(direction) + coords[:, 1] * np.sin(direction)
+        offsets[:, i % 2] = offsets[:, i % 2] + np.sin(along * frequency + phase)
+    offsets = offsets * jitter / 3.0
+    geoms = shapely.set_coordinates(np.array(geoms, dtype=object), coords + offsets)
+    invalid = ~shapely.is_valid(geoms)
+    geoms[invalid] = shapely.make_valid(geoms[invalid])
+    return geoms
+
+
+def centroid_tree(geoms):
+    # Centroid coordinates of the base map polygons and an STRtree of the centroids, for group_neighbours
+    centroids = shapely.centroid(geoms)
+    return shapely.get_coordinates(centroids), shapely.STRtree(centroids)
+
+
+def group_neighbours(centroids, tree, seeds, radii):
+    # Group index of each base map polygon whose centroid is within radii[i] of seeds[i] (-1 if none). Where circles overlap the
+    # nearest seed in radius units wins.
+    group = np.full(len(centroids), -1, dtype=np.int64)
+    seed_index, geom_index = tree.query(shapely.points(seeds), predicate="dwithin", distance=radii)
+    distance = np.sqrt(((centroids[geom_index] - seeds[seed_index]) ** 2).sum(axis=1)) / radii[seed_index]
+    # Sort by polygon then distance and keep the first seed for each polygon
+    order = np.lexsort((distance, geom_index))
+    first = order[np.r_[True, geom_index[order][1:] != geom_index[order][:-1]]] if len(order) > 0 else order
+    group[geom_index[first]] = seed_index[first]
+    return group
+
+
+def dissolve_groups(geoms, group):
+    # Union of the geometries in each group (ignoring -1). Returns the group numbers and geometries.
+    rows = np.flatnonzero(group >= 0)
+    order = rows[np.argsort(group[rows], kind="stable")]
+    if len(order) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=object)
+    starts = np.flatnonzero(np.r_[True, group[order][1:] != group[order][:-1]])
+    stops = np.r_[starts[1:], len(order)]
+    groups = group[order][starts]
+    # The base map polygons share edges exactly, so the faster coverage union can be used
+    dissolved = np.array([shapely.coverage_union_all(geoms[order[start:stop]]) for start, stop in zip(starts, stops)], dtype=object)
+    return groups, dissolved
+
+
+def make_hlu(base_map, seed=0, cell_size=250.0, jitter=2.0):
+    # Phase 1 habitat polygons covering the whole area: groups of base map polygons around seeds about cell_size apart, each
+    # given a Phase 1 habitat from the OSMM class of its largest polygon, with boundaries offset by up to 'jitter' metres
+    random = np.random.RandomState(seed + 1)
+    size = shapely.bounds(base_map.geoms)[:, 2:].max()
+    seeds = jittered_grid(random, 0, 0, size, size, cell_size)
+    # A radius bigger than the seed spacing so every base map polygon is in a group
+    centroids, tree = centroid_tree(base_map.geoms)
+    group = group_neighbours(centroids, tree, seeds, np.full(len(seeds), cell_size * 1.5))
+    groups, geoms = dissolve_groups(base_map.geoms, group)
+    area = shapely.area(base_map.geoms)
+
+    # Habitat of the largest base map polygon in each group
+    rows = np.flatnonzero(group >= 0)
+    order = rows[np.lexsort((-area[rows], group[rows]))]
+    first = order[np.r_[True, group[order][1:] != group[order][:-1]]]
+    habitats = []
+    s41 = []
+    for row in first:
+        key = base_map.columns["DescriptiveTerm"][row] or base_map.columns["DescriptiveGroup"][row]
+        if key not in phase1_habitats:
+            key = base_map.columns["Make"][row]
+        if base_map.columns["DescriptiveGroup"][row] in ("Building", "Road Or Track", "Path", "Roadside"):
+            key = base_map.columns["DescriptiveGroup"][row]
+        choices = phase1_habitats[key]
+        habitat = choices[choose(random, choices, 1)[0]][0]
+        habitats.append(habitat)
+        s41.append(s41_habitats[habitat] if habitat in s41_habitats and random.uniform() < 0.3 else "")
+    num_hlu = len(geoms)
+    columns = {"POLYID": np.arange(1, num_hlu + 1), "PHASE1HAB": np.array(habitats, dtype=object),
+               "S41HABITAT": np.array(s41, dtype=object), "S41HAB2": np.array([""] * num_hlu, dtype=object),
+               "SITEREF": np.array([""] * num_hlu, dtype=object), "COPYRIGHT": np.array(["Synthetic"] * num_hlu, dtype=object),
+               "VERSION": np.array(["1"] * num_hlu, dtype=object)}
+    fields = ["POLYID", "PHASE1HAB", "S41HABITAT", "S41HAB2", "SITEREF", "COPYRIGHT", "VERSION"]
+    return Layer(displace(geoms, jitter, seed + 1), columns, fields, crs=base_map.crs)
+
+
+def make_designations(base_map, centres, radii, seed=0, jitter=2.0):
+    # Non-overlapping designation polygons with Type, Name and a 0 / 1 flag field for each designation type. Sites are groups of base map
+    # polygons around random centres (in the countryside or in towns according to the type); where sites of different types
+    # overlap, the polygons carry both flags.
+    random = np.random.RandomState(seed + 2)
+    size = shapely.bounds(base_map.geoms)[:, 2:].max()
+    centroids, tree = centroid_tree(base_map.geoms)
+    is_urban = urban_distance(centroids, centres, radii) < 1
+    names = [designation[0] for designation in designation_types]
+    flags = np.zeros((len(base_map.geoms), len(names)), dtype=np.int16)
+    for j, (name, density, radius, rural) in enumerate(designation_types):
+        num_sites = random.poisson(density * size * size / 1e8)
+        if 2 * radius < size:
+            num_sites = max(1, num_sites)
+        if num_sites == 0:
+            continue
+        # Site centres are base map polygons of the right kind (rural or urban)
+        candidates = np.flatnonzero(is_urban != rural)
+        if len(candidates) == 0:
+            continue
+        seeds = centroids[random.choice(candidates, num_sites)]
+        site_radii = radius * random.uniform(0.5, 1.5, num_sites)
+        flags[group_neighbours(centroids, tree, seeds, site_radii) >= 0, j] = 1
+
+    # One group per distinct combination of flags
+    designated = flags.any(axis=1)
+    combinations, group = np.unique(flags, axis=0, return_inverse=True)
+    group = np.where(designated, group.ravel(), -1)
+    groups, geoms = dissolve_groups(base_map.geoms, group)
+    columns = dict((name, combinations[groups, j]) for j, name in enumerate(names))
+    # Type and Name (used as the key fields when merging designations into the base map): the first designation type flagged
+    types = [names[int(np.argmax(combinations[group_number]))] for group_number in groups]
+    columns["Type"] = np.array(types, dtype=object)
+    columns["Name"] = np.array([types[i] + " " + str(i + 1) for i in range(len(groups))], dtype=object)
+    return Layer(displace(geoms, jitter, seed + 2), columns, ["Type", "Name"] + names, crs=base_map.crs)
+
+
+def make_greenspace(base_map, centres, radii, seed=0, jitter=2.0):
+    # OS open greenspace sites (GSID, function, distName1) made of base map polygons, mostly in and near towns
+    random = np.random.RandomState(seed + 3)
+    centroids, tree = centroid_tree(base_map.geoms)
+    near_town = np.flatnonzero(urban_distance(centroids, centres, radii) < 1.3)
+    # About one site per 10 ha of town
+    num_sites = max(1, int(np.pi * (radii ** 2).sum() / 1e5))
+    functions = choose(random, greenspace_functions, num_sites)
+    seeds = centroids[random.choice(near_town, num_sites)]
+    site_radii = np.array([greenspace_functions[i][2] for i in functions]) * random.uniform(0.5, 1.5, num_sites)
+    group = group_neighbours(centroids, tree, seeds, site_radii)
+    groups, geoms = dissolve_groups(base_map.geoms, group)
+    num_gs = len(groups)
+    columns = {"GSID": np.array(["GS" + str(i + 1).zfill(8) for i in groups], dtype=object),
+               "function": np.array([greenspace_functions[functions[i]][0] for i in groups], dtype=object),
+               "distName1": np.array(["Site " + str(i + 1) for i in groups], dtype=object)}
+    return Layer(displace(geoms, jitter, seed + 3), columns, ["GSID", "function", "distName1"], crs=base_map.crs)
+
+
+def make_dataset(scale="parish", seed=0, jitter=2.0, crs="EPSG:27700"):
+    # All the synthetic layers for a named scale (or a side length in metres), as a dictionary of layer name: Layer
+    size = scales[scale] if scale in scales else float(scale)
+    base_map, centres, radii = make_base_map(size, seed)
+    base_map.crs = crs
+    return {"OSMM": base_map, "HLU": make_hlu(base_map, seed, jitter=jitter),
+            "Designations": make_designations(base_map, centres, radii, seed, jitter),
+            "OS_openGS": make_greenspace(base_map, centres, radii, seed, jitter)}
+
+
+def describe_dataset(layers):
+    # Number of polygons and total area of each layer, for the benchmark report
+    lines = []
+    for name in sorted(layers):
+        layer = layers[name]
+        lines.append(name + ": " + str(layer.count()) + " polygons, " + str(round(shapely.area(layer.geoms).sum() / 1e4, 1)) + " ha")
+    return "\n".join(lines)
+
+
+def check_dataset(scale="parish", seeds=(0, 1, 2, 3)):
+    # Self-check that every layer has polygons at the given scale for each seed
+    checks = []
+    for seed in seeds:
+        layers = make_dataset(scale, seed)
+        for name in sorted(layers):
+            checks.append(layers[name].count() > 0)
+            if not checks[-1]:
+                print("   " + name + " is empty at scale " + str(scale) + " with seed " + str(seed))
+    print(str(sum(checks)) + " of " + str(len(checks)) + " synthetic layer checks passed")
+    return all(checks)
+
+
+if __name__ == "__main__":
+    print(describe_dataset(make_dataset("parish")))
+    if not check_dataset():
+        exit(1)
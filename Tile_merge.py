@@ -0,0 +1,151 @@
+# Tiled version of Merge_into_Base_Map_V5b.py for county-scale inputs (e.g. merge_type = "Oxon_OSMM_HLU"), where running the
+# whole county as one gdb is slow and Union can fail with exit codes.
+# -----------------------------------------------------------------------------------------------------------------------
+# 1. Each base map polygon is given a home tile (the tile containing its label point, read with a cursor) and its original ID.
+# 2. For each tile, a tile gdb is made with the base map polygons within 'overlap' of the tile, and all the new features that
+#    intersect them, so polygons near the tile edges see all their neighbours.
+# 3. Merge_into_Base_Map_V5b.py is run on the tile gdbs in parallel (see Parallel_LADs.py), keeping the tile fields through the
+#    attribute re-join (keep_fields).
+# 4. The merged tiles are stitched back together keeping only the rows from each polygon's home tile, so polygons crossing
+#    tile edges are handled once. The base and new feature IDs are reset to the original IDs.
+# Peak memory of each merge is set by the tile size rather than the county size.
+# -----------------------------------------------------------------------------------------------------------------------
+# BEFORE RUNNING THIS SCRIPT
+# Set merge_type and the stage flags in Merge_into_Base_Map_V5b.py as for an untiled run. Feature class names in that
+# parameter block must be names within the gdb (not full paths), and clip_new should be False.
+# -----------------------------------------------------------------------------------------------------------------------
+import json
+import os
+import time
+import arcpy
+import MyFunctions
+import MergeFunctions
+import PipelineFunctions
+
+arcpy.env.overwriteOutput = True
+
+# Parameters - these must match the parameter block selected in Merge_into_Base_Map_V5b.py
+gdb = r"D:\cenv0389\Oxon_GIS\Oxon_county\Data\Merge_OSMM_HLU_CR_ALC.gdb"
+Base_map_name = "OSMM_noLandform"
+New_features = "HLU_preprocessed"
+Output_fc = "OSMM_HLU"
+base_ID = "OSMM_OBJID"
+new_ID = "HLU_OBJID"
+# Tile size and overlap in metres, folder for the tile gdbs and number of tiles to merge at once
+tile_size = 10000
+overlap = 200
+tile_folder = r"D:\cenv0389\Oxon_GIS\Oxon_county\Data\Tiles"
+num_workers = 6
+merge_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Merge_into_Base_Map_V5b.py")
+
+# Which stages to run
+make_tile_gdbs = True
+merge_tiles = True
+stitch_tiles = True
+
+if __name__ == "__main__":
+    print(''.join(["## Started on : ", time.ctime()]))
+    arcpy.env.workspace = gdb
+    if not os.path.exists(tile_folder):
+        os.makedirs(tile_folder)
+
+    extent = arcpy.Describe(Base_map_name).extent
+    num_columns, num_rows, tiles = MergeFunctions.make_tiles(extent.XMin, extent.YMin, extent.XMax, extent.YMax, tile_size)
+    num_tiles = num_columns * num_rows
+    tile_gdbs = [os.path.join(tile_folder, "Tile_" + str(i) + ".gdb") for i in range(num_tiles)]
+
+    if make_tile_gdbs:
+        print("Saving original IDs and home tiles for " + str(num_tiles) + " tiles")
+        MyFunctions.check_and_add_field(New_features, "Orig_new_ID", "LONG", 0)
+        arcpy.CalculateField_management(New_features, "Orig_new_ID", "!OBJECTID!", "PYTHON_9.3")
+        MyFunctions.check_and_add_field(Base_map_name, "Orig_base_ID", "LONG", 0)
+        MyFunctions.check_and_add_field(Base_map_name, "Home_tile", "LONG", 0)
+        # Only the label points are held in memory, not the polygons
+        OIDs = []
+        xs = []
+        ys = []
+        with arcpy.da.SearchCursor(Base_map_name, ["OID@", "SHAPE@"]) as cursor:
+            for row in cursor:
+                OIDs.append(row[0])
+                xs.append(row[1].labelPoint.X)
+                ys.append(row[1].labelPoint.Y)
+        home = dict(zip(OIDs, MergeFunctions.home_tiles(xs, ys, extent.XMin, extent.YMin, tile_size, num_columns, num_rows).tolist()))
+        del OIDs, xs, ys
+        with arcpy.da.UpdateCursor(Base_map_name, ["OID@", "Orig_base_ID", "Home_tile"]) as cursor:
+            for row in cursor:
+                row[1] = row[0]
+                row[2] = home[row[0]]
+                cursor.updateRow(row)
+
+        # Feature class of tile outlines, used to select the polygons for each tile
+        spatial_reference = arcpy.Describe(Base_map_name).spatialReference
+        arcpy.CreateFeatureclass_management(gdb, "Tiles", "POLYGON", spatial_reference=spatial_reference)
+        MyFunctions.check_and_add_field("Tiles", "Tile_ID", "LONG", 0)
+        with arcpy.da.InsertCursor("Tiles", ["SHAPE@", "Tile_ID"]) as cursor:
+            for i in range(num_tiles):
+                xmin, ymin, xmax, ymax = [float(bound[i]) for bound in tiles]
+                corners = arcpy.Array([arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax), arcpy.Point(xmax, ymax), arcpy.Point(xmax, ymin)])
+                cursor.insertRow([arcpy.Polygon(corners, spatial_reference), i])
+
+        arcpy.MakeFeatureLayer_management(Base_map_name, "base_lyr")
+        arcpy.MakeFeatureLayer_management(New_features, "new_lyr")
+        for i in range(num_tiles):
+            arcpy.MakeFeatureLayer_management("Tiles", "tile_lyr", "Tile_ID = " + str(i))
+            arcpy.SelectLayerByLocation_management("base_lyr", "WITHIN_A_DISTANCE", "tile_lyr", str(overlap) + " Meters")
+            numrows = int(arcpy.GetCount_management("base_lyr").getOutput(0))
+            if numrows == 0:
+                tile_gdbs[i] = None
+                arcpy.Delete_management("tile_lyr")
+                continue
+            print("   Tile " + str(i) + ": " + str(numrows) + " base map polygons")
+            arcpy.CreateFileGDB_management(tile_folder, os.path.basename(tile_gdbs[i]))
+            arcpy.CopyFeatures_management("base_lyr", os.path.join(tile_gdbs[i], Base_map_name))
+            arcpy.SelectLayerByLocation_management("new_lyr", "INTERSECT", os.path.join(tile_gdbs[i], Base_map_name))
+            arcpy.CopyFeatures_management("new_lyr", os.path.join(tile_gdbs[i], New_features))
+            arcpy.Delete_management("tile_lyr")
+        arcpy.Delete_management("base_lyr")
+        arcpy.Delete_management("new_lyr")
+        print(''.join(["## Tile gdbs created on : ", time.ctime()]))
+
+    tile_gdbs = [tile_gdb for tile_gdb in tile_gdbs if tile_gdb is not None and arcpy.Exists(tile_gdb)]
+
+    if merge_tiles:
+        # The re-join of new attributes in the merge keeps only the fields it needs: keep the tile fields as well, or the re-joined rows
+        # lose their home tile and are dropped when stitching. The original new feature ID comes back with the join to New_snap_clean.
+        os.environ["NATCAP_OVERRIDES"] = json.dumps({"keep_fields": ["Home_tile", "Orig_base_ID"]})
+        results = PipelineFunctions.run_parallel(merge_script, tile_gdbs, num_workers, os.path.join(tile_folder, "logs"))
+        report = PipelineFunctions.failure_report(results)
+        print(report)
+        if any(result[1] != 0 for result in results):
+            print("Some tiles failed. Rerun them (set make_tile_gdbs to False) before stitching.")
+            exit(1)
+
+    if stitch_tiles:
+        print("Stitching " + str(len(tile_gdbs)) + " tiles")
+        tile_layers = []
+        new_IDs = {}
+        for i, tile_gdb in enumerate(tile_gdbs):
+            tile_ID = int(os.path.splitext(os.path.basename(tile_gdb))[0].split("_")[1])
+            # Keep only the polygons whose home is this tile
+            arcpy.MakeFeatureLayer_management(os.path.join(tile_gdb, Output_fc), "stitch_lyr" + str(i), "Home_tile = " + str(tile_ID))
+            tile_layers.append("stitch_lyr" + str(i))
+            # Original ID of each new feature in this tile
+            with arcpy.da.SearchCursor(os.path.join(tile_gdb, "New_snap_clean"), [new_ID, "Orig_new_ID"]) as cursor:
+                for row in cursor:
+                    new_IDs[(tile_ID, row[0])] = row[1]
+        arcpy.Merge_management(tile_layers, Output_fc + "_tiled")
+        for tile_layer in tile_layers:
+            arcpy.Delete_management(tile_layer)
+
+        # IDs in the tile gdbs are tile object IDs: reset them to the original IDs so they match the untiled inputs
+        print("Resetting base map and new feature IDs")
+        with arcpy.da.UpdateCursor(Output_fc + "_tiled", [base_ID, "Orig_base_ID", new_ID, "Home_tile"]) as cursor:
+            for row in cursor:
+                row[0] = row[1]
+                if row[2] is not None and row[2] != 0:
+                    row[2] = new_IDs.get((row[3], row[2]), row[2])
+                cursor.updateRow(row)
+        MyFunctions.check_and_repair(Output_fc + "_tiled")
+        print("Stitched output is " + Output_fc + "_tiled with " + str(arcpy.GetCount_management(Output_fc + "_tiled")) + " rows")
+
+    print(''.join(["## Completed on : ", time.ctime()]))
@@ -0,0 +1,154 @@
+# Timing functions
+# ----------------
+# These functions are research tools and have not been rigorously tested for wider use.
+# -------------------------------------------------------------------------------------
+# Structured timing log for the per-LAD scripts. Each timed step (a pipeline stage or a single arcpy call) is written as one JSON
+# line to <gdb>_timings.jsonl next to the gdb, with its duration, the row counts of its input and output datasets and the gdb size
+# after it, so runs over many LADs can be aggregated. timing_report ranks the slowest steps in each gdb and over all gdbs.
+# Row counts are made with a count_rows function passed in (MyFunctions.step_log passes an arcpy one), so this does not import arcpy.
+#
+# Usage in a script:
+#     log = MyFunctions.step_log(gdb, "Merge_into_Base_Map_V5b")
+#     with log.step("tabulate_intersections", inputs=[Base_map, "New_snap_clean"], outputs=["Base_TI"]):
+#         ...
+#     log.call(arcpy.Union_analysis, [Base_map, New_features], "Joint", outputs=["Joint"])
+# or log.start(name, inputs, outputs) ... log.finish(name) where a stage does not fit in one block.
+# -------------------------------------------------------------------------------------------------------------------
+import json
+import os
+import time
+import BenchmarkFunctions
+
+
+def log_path(gdb):
+    return os.path.splitext(gdb.rstrip("\\/"))[0] + "_timings.jsonl"
+
+
+class StepLog(object):
+    # Timing log for one run of a script on one gdb
+
+    def __init__(self, gdb, script=None, count_rows=None, path=None):
+        self.gdb = gdb
+        self.script = script
+        self.count_rows = count_rows
+        self.path = path or log_path(gdb)
+        self.run = time.strftime("%Y%m%d_%H%M%S")
+        self.open_steps = {}
+        self.last_step = None
+
+    def counts(self, datasets):
+        counts = {}
+        if self.count_rows is not None:
+            for dataset in datasets:
+                try:
+                    counts[dataset] = self.count_rows(dataset)
+                except Exception:
+                    counts[dataset] = None
+        return counts
+
+    def start(self, name, inputs=(), outputs=()):
+        self.open_steps[name] = (time.time(), self.counts(inputs), list(outputs))
+
+    def finish(self, name, status="ok"):
+        # Steps started together (e.g. stages checked before either runs) are timed from the end of the previous step, so the
+        # time is not counted twice. Steps nested inside another step (started after it) are not affected.
+        # A step that was never started (e.g. a stage whose check was skipped) is timed from the end of the previous step
+        started, rows_in, outputs = self.open_steps.pop(name, (None, {}, []))
+        if started is None:
+            started = self.last_step[1] if self.last_step is not None else time.time()
+        opened = started
+        if self.last_step is not None and self.last_step[0] <= started < self.last_step[1]:
+            started = self.last_step[1]
+        finished = time.time()
+        self.last_step = (opened, finished)
+        record = {"gdb": self.gdb, "script": self.script, "run": self.run, "step": name, "status": status,
+                  "started": time.ctime(started), "seconds": round(finished - started, 2), "rows_in": rows_in,
+                  "rows_out": self.counts(outputs), "gdb_mb": round(BenchmarkFunctions.folder_size(self.gdb) / 1048576.0, 1)}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+        print("      " + name + " " + status + " in " + str(record["seconds"]) + " s" +
+              "".join(", " + dataset + ": " + str(count) + " rows" for dataset, count in sorted(record["rows_out"].items())))
+        return record
+
+    def fail(self):
+        # Record any steps still open (e.g. after an exception) as failed
+        for name in list(self.open_steps.keys()):
+            self.finish(name, "failed")
+
+    def step(self, name, inputs=(), outputs=()):
+        return TimedStep(self, name, inputs, outputs)
+
+    def call(self, function, *args, **kwargs):
+        # Time one call, e.g. log.call(arcpy.Clip_analysis, "OSMM", "boundary", "OSMM_clip", outputs=["OSMM_clip"]).
+        # The step is named after the function unless step_name is given.
+        name = kwargs.pop("step_name", getattr(function, "__name__", str(function)))
+        inputs = kwargs.pop("inputs", ())
+        outputs = kwargs.pop("outputs", ())
+        with self.step(name, inputs, outputs):
+            return function(*args, **kwargs)
+
+
+class TimedStep(object):
+    # Context manager for StepLog.step: the step is recorded as failed if the block raises an exception
+
+    def __init__(self, log, name, inputs, outputs):
+        self.log = log
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def __enter__(self):
+        self.log.start(self.name, self.inputs, self.outputs)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.log.finish(self.name, "ok" if exc_type is None else "failed")
+        return False
+
+
+def read_log(path, latest_run=True):
+    # Records from a timing log, by default only those from the latest run of each script
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    if latest_run:
+        latest = {}
+        for record in records:
+            latest[record["script"]] = max(latest.get(record["script"], ""), record["run"])
+        records = [record for record in records if record["run"] == latest[record["script"]]]
+    return records
+
+
+def timing_report(gdbs, num_steps=10):
+    # Report of the slowest steps of the latest run in each gdb, and the steps with the most time over all gdbs.
+    # Times of steps nested inside other steps (e.g. single calls within a stage) are also included in the outer step.
+    lines = []
+    totals = {}
+    for gdb in gdbs:
+        records = read_log(log_path(gdb))
+        if not records:
+            continue
+        total = sum(record["seconds"] for record in records)
+        lines.append("")
+        lines.append(os.path.basename(gdb.rstrip("\\/")) + ": " + str(round(total, 1)) + " s in " + str(len(records)) + " steps")
+        for record in sorted(records, key=lambda record: -record["seconds"])[:num_steps]:
+            share = record["seconds"] * 100.0 / total if total > 0 else 0
+            lines.append("   " + str(round(record["seconds"], 1)).rjust(9) + " s " + str(int(round(share))).rjust(3) + "%  "
+                         + record["script"] + ": " + record["step"] + ("" if record["status"] == "ok" else " (" + record["status"] + ")"))
+        for record in records:
+            key = (record["script"], record["step"])
+            seconds, count, slowest = totals.get(key, (0.0, 0, (-1.0, gdb)))
+            if record["seconds"] > slowest[0]:
+                slowest = (record["seconds"], gdb)
+            totals[key] = (seconds + record["seconds"], count + 1, slowest)
+    if not totals:
+        return "No timing logs found"
+    summary = ["Slowest steps over " + str(len(gdbs)) + " gdbs (total s, number of gdbs, slowest gdb):"]
+    for key, (seconds, count, slowest) in sorted(totals.items(), key=lambda item: -item[1][0])[:num_steps]:
+        summary.append("   " + str(round(seconds, 1)).rjust(9) + " s " + str(count).rjust(4) + "  " + key[0] + ": " + key[1]
+                       + " (slowest " + os.path.basename(slowest[1].rstrip("\\/")) + ", " + str(round(slowest[0], 1)) + " s)")
+    return "\n".join(summary + lines)